@@ -2,6 +2,7 @@ from pathlib import Path
 
 UNIVERSAL_FINAL_FOLDER = Path('calyapo/data/final')
 UNIVERSAL_PENULTIMATE_FOLDER = Path('calyapo/data/penultimate')
+UNIVERSAL_STAGE_CACHE_PATH = Path('calyapo/data/stage_cache.json')
 UNIVERSAL_RANDOM_SEED = 42
 UNIVERSAL_NA_FILLER = "not available"
 DATA_PATHS = {
@@ -1,7 +1,10 @@
 
-from typing import List, Dict, Any, Union, Iterable
+from typing import List, Dict, Any, Union, Iterable, Tuple, Sequence
+from types import MappingProxyType
+from collections.abc import Mapping
 import string
 import json
+import sys
 from pathlib import Path
 import pandas as pd
 from collections import defaultdict
@@ -184,18 +187,20 @@ class Individual:
         self.na_filler = na_filler
         
         # setting up question text and variable mappers NOT invariant across time
-        self.dataset_maps = ALL_DATA_MAPS[dataset_name].get(time_period)
-        self.label2qes = self.dataset_maps.get('label2qes', {})
-        self.label2opt = self.dataset_maps.get('label2opt', {})
-        self.var2label = self.dataset_maps.get('var2label', {})
-        self.label2var = {v: k for k, v in self.var2label.items()} # label2var = {'age': 'Q21', 'ideology': 'Q27'}
-        self.opt_decoders = self._get_dataset_decoders() # opt_decoders = { 'partyid': {1: 'Democrat', ...}, 'age': {1: '18-29', ...} }
+        # shared read-only references compiled once per dataset/time period by the codebook registry
+        self.codebook = CODEBOOK_REGISTRY.get(dataset_name, time_period)
+        self.label2qes = self.codebook.label2qes
+        self.label2opt = self.codebook.label2opt
+        self.var2label = self.codebook.var2label
+        self.label2var = self.codebook.label2var # label2var = {'age': 'Q21', 'ideology': 'Q27'}
+        self.opt_decoders = self.codebook.opt_decoders # opt_decoders = { 'partyid': {1: 'Democrat', ...}, 'age': {1: '18-29', ...} }
     
     # ---------------
     # PRIVATE METHODS
     # ---------------
 
-    def _invert_mapping(self, opt_map: Dict[str, Any]) -> Dict[int, str]:
+    @staticmethod
+    def _invert_mapping(opt_map: Dict[str, Any]) -> Dict[int, str]:
         """
         Inverts the mapping schema from {Text: Code} to {Code: Text} for lookup.
         Returns {<raw encoding> : < codebook option text>} 
@@ -210,46 +215,9 @@ class Individual:
                 inverted[code] = label
         return inverted
     
-    def _get_dataset_decoders(self) -> Dict[str, Dict[int, str]]:
-        """
-        Generates a dictionary of decoders for a specific dataset.
-        Returns: {<variable_label> : <inverted mapping>}
-        - eg. { 'partyid': {1: 'Democrat', ...}, 'age': {1: '18-29', ...} }
-        """
-        decoders = {}
-        for variable_label, mapping in self.label2opt.items():
-            if mapping: # only invert if mapping exists
-                decoders[variable_label] = self._invert_mapping(mapping)
-            
-        return decoders
-    
     def _process_response(self, variable_label: str, raw_val: Any):
         """Helper to decode a raw value into text."""
-        raw_str = str(raw_val).strip()
-
-        # if self.time_period == '20240819':
-        #     print(f"raw val: ", raw_str)
-        #     print(f"var label: ", variable_label)
-        #     print(f"decoder: ", self.opt_decoders)
-
-        #     print("label existence: ", variable_label in self.opt_decoders)
-        #     print("raw value existence: ", raw_str in self.opt_decoders[variable_label])
-
-        if variable_label in self.opt_decoders and raw_str in self.opt_decoders[variable_label]:
-            return self.opt_decoders[variable_label][raw_str]
-        
-        try:
-            raw_int = int(float(raw_str)) # Handle "1.0" -> 1
-            normalized_str = str(int(float(raw_str))) 
-        
-            if variable_label in self.opt_decoders and normalized_str in self.opt_decoders[variable_label]:
-                return self.opt_decoders[variable_label][normalized_str]
-        except ValueError:
-            pass
-        
-        # in the case of nan vals, all previous checks fail
-        # then the na_filler is returned and filled in
-        return self.na_filler
+        return self.codebook.decode(variable_label, raw_val, self.na_filler)
     
     def _get_choices_string(self, variable_label: str, raw_val: str) -> str:
         """
@@ -270,24 +238,10 @@ class Individual:
         if user_response_text == self.na_filler:
             return result
 
-        # then build out full options map
-        options_map = self.label2opt[variable_label]
-        choices_list = list(options_map.keys())
-        letters = string.ascii_uppercase
-        
-        formatted_lines = []
-        
-        for i, choice_text in enumerate(choices_list):
-            if i >= len(letters): break
-            
-            letter = letters[i]
-            formatted_lines.append(f"{letter}. {choice_text}")
-            
-            # save the letter if the option matches 
-            if str(user_response_text).strip() == str(choice_text).strip():
-                result['option_letter'] = letter
-
-        result['formatted'] = "\n".join(formatted_lines)
+        # then pull the prebuilt options block
+        formatted, text2letter = self.codebook.choices[variable_label]
+        result['option_letter'] = text2letter.get(str(user_response_text).strip(), self.na_filler)
+        result['formatted'] = formatted
         return result
     
     def _add_question_data(self, split: str, variable_label: str, raw_val: Any):
@@ -361,6 +315,285 @@ class Individual:
             }
         return entry
     
+class Codebook:
+    def __init__(self, dataset_name: str, time_period: str):
+        """
+        Read-only lookup tables for a single dataset and time period, compiled once from ALL_DATA_MAPS. 
+        Strings are interned so every indiv map references the same question, option and choices text.
+        """
+        if dataset_name not in ALL_DATA_MAPS:
+            raise ValueError(f"Unknown dataset {dataset_name} in ALL_DATA_MAPS")
+        dataset_maps = ALL_DATA_MAPS[dataset_name].get(time_period)
+        if dataset_maps is None:
+            raise ValueError(f"(Codebook) No mapping for '{dataset_name}' in '{time_period}'")
+        
+        self.dataset_name = dataset_name
+        self.time_period = time_period
+        self.label2qes = MappingProxyType({k: sys.intern(str(v)) for k, v in dataset_maps.get('label2qes', {}).items()})
+        self.label2opt = MappingProxyType(dataset_maps.get('label2opt', {}))
+        self.var2label = MappingProxyType(dataset_maps.get('var2label', {}))
+        self.label2var = MappingProxyType({v: k for k, v in self.var2label.items()})
+
+        decoders = {}
+        choices = {}
+        option_texts = {}
+        for variable_label, mapping in self.label2opt.items():
+            if mapping: # only invert if mapping exists
+                decoders[variable_label] = MappingProxyType(Individual._invert_mapping(mapping))
+                choices[variable_label] = self._compile_choices(mapping)
+                option_texts[variable_label] = tuple(sys.intern(str(text)) for text in mapping.keys())
+        self.opt_decoders = MappingProxyType(decoders)
+        self.choices = MappingProxyType(choices) # {<variable_label> : (<formatted choices>, {<option text> : <option letter>})}
+        self.option_texts = MappingProxyType(option_texts) # {<variable_label> : (<option text>, ...)}, position is the integer option code
+        self._option_codes = {label: {text: i for i, text in enumerate(texts)} for label, texts in option_texts.items()}
+
+    @staticmethod
+    def _compile_choices(options_map: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+        """
+        Builds the 'A. Option1\nB. Option2' block and a {option text : option letter} lookup.
+        """
+        letters = string.ascii_uppercase
+        choices_list = list(options_map.keys())[:len(letters)]
+        formatted = "\n".join([f"{letters[i]}. {choice_text}" for i, choice_text in enumerate(choices_list)])
+        text2letter = {str(choice_text).strip(): letters[i] for i, choice_text in enumerate(choices_list)}
+        return sys.intern(formatted), MappingProxyType(text2letter)
+
+    def decode(self, variable_label: str, raw_val: Any, na_filler: str = UNIVERSAL_NA_FILLER) -> str:
+        """
+        Decodes a raw value into its codebook option text.
+        """
+        decoder = self.opt_decoders.get(variable_label)
+        if decoder is None:
+            return na_filler
+        
+        raw_str = str(raw_val).strip()
+        if raw_str in decoder:
+            return decoder[raw_str]
+        
+        try:
+            normalized_str = str(int(float(raw_str))) # Handle "1.0" -> 1
+            if normalized_str in decoder:
+                return decoder[normalized_str]
+        except ValueError:
+            pass
+        
+        # in the case of nan vals, all previous checks fail
+        # then the na_filler is returned and filled in
+        return na_filler
+
+    def __reduce__(self):
+        # read-only proxies can't be pickled, worker processes re-fetch from their own registry instead
+        return (_registry_codebook, (self.dataset_name, self.time_period))
+
+    def encode(self, variable_label: str, raw_val: Any, na_filler: str = UNIVERSAL_NA_FILLER) -> int:
+        """
+        Decodes a raw value into its integer option code, the position of its text in option_texts.
+        Returns -1 for missing values.
+        """
+        option_text = self.decode(variable_label, raw_val, na_filler)
+        return self._option_codes.get(variable_label, {}).get(option_text, -1)
+
+class CodebookRegistry:
+    def __init__(self):
+        """
+        Process-wide cache of compiled Codebooks keyed on (dataset_name, time_period).
+        Tracks hits and misses for debugging.
+        """
+        self._codebooks: Dict[Tuple[str, str], Codebook] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, dataset_name: str, time_period: str) -> Codebook:
+        key = (dataset_name, time_period)
+        codebook = self._codebooks.get(key)
+        if codebook is None:
+            self.misses += 1
+            codebook = Codebook(dataset_name, time_period)
+            self._codebooks[key] = codebook
+        else:
+            self.hits += 1
+        return codebook
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'codebooks' : len(self._codebooks), 
+            'hits' : self.hits, 
+            'misses' : self.misses
+        }
+
+    def clear(self):
+        """Drops compiled codebooks, eg. after editing data_mappings in an interactive session."""
+        self._codebooks.clear()
+        self.hits = 0
+        self.misses = 0
+
+CODEBOOK_REGISTRY = CodebookRegistry()
+
+def _registry_codebook(dataset_name: str, time_period: str) -> Codebook:
+    return CODEBOOK_REGISTRY.get(dataset_name, time_period)
+
+class RecordLayout:
+    def __init__(
+            self, 
+            codebook: Codebook, 
+            demo_labels: Sequence[str], 
+            split_labels: Dict[str, Sequence[str]], 
+            na_filler: str = UNIVERSAL_NA_FILLER
+        ):
+        """
+        Shared description of how a CompactIndividual's option codes are laid out for one wave and train plan.
+        Codes are stored demographics first, then train, val and test question labels. 
+        split_labels should only hold labels whose column exists in the wave, same as Individual.add_<split>.
+        """
+        self._init_args = (codebook, tuple(demo_labels), {split: tuple(labels) for split, labels in split_labels.items()}, na_filler)
+        self.codebook = codebook
+        self.na_filler = na_filler
+        self.demo_labels = tuple(demo_labels)
+        self.split_slices = {}
+        self.split_specs = {} # {<split> : ((<label>, <question text>, <formatted choices>, <text2letter>, <option texts>), ...)}
+        self.split_answered = {} # {<split> : ((<label>, <codes with an option letter>), ...)}
+        offset = len(self.demo_labels)
+        for split in ['train', 'val', 'test']:
+            labels = tuple(split_labels.get(split, ()))
+            self.split_slices[split] = slice(offset, offset + len(labels))
+            self.split_specs[split] = tuple(
+                (
+                    label, 
+                    codebook.label2qes.get(label, "Missing Question Text"), 
+                    *codebook.choices.get(label, ("", {})), 
+                    codebook.option_texts.get(label, ())
+                )
+                for label in labels
+            )
+            self.split_answered[split] = tuple(
+                (label, frozenset(code for code, text in enumerate(options) if text != na_filler and text2letter.get(text.strip(), na_filler) != na_filler))
+                for label, _, _, text2letter, options in self.split_specs[split]
+            )
+            offset += len(labels)
+        self.width = offset
+
+    def __reduce__(self):
+        # rebuilt from its inputs so records can be returned from worker processes
+        return (RecordLayout, self._init_args)
+
+    def _option_text(self, options: Tuple[str], code: int) -> str:
+        return options[code] if code >= 0 else self.na_filler
+
+    def demog(self, codes: Sequence[int]) -> Dict[str, str]:
+        return {
+            label: self._option_text(self.codebook.option_texts.get(label, ()), code) 
+            for label, code in zip(self.demo_labels, codes[:len(self.demo_labels)])
+        }
+
+    def answered(self, split: str, codes: Sequence[int]) -> Iterable[Tuple[str, bool]]:
+        """(label, has option letter) per split question, without materializing the question map."""
+        for (label, answered_codes), code in zip(self.split_answered[split], codes[self.split_slices[split]]):
+            yield label, code in answered_codes
+
+    def question_map(self, split: str, codes: Sequence[int]) -> Dict[str, Dict]:
+        """Materializes the same split question map Individual builds."""
+        qst_map = {
+            "var_label2qst_text": {}, 
+            "var_label2qst_choices": {}, 
+            "var_label2qst_option": {}
+        }
+        for (label, question_text, formatted, text2letter, options), code in zip(self.split_specs[split], codes[self.split_slices[split]]):
+            option_text = self._option_text(options, code)
+            answered = option_text != self.na_filler
+            qst_map['var_label2qst_text'][label] = question_text
+            qst_map['var_label2qst_choices'][label] = formatted if answered else ""
+            qst_map['var_label2qst_option'][label] = {
+                'option_letter' : text2letter.get(option_text.strip(), self.na_filler) if answered else self.na_filler, 
+                'option_text' : option_text
+            }
+        return qst_map
+
+class CompactIndividual(Mapping):
+    __slots__ = ('layout', 'id', 'uniqueid', '_codes')
+    SPLITS = ('train', 'val', 'test')
+
+    def __init__(self, layout: RecordLayout, idx: Any, uniqueid: str, codes: bytes):
+        """
+        Memory-light stand-in for Individual.return_full_indiv_map(). 
+        Holds int16 option codes packed into bytes and only builds the dict shape on access or serialization.
+        """
+        self.layout = layout
+        self.id = idx
+        self.uniqueid = uniqueid
+        self._codes = codes
+
+    @property
+    def codes(self) -> memoryview:
+        return memoryview(self._codes).cast('h')
+
+    def view(self, split: str) -> Union['CompactIndividual', 'IndividualView']:
+        """Zero-copy projection matching Individual.return_split_indiv_map(split)."""
+        if split == 'full':
+            return self
+        return IndividualView(self, (split,))
+
+    def _get_field(self, key: str, splits: Tuple[str]) -> Any:
+        if key == 'id':
+            return self.id
+        elif key == 'uniqueid':
+            return self.uniqueid
+        elif key == 'time':
+            return self.layout.codebook.time_period
+        elif key == 'demog':
+            return self.layout.demog(self.codes)
+        elif key == 'dataset':
+            return self.layout.codebook.dataset_name
+        elif key in splits:
+            return self.layout.question_map(key, self.codes)
+        raise KeyError(key)
+
+    def _keys(self, splits: Tuple[str]) -> Tuple[str]:
+        return ('id', 'uniqueid', 'time', 'demog', 'dataset', *splits)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._get_field(key, self.SPLITS)
+
+    def __iter__(self):
+        return iter(self._keys(self.SPLITS))
+
+    def __len__(self):
+        return len(self._keys(self.SPLITS))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys(self.SPLITS)
+
+    def __repr__(self):
+        return f"<CompactIndividual: {self.uniqueid}>"
+
+    def to_dict(self) -> dict:
+        return {k: self[k] for k in self}
+
+class IndividualView(Mapping):
+    __slots__ = ('record', 'splits')
+
+    def __init__(self, record: CompactIndividual, splits: Tuple[str]):
+        """Split projection of a CompactIndividual, no data is copied."""
+        self.record = record
+        self.splits = splits
+
+    def __getitem__(self, key: str) -> Any:
+        return self.record._get_field(key, self.splits)
+
+    def __iter__(self):
+        return iter(self.record._keys(self.splits))
+
+    def __len__(self):
+        return len(self.record._keys(self.splits))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.record._keys(self.splits)
+
+    def __repr__(self):
+        return f"<IndividualView: {self.record.uniqueid} {self.splits}>"
+
+    def to_dict(self) -> dict:
+        return {k: self[k] for k in self}
+
 class TrainPlanWrapper:
     def __init__(self, dataset_name, train_plan):
         if train_plan not in TRAIN_PLANS:
@@ -373,6 +606,9 @@ class TrainPlanWrapper:
         if self.variable_map is None:
             raise ValueError(f"(TrainPlanWrap) Could not find variable map for dataset '{dataset_name}' and training plan '{train_plan}'")
 
+    def get_codebook(self, time_period: str) -> Codebook:
+        return CODEBOOK_REGISTRY.get(self.dataset_name, time_period)
+
     def get_var_lst(self, split: str):
         """
         Handles for:
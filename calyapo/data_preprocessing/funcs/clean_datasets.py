@@ -2,17 +2,119 @@ import json
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from typing import List, Dict, Union
+from typing import List, Dict, Any, Tuple, Union, Iterable
 import math
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from calyapo.configurations.data_map_config import ALL_DATA_MAPS
 from calyapo.configurations.config import UNIVERSAL_NA_FILLER
-from calyapo.data_preprocessing.cleaning_objects import Individual, TrainPlanWrapper, DataPackage
+from calyapo.data_preprocessing.cleaning_objects import Individual, TrainPlanWrapper, DataPackage, Codebook, CODEBOOK_REGISTRY, RecordLayout, CompactIndividual, unique_id_generator
 from calyapo.utils.persistence import *
 
-def process_csv(data: pd.DataFrame, dataset_name: str, train_plan: str, reduction_modifier: float = None, seed: int = 42, debug: bool = False, verbose: bool = False) -> DataPackage:
+def _encode_column(column: pd.Series, codebook: Codebook, variable_label: str, na_filler: str = UNIVERSAL_NA_FILLER) -> np.ndarray:
+    """
+    Encodes a whole column at once. Each distinct raw value is decoded a single time 
+    then broadcast back onto the rows through its categorical code.
+    Returns an int16 array of option codes aligned with the column, -1 for missing.
+    """
+    codes, uniques = pd.factorize(column, use_na_sentinel=True)
+    encoded = [codebook.encode(variable_label, raw_val, na_filler) for raw_val in uniques]
+    encoded.append(-1) # NaNs get code -1 which indexes this trailing missing code
+    return np.asarray(encoded, dtype=np.int16)[codes]
+
+def _process_csv_vectorized(
+        data: pd.DataFrame, 
+        dataset_name: str, 
+        time_period: str, 
+        tp_wrap: TrainPlanWrapper, 
+        compact: bool = False, 
+        na_filler: str = UNIVERSAL_NA_FILLER
+    ) -> Tuple[List[Dict], List[Dict], List[Dict], List[Dict]]:
+    """
+    Columnar equivalent of the Individual loop in process_csv. 
+    Decoding is done once per (dataset, time_period, variable_label) over whole columns, 
+    then the same full/train/val/test indiv maps are emitted row by row.
+    If compact, emits CompactIndividual records and zero-copy split views instead of dicts.
+    """
+    codebook = tp_wrap.get_codebook(time_period)
+    label2var = codebook.label2var
+    n = len(data)
+
+    encoded_cols: Dict[str, np.ndarray] = {} # caches encoded columns, labels are often shared across splits
+    def encode_label(var_label: str) -> np.ndarray:
+        if var_label not in encoded_cols:
+            csv_col = label2var.get(var_label)
+            if csv_col and csv_col in data.columns and var_label in codebook.opt_decoders:
+                encoded_cols[var_label] = _encode_column(data[csv_col], codebook, var_label, na_filler)
+            else:
+                encoded_cols[var_label] = np.full(n, -1, dtype=np.int16)
+        return encoded_cols[var_label]
+
+    # ID logic
+    id_col = label2var.get('dataset_id')
+    ids = data[id_col].tolist() if (id_col and id_col in data.columns) else data.index.tolist()
+    uniqueids = unique_id_generator(base_ids=ids, time_period=time_period)
+
+    # only questions whose column exists are recorded, same as the row path
+    demo_labels = tp_wrap.get_var_lst('demo')
+    split_labels = {
+        split: [
+            var_label for var_label in tp_wrap.get_var_lst(f"{split}_resp") 
+            if label2var.get(var_label) and label2var.get(var_label) in data.columns
+        ]
+        for split in ['train', 'val', 'test']
+    }
+    layout = RecordLayout(codebook=codebook, demo_labels=demo_labels, split_labels=split_labels, na_filler=na_filler)
+    all_labels = [*demo_labels, *split_labels['train'], *split_labels['val'], *split_labels['test']]
+    code_matrix = np.stack([encode_label(var_label) for var_label in all_labels], axis=1) if all_labels else np.empty((n, 0), dtype=np.int16)
+    
+    cleaned_data: List[Dict] = []
+    train_data: List[Dict] = []
+    val_data: List[Dict] = []
+    test_data: List[Dict] = []
+    if compact:
+        row_bytes = np.ascontiguousarray(code_matrix, dtype=np.int16).tobytes()
+        width = layout.width * np.dtype(np.int16).itemsize
+        for i in range(n):
+            record = CompactIndividual(layout, ids[i], uniqueids[i], row_bytes[i * width:(i + 1) * width])
+            cleaned_data.append(record)
+            train_data.append(record.view('train'))
+            val_data.append(record.view('val'))
+            test_data.append(record.view('test'))
+        return cleaned_data, train_data, val_data, test_data
+    
+    for i, codes in enumerate(code_matrix.tolist()):
+        base = {
+            "id" : ids[i], 
+            "uniqueid" : uniqueids[i], 
+            "time" : time_period, 
+            "demog" : layout.demog(codes), 
+            "dataset" : dataset_name, 
+        }
+        train_map, val_map, test_map = (layout.question_map(split, codes) for split in ['train', 'val', 'test'])
+        cleaned_data.append({**base, "train" : train_map, "val" : val_map, "test" : test_map})
+        train_data.append({**base, "train" : train_map})
+        val_data.append({**base, "val" : val_map})
+        test_data.append({**base, "test" : test_map})
+
+    return cleaned_data, train_data, val_data, test_data
+
+def process_csv(
+        data: pd.DataFrame, 
+        dataset_name: str, 
+        train_plan: str, 
+        reduction_modifier: float = None, 
+        seed: int = 42, 
+        vectorized: bool = False, 
+        compact: bool = False, 
+        debug: bool = False, 
+        verbose: bool = False
+    ) -> DataPackage:
     """
     Process a single CSV file or dataframe and return a DataPackage.
+    If vectorized, decodes whole columns at once instead of building an Individual per row.
+    If compact, the package holds CompactIndividual records and split views (implies vectorized).
     """
 
     if 'time_period' in data.columns:
@@ -28,53 +130,62 @@ def process_csv(data: pd.DataFrame, dataset_name: str, train_plan: str, reductio
     if debug: print(f"(process_csv | Debug) Base df empty: '{data is None}'")
     
     tp_wrap = TrainPlanWrapper(dataset_name, train_plan) # validates train_plan and dataset_name
-    dataset_maps = ALL_DATA_MAPS[dataset_name][time_period]
-    var2label = dataset_maps.get('var2label', {})
-    label2var = {v: k for k, v in var2label.items()}
+    label2var = tp_wrap.get_codebook(time_period).label2var
 
     # data specific arrays
     cleaned_data: List[Dict] = []
     train_data: List[Dict] = []
     val_data: List[Dict] = []
     test_data: List[Dict] = []
-    for idx, row in data.iterrows():
-        # ID logic
-        id_col = label2var.get('dataset_id')
-        indiv_id = row[id_col] if (id_col and id_col in row) else idx
+    if vectorized or compact:
+        cleaned_data, train_data, val_data, test_data = _process_csv_vectorized(
+            data=data, 
+            dataset_name=dataset_name, 
+            time_period=time_period, 
+            tp_wrap=tp_wrap, 
+            compact=compact
+        )
+    else:
+        # boxed row values keep each column's own type, an all numeric frame (eg. one read with only a plan's columns) 
+        # would otherwise hand every value over as numpy.float64, ids included
+        for idx, row in data.astype(object).iterrows():
+            # ID logic
+            id_col = label2var.get('dataset_id')
+            indiv_id = row[id_col] if (id_col and id_col in row) else idx
         
-        entry = Individual(indiv_id, time_period, train_plan, dataset_name)
+            entry = Individual(indiv_id, time_period, train_plan, dataset_name)
 
-        # demographics
-        for var_label in tp_wrap.get_var_lst('demo'):
-            csv_col = label2var.get(var_label)
-            if csv_col and csv_col in row:
-                entry.add_demog(var_label, row[csv_col], debug)
-            else:
-                entry.add_demog(var_label, UNIVERSAL_NA_FILLER, debug)
+            # demographics
+            for var_label in tp_wrap.get_var_lst('demo'):
+                csv_col = label2var.get(var_label)
+                if csv_col and csv_col in row:
+                    entry.add_demog(var_label, row[csv_col], debug)
+                else:
+                    entry.add_demog(var_label, UNIVERSAL_NA_FILLER, debug)
 
-        # train questions
-        for var_label in tp_wrap.get_var_lst('train_resp'):
-            csv_col = label2var.get(var_label)
-            if csv_col and csv_col in row:
-                entry.add_train(var_label, row[csv_col])
+            # train questions
+            for var_label in tp_wrap.get_var_lst('train_resp'):
+                csv_col = label2var.get(var_label)
+                if csv_col and csv_col in row:
+                    entry.add_train(var_label, row[csv_col])
                 
 
-        # val questions
-        for var_label in tp_wrap.get_var_lst('val_resp'):
-            csv_col = label2var.get(var_label)
-            if csv_col and csv_col in row:
-                entry.add_val(var_label, row[csv_col])
+            # val questions
+            for var_label in tp_wrap.get_var_lst('val_resp'):
+                csv_col = label2var.get(var_label)
+                if csv_col and csv_col in row:
+                    entry.add_val(var_label, row[csv_col])
         
-        # test questions
-        for var_label in tp_wrap.get_var_lst('test_resp'):
-            csv_col = label2var.get(var_label)
-            if csv_col and csv_col in row:
-                entry.add_test(var_label, row[csv_col])
+            # test questions
+            for var_label in tp_wrap.get_var_lst('test_resp'):
+                csv_col = label2var.get(var_label)
+                if csv_col and csv_col in row:
+                    entry.add_test(var_label, row[csv_col])
 
-        cleaned_data.append(entry.return_full_indiv_map())
-        train_data.append(entry.return_split_indiv_map('train'))
-        val_data.append(entry.return_split_indiv_map('val'))
-        test_data.append(entry.return_split_indiv_map('test'))
+            cleaned_data.append(entry.return_full_indiv_map())
+            train_data.append(entry.return_split_indiv_map('train'))
+            val_data.append(entry.return_split_indiv_map('val'))
+            test_data.append(entry.return_split_indiv_map('test'))
 
     if verbose: print(f"(process_csv) finished processing single df, initial dataset size: '{len(cleaned_data)}'")
     # all are the same length due to missing val handling in Individual class
@@ -108,6 +219,38 @@ def process_csv(data: pd.DataFrame, dataset_name: str, train_plan: str, reductio
     
     return pack
 
+def process_wave(
+        df: pd.DataFrame, 
+        dataset_name: str, 
+        train_plan: str, 
+        reduction_modifier: float = None, 
+        out_path: str = None, 
+        seed: int = 42, 
+        vectorized: bool = False, 
+        compact: bool = False, 
+        persistence_format: str = 'json', 
+        save: bool = True, 
+        debug: bool = False, 
+        verbose: bool = False
+    ) -> DataPackage:
+    """
+    Processes and saves a single wave. Module level so split_questions can fan waves out across worker processes, also used by SplitHandler.append_wave.
+    """
+    pack = process_csv(data=df, dataset_name=dataset_name, train_plan=train_plan, reduction_modifier=reduction_modifier, seed=seed, vectorized=vectorized, compact=compact, debug=debug, verbose=verbose)
+    if pack and save:
+        save_wave(pack, out_path=out_path, persistence_format=persistence_format, verbose=verbose)
+    return pack
+
+def save_wave(pack: DataPackage, out_path: str, persistence_format: str = 'json', verbose: bool = False) -> Path:
+    """Saves a processed wave's package to {plan}_{dataset}_{time period}_processed."""
+    assert out_path is not None, f"(split_questions) Cannot save files without valid out path"
+    # e.g. ideology_to_trump_IGS_2024_processed.json
+    suffix, data_type = PACKAGE_FORMATS[persistence_format]
+    out_name = f"{pack.train_plan}_{pack.dataset_name}_{pack.time_period}_processed{suffix}"
+    
+    file_saver(out_path=Path(Path(out_path) / out_name), data=pack.get_data('full'), data_type=data_type, indnt=2, verbose=verbose)
+    return Path(out_path) / out_name
+
 def split_questions(
         data: List[pd.DataFrame], 
         dataset_name: str, 
@@ -115,6 +258,10 @@ def split_questions(
         reduction_modifier: float = None, 
         out_path: str = None, 
         seed: int = 42, 
+        vectorized: bool = False, 
+        compact: bool = False, 
+        num_workers: int = None, 
+        persistence_format: str = 'json', 
         save: bool = True, 
         debug: bool = False, 
         verbose: bool = False
@@ -122,51 +269,72 @@ def split_questions(
     """
     Iterates through all CSVs for a dataset, cleans them, saves intermediates,
     and returns a combined DataPackage.
+    If num_workers > 1, waves are processed in parallel and merged back in their input order.
+    If persistence_format is 'jsonl' and save, each wave's records are streamed straight to the compact JSONL fullpack as it's merged 
+    and the returned package reads them back lazily, so this stage's memory stays flat with respondent count. 
+    Only question splitting streams, split_ratio still reads the whole fullpack into memory to split it.
     """    
-    # whole-survey arrays
-    master_full: List[Dict] = []
-    master_train: List[Dict] = []
-    master_val: List[Dict] = []
-    master_test: List[Dict] = []
-
     if verbose: print(f"(split_question) recieving '{len(data)}' dataframes")
 
-    for df in data:
-        pack = process_csv(data=df, dataset_name=dataset_name, train_plan=train_plan, reduction_modifier=reduction_modifier, seed=seed, debug=debug, verbose=verbose)
+    worker = partial(
+        process_wave, 
+        dataset_name=dataset_name, 
+        train_plan=train_plan, 
+        reduction_modifier=reduction_modifier, 
+        out_path=out_path, 
+        seed=seed, 
+        vectorized=vectorized, 
+        compact=compact, 
+        persistence_format=persistence_format, 
+        save=save, 
+        debug=debug, 
+        verbose=verbose
+    )
+    suffix, data_type = PACKAGE_FORMATS[persistence_format]
+    fullpack_name = f"{train_plan}_{dataset_name}_fullpack_processed{suffix}"
+    stream_writer = None
+    if save and persistence_format == 'jsonl':
+        assert out_path is not None, f"(split_questions) Cannot save files without valid out path"
+        stream_writer = JSONLPackageWriter(Path(out_path / fullpack_name))
 
-        
-        if not pack: continue # skip if config missing
-        
-        full_data = pack.get_data('full')
-        if debug:
-            print(f"(split_question | Debug) full_data empty:{full_data is None}")
-        master_full.extend(full_data)
-        master_train.extend(pack.get_data('train'))
-        master_val.extend(pack.get_data('val'))
-        master_test.extend(pack.get_data('test'))
+    # whole-survey arrays, only held in memory when not streaming
+    master_pack = DataPackage(dataset_name, train_plan, "all_combined")
+    master_splits: Dict[str, List[Dict]] = {split: [] for split in ['full', 'train', 'val', 'test']}
+
+    def merge(packs: Iterable[DataPackage]):
+        for pack in packs:
+            if not pack: continue # skip if config missing
+            if debug:
+                print(f"(split_question | Debug) full_data empty:{pack.get_data('full') is None}")
+            for split, records in master_splits.items():
+                if stream_writer is not None:
+                    stream_writer.extend(split, pack.get_data(split))
+                else:
+                    records.extend(pack.get_data(split))
 
+    if num_workers is not None and num_workers > 1:
+        if verbose: print(f"(split_question) processing waves across '{num_workers}' workers")
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            merge(executor.map(worker, data)) # map keeps wave order so merging stays deterministic, each wave is released once merged
+    else:
+        merge(map(worker, data))
+
+    if stream_writer is not None:
+        stream_writer.close(meta=master_pack.meta)
+        if verbose: print(f"(split_question) Results streamed to: {Path(out_path / fullpack_name)}")
+        master_pack = load_package_jsonl(Path(out_path / fullpack_name)) # lazy JSONLRecords views of what was just written
+    else:
+        for split, records in master_splits.items():
+            master_pack.add_data(split, records)
         if save:
             assert out_path is not None, f"(split_questions) Cannot save files without valid out path"
-            # e.g. ideology_to_trump_IGS_2024_processed.json
-            out_name = f"{train_plan}_{dataset_name}_{pack.time_period}_processed.json"
-            
-            file_saver(out_path=Path(out_path / out_name), data=full_data, data_type='DataPackage', indnt=2, verbose=verbose)
-
-    master_pack = DataPackage(dataset_name, train_plan, "all_combined")
-    master_pack.add_data('full', master_full)
-    master_pack.add_data('train', master_train)
-    master_pack.add_data('val', master_val)
-    master_pack.add_data('test', master_test)
+            file_saver(out_path=Path(out_path / fullpack_name), data=master_pack, data_type=data_type, indnt=2, verbose=verbose)
 
     if debug:
         print(f"(split_question | Debug) master_pack['full'] empty: '{master_pack.get('full') is None}'")
 
     if verbose:
         print(f"(split_question) processed '{len(master_pack['full'])}' individual maps")
+        print(f"(split_question) codebook registry stats: {CODEBOOK_REGISTRY.stats()}")
 
-    if save:
-        assert out_path is not None, f"(split_questions) Cannot save files without valid out path"
-        out_name = f"{train_plan}_{dataset_name}_fullpack_processed.json"
-        file_saver(out_path=Path(out_path / out_name), data=master_pack, data_type='DataPackage', indnt=2, verbose=verbose)
-    
-    return master_pack
\ No newline at end of file
+    return master_pack
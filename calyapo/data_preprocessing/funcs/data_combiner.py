@@ -1,7 +1,10 @@
+import ast
 import json
 import os
+import re
+from json.encoder import encode_basestring_ascii
 from pathlib import Path
-from typing import List, Dict, Any, Iterable
+from typing import List, Dict, Any, Iterable, Tuple
 
 from calyapo.configurations.data_map_config import TRAIN_PLANS, VARLABEL_DESC
 from calyapo.configurations.config import UNIVERSAL_FINAL_FOLDER, UNIVERSAL_NA_FILLER, IGS_SURVEY_WAVE_DESC, POLLING_FIRM_DESC
@@ -20,76 +23,114 @@ def format_demographics(demog_dict: Dict[str, str]) -> str:
         parts.append(f"{clean_key}: {v}")
     return ", ".join(parts)
 
-def flatten_data_to_llama_format(raw_data_list: List[Dict], split: str) -> List[Dict[str, str]]:
-    """
-    Flattens Individuals into MCQ Prompt/Completion pairs.
-    """
-    flattened_examples = []
-    meta_configs = []
-    
-    for entry in raw_data_list:
-        # track IDS here
+def _parse_answer(answer_data: Any) -> Dict:
+    """answer_data is usually a dict, eg. {'option_letter': 'A', 'option_text': 'Yes'}, but may come back as its string repr from older saves."""
+    if isinstance(answer_data, str):
+        try:
+            return ast.literal_eval(answer_data)
+        except Exception:
+            return None
+    return answer_data
+
+class PromptCompiler:
+    def __init__(self):
+        """
+        Batched prompt builder behind flatten_data_to_llama_format.
+        The header (narrative + demographic profile) is compiled once per distinct (time, dataset, demographics), 
+        and the question + choices block once per (dataset, time, var_label). Prompts are then joins of cached pieces.
+        When encoding, pieces are json-escaped once too so JSONL lines are assembled without re-escaping every prompt.
+        """
+        self._headers: Dict[tuple, str] = {}
+        self._blocks: Dict[tuple, str] = {}
+        self._encoded: Dict[str, str] = {} # piece : json string literal
+
+    def _encode(self, text: str) -> str:
+        encoded = self._encoded.get(text)
+        if encoded is None:
+            encoded = self._encoded[text] = encode_basestring_ascii(text) # same escaping as json.dumps
+        return encoded
+
+    def header(self, entry: Dict) -> str:
         time_label = entry.get('time', 'Unknown')
-        polling_date = IGS_SURVEY_WAVE_DESC.get(time_label, 'Unkown')
         dataset_label = entry.get('dataset', 'Unknown')
-        polling_firm = POLLING_FIRM_DESC.get(dataset_label, 'Unkown')
-        demog_str = format_demographics(entry.get('demog', {}))
-        
-        narrative = f"You are a survey respondent based in California from the {polling_date} {polling_firm} polling wave."
-        
-        section_data = entry.get(split, {})
-        
-        text_map = section_data.get('var_label2qst_text', {})
-        choices_map = section_data.get('var_label2qst_choices', {})
-        # options map contains the answer logic {var: {option_text, option_letter}}
-        options_map = section_data.get('var_label2qst_option', {})
-        
-        # each datapoint is a unique individual-question pair so now we iterate thru questions
-        for var_label, answer_data in options_map.items():
-            
-            # answer_data is a dictionary, e.g. {'option_letter': 'A', 'option_text': 'Yes'}
-            # NOTE: eval() might be needed if it was saved as string representation of dict
-            if isinstance(answer_data, str):
-                try:
-                    import ast
-                    answer_data = ast.literal_eval(answer_data)
-                except:
-                    continue
+        demog = entry.get('demog', {})
+        key = (time_label, dataset_label, tuple(demog.values()), tuple(demog))
+        header = self._headers.get(key)
+        if header is None:
+            polling_date = IGS_SURVEY_WAVE_DESC.get(time_label, 'Unkown')
+            polling_firm = POLLING_FIRM_DESC.get(dataset_label, 'Unkown')
+            header = self._headers[key] = (
+                f"You are a survey respondent based in California from the {polling_date} {polling_firm} polling wave.\n"
+                f"You have the following demographic profile: {format_demographics(demog)}.\n"
+            )
+        return header
 
-            response_text = answer_data.get('option_text') # text description of chosen option, accurate to survey
-            target_letter = answer_data.get('option_letter') # just the corresponding letter
-            
-            #FIX skip if missing 
-            if not target_letter or target_letter == UNIVERSAL_NA_FILLER:
-                continue
-                
-            question_text = text_map.get(var_label, "")
-            choices_block = choices_map.get(var_label, "")
-            question_varlabel_desc = VARLABEL_DESC[var_label]
-
-            # construct prompt
-            prompt = (
-                f"{narrative}\n"
-                f"You have the following demographic profile: {demog_str}.\n"
-                f"Answer the following question about {question_varlabel_desc} according to your demographic profile: {question_text}\n"
+    def block(self, entry: Dict, section_data: Dict, var_label: str) -> str:
+        key = (entry.get('dataset', 'Unknown'), entry.get('time', 'Unknown'), var_label)
+        block = self._blocks.get(key)
+        if block is None:
+            question_text = section_data.get('var_label2qst_text', {}).get(var_label, "")
+            choices_block = section_data.get('var_label2qst_choices', {}).get(var_label, "")
+            block = self._blocks[key] = (
+                f"Answer the following question about {VARLABEL_DESC[var_label]} according to your demographic profile: {question_text}\n"
                 f"{choices_block}\n"
                 f"Answer:"
             )
+        return block
+
+    def compile(self, raw_data_list: Iterable[Dict], split: str, encode: bool = False) -> Iterable[Tuple[Dict, Dict, str, str]]:
+        """
+        Yields (example, meta, example_line, meta_line) per individual-question pair. 
+        If encode, the lines are exactly what json.dumps would write for example and meta, otherwise None.
+        """
+        example_line = meta_line = None
+        for entry in raw_data_list:
+            header = self.header(entry)
+            section_data = entry.get(split, {})
+            # options map contains the answer logic {var: {option_text, option_letter}}
+            options_map = section_data.get('var_label2qst_option', {})
+            meta = None
             
-            # construct completiion target (just the target letter)
-            completion = f"{target_letter}"
-            
-            flattened_examples.append({
-                "prompt": prompt,
-                "completion": completion
-            })
-            
-            meta_configs.append({
-                'id': entry.get('id', 'Unknown'), 
-                'uniqueid': entry.get('uniqueid', 'Unknown'), 
-                'time_period': entry.get('time', 'Unknown'), 
-                'dataset': entry.get('dataset', 'Unknown'), 
-            })
+            # each datapoint is a unique individual-question pair so now we iterate thru questions
+            for var_label, answer_data in options_map.items():
+                answer_data = _parse_answer(answer_data)
+                if answer_data is None:
+                    continue
+                target_letter = answer_data.get('option_letter') # just the corresponding letter
+                
+                #FIX skip if missing 
+                if not target_letter or target_letter == UNIVERSAL_NA_FILLER:
+                    continue
+
+                block = self.block(entry, section_data, var_label)
+                if meta is None:
+                    # shared by all of this individual's questions
+                    meta = {
+                        'id': entry.get('id', 'Unknown'), 
+                        'uniqueid': entry.get('uniqueid', 'Unknown'), 
+                        'time_period': entry.get('time', 'Unknown'), 
+                        'dataset': entry.get('dataset', 'Unknown'), 
+                    }
+                    if encode: meta_line = json.dumps(meta)
+                
+                # completion target is just the target letter
+                completion = f"{target_letter}"
+                example = {"prompt": header + block, "completion": completion}
+                if encode:
+                    # json escapes per character so the escaped pieces join into the escaped prompt
+                    example_line = f'{{"prompt": {self._encode(header)[:-1]}{self._encode(block)[1:]}, "completion": {self._encode(completion)}}}'
+                yield example, meta, example_line, meta_line
+
+def flatten_data_to_llama_format(raw_data_list: List[Dict], split: str, compiler: PromptCompiler = None) -> List[Dict[str, str]]:
+    """
+    Flattens Individuals into MCQ Prompt/Completion pairs.
+    """
+    compiler = compiler if compiler is not None else PromptCompiler()
+    flattened_examples = []
+    meta_configs = []
+    for example, meta, _, _ in compiler.compile(raw_data_list, split):
+        flattened_examples.append(example)
+        meta_configs.append(meta)
     return flattened_examples, meta_configs
 
 def save_jsonl(data: List[Dict], filename: str, out_path: str = None, verbose: bool = False):
@@ -106,12 +147,19 @@ def split_combine(
         package: DataPackage,
         out_path: str = None,
         save: bool = True,
+        mode: str = 'w', 
         debug: bool = False,
         verbose: bool = True
     ):
+    """
+    Compiles every dataset package's splits into prompts, streamed to {plan}_{split}.jsonl and its meta when saving.
+    mode 'a' appends to existing files (eg. a newly ingested wave) instead of overwriting them.
+    When saving, prompts aren't kept in memory and the returned package holds lazy JSONLRecords over the lines this call wrote, 
+    otherwise it holds the compiled lists.
+    """
     data_dict = {
         'train' : {
-            'data' : [], # when function finishes this will be list of {prompt : completion} dictionaries
+            'data' : [], # when function finishes this will be list of {prompt : completion} dictionaries, left empty when saving
             'meta' : []
         },
         'val' : {
@@ -123,32 +171,56 @@ def split_combine(
             'meta' : []
         }
     }
+    counts = {split: 0 for split in data_dict}
        
+    writers = {}
+    offsets = {} # where this call's lines start in each file, past the existing lines when appending
+    if save:
+        # prompts are streamed to their jsonl files as they're compiled
+        assert out_path is not None, f"(split_combine | WARNING) Cannot have no out_path if saving."
+        for split in data_dict:
+            for suffix in ['', '_meta']:
+                file_name = f"{package.train_plan}_{split}{suffix}.jsonl"
+                file_path = Path(out_path) / file_name if Path(out_path).is_dir() else Path(out_path)
+                writers[f"{split}{suffix}"] = open(file_path, mode)
+                offsets[f"{split}{suffix}"] = writers[f"{split}{suffix}"].tell()
+
     # needs to be able to take different packages in memory
     if verbose:
         print(f"(split_combine) There are '{len(package['dataset_packages'])}' datasets to process")
-    for dataset_name, inpack in package['dataset_packages'].items():
-        if verbose: print(f"(split_combine) Processing {dataset_name}...")
-        if debug:
-            print(f"(split_combine | Debug) Data Package: {package}")
+    compiler = PromptCompiler() # headers and question blocks are shared across splits
+    try:
+        for dataset_name, inpack in package['dataset_packages'].items():
+            if verbose: print(f"(split_combine) Processing {dataset_name}...")
+            if debug:
+                print(f"(split_combine | Debug) Data Package: {package}")
 
-        for split, split_dict in data_dict.items():
-            indiv_map: List[Dict] = inpack.get(split)
-            data, meta = flatten_data_to_llama_format(indiv_map, split)
-            split_dict['data'].extend(data)
-            split_dict['meta'].extend(meta)
-
-    if save:
-        assert out_path is not None, f"(split_combine | WARNING) Cannot have no out_path if saving."
-        for split, split_dict in data_dict.items():
-            save_jsonl(split_dict['data'], f"{package.train_plan}_{split}.jsonl", out_path, verbose)
-            save_jsonl(split_dict['meta'], f"{package.train_plan}_{split}_meta.jsonl", out_path, verbose)
+            for split, split_dict in data_dict.items():
+                indiv_map: List[Dict] = inpack.get(split)
+                for example, meta, example_line, meta_line in compiler.compile(indiv_map, split, encode=save):
+                    counts[split] += 1
+                    if save:
+                        writers[split].write(example_line + "\n")
+                        writers[f"{split}_meta"].write(meta_line + "\n")
+                    else:
+                        split_dict['data'].append(example)
+                        split_dict['meta'].append(meta)
+    finally:
+        for writer in writers.values():
+            writer.close()
 
+    if save and verbose:
+        for split in data_dict:
+            print(f"(split_combine | save_jsonl) Saved {counts[split]} examples to {writers[split].name}")
 
     out_pack = DataPackage(package.dataset_name, package.train_plan, package.time_period)
     for split, split_dict in data_dict.items():
-        out_pack[split] = split_dict['data']
-        out_pack[f"{split}_meta"] = split_dict['meta']
+        if save:
+            out_pack[split] = JSONLRecords(Path(writers[split].name), offset=offsets[split], count=counts[split])
+            out_pack[f"{split}_meta"] = JSONLRecords(Path(writers[f"{split}_meta"].name), offset=offsets[f"{split}_meta"], count=counts[split])
+        else:
+            out_pack[split] = split_dict['data']
+            out_pack[f"{split}_meta"] = split_dict['meta']
 
     return out_pack
 
@@ -164,8 +236,9 @@ def subdivide_training_set(
     out_pack = DataPackage(package.dataset_name, package.train_plan, package.time_period)
     np.random.default_rng(seed)
 
-    base_train_set = package['train']  # list of {prompt: completion}
-    base_train_meta = package['train_meta']
+    # list of {prompt: completion}, lazy records (eg. from a saving split_combine) are read in since subsets are drawn by index
+    base_train_set = package['train'] if isinstance(package['train'], list) else list(package['train'])
+    base_train_meta = package['train_meta'] if isinstance(package['train_meta'], list) else list(package['train_meta'])
     train_size_total = len(base_train_set)
     rng = np.random.default_rng(seed)
     for proportion in subproportions:
@@ -185,3 +258,96 @@ def subdivide_training_set(
 
     return out_pack
 
+
+# ---- Streaming subproportions ----
+GOLDEN_RATIO_CONJ = (5 ** 0.5 - 1) / 2
+_PROFILE_PATTERN = re.compile(r"demographic profile:\s*(?P<demogs>.*?)\.\nAnswer", re.DOTALL)
+
+def prompt_demographics(prompt: str) -> Dict[str, str]:
+    """Parses the demographic profile back out of a prompt, same splitting as Tabularizer. eg. {'age': '40-49', 'party identity': 'Democrat'}"""
+    match = _PROFILE_PATTERN.search(prompt)
+    if not match:
+        return {}
+    demogs = {}
+    for part in re.split(r",\s*(?=[A-Za-z\s]+:)", match.group("demogs")):
+        if ":" in part:
+            k, v = part.split(":", 1)
+            demogs[k.strip()] = v.strip()
+    return demogs
+
+def _stratum_key(example: Dict, meta: Dict, stratify_on: Iterable[str]) -> tuple:
+    """Meta fields (eg. 'time_period') are read off the meta line, anything else is a demographic label or its VARLABEL_DESC name."""
+    demogs = None
+    key = []
+    for field in stratify_on:
+        if field in meta:
+            key.append(meta[field])
+        else:
+            if demogs is None:
+                demogs = prompt_demographics(example.get('prompt', ''))
+            key.append(demogs.get(VARLABEL_DESC.get(field, field), UNIVERSAL_NA_FILLER))
+    return tuple(key)
+
+def stream_subdivide_training_set(
+        train_path: Path, 
+        train_meta_path: Path, 
+        subproportions: Iterable[float], 
+        train_plan: str, 
+        out_path: str = None, 
+        seed: int = 42, 
+        stratify_on: Iterable[str] = None, 
+        debug: bool = False, 
+        verbose: bool = True
+    ) -> DataPackage:
+    """
+    Single pass, memory-flat version of subdivide_training_set reading straight from the final train jsonl and its meta.
+    Every line draws one threshold u in [0, 1) and is written to each proportion p with u < p, so the subsets are nested 
+    (train_0.1 is inside train_0.2, ...) and lines keep their file order.
+    Thresholds are uniform draws from rng, or if stratify_on is given, a golden ratio sequence per stratum started at a random offset 
+    so every stratum (eg. age x party identity) lands within a few lines of p of its size in every proportion (the gap grows like the log of the stratum size, eg. at most 3 lines at 100k).
+    Returns a DataPackage of lazy JSONLRecords over the written files.
+    """
+    out_path = Path(out_path) if out_path is not None else UNIVERSAL_FINAL_FOLDER
+    subproportions = sorted(subproportions)
+    rng = np.random.default_rng(seed)
+    stratum_offsets = {} # stratum : (random offset, lines seen)
+
+    writers = {}
+    counts = {proportion: 0 for proportion in subproportions}
+    try:
+        for proportion in subproportions:
+            writers[proportion] = (
+                open(out_path / f"{train_plan}_train_{str(proportion)}.jsonl", 'w'), 
+                open(out_path / f"{train_plan}_train_{str(proportion)}_meta.jsonl", 'w')
+            )
+        with open(train_path, 'r') as train_f, open(train_meta_path, 'r') as meta_f:
+            for line, meta_line in zip(train_f, meta_f):
+                if stratify_on:
+                    stratum = _stratum_key(json.loads(line), json.loads(meta_line), stratify_on)
+                    if stratum not in stratum_offsets:
+                        stratum_offsets[stratum] = [rng.random(), 0]
+                    offset, seen = stratum_offsets[stratum]
+                    threshold = (offset + seen * GOLDEN_RATIO_CONJ) % 1.0
+                    stratum_offsets[stratum][1] += 1
+                else:
+                    threshold = rng.random()
+                for proportion in subproportions:
+                    if threshold < proportion:
+                        writers[proportion][0].write(line)
+                        writers[proportion][1].write(meta_line)
+                        counts[proportion] += 1
+    finally:
+        for data_writer, meta_writer in writers.values():
+            data_writer.close()
+            meta_writer.close()
+
+    if verbose:
+        if stratify_on: print(f"(stream_subdivide_training_set) stratified on {list(stratify_on)} across {len(stratum_offsets)} strata")
+        for proportion in subproportions:
+            print(f"(stream_subdivide_training_set) Saved {counts[proportion]} examples to {writers[proportion][0].name}")
+
+    out_pack = DataPackage('multiple, combined', train_plan, 'multiple, combined')
+    for proportion in subproportions:
+        out_pack[f"train_{str(proportion)}"] = JSONLRecords(Path(writers[proportion][0].name), offset=0, count=counts[proportion])
+        out_pack[f"train_{str(proportion)}_meta"] = JSONLRecords(Path(writers[proportion][1].name), offset=0, count=counts[proportion])
+    return out_pack
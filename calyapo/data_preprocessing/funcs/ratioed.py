@@ -1,9 +1,10 @@
+import json
 import pandas as pd
 import numpy as np
 from typing import Union, List, Dict, Iterable
 from collections import defaultdict
 
-from calyapo.data_preprocessing.cleaning_objects import DataPackage, Individual
+from calyapo.data_preprocessing.cleaning_objects import DataPackage, Individual, CompactIndividual
 from calyapo.configurations.config import UNIVERSAL_NA_FILLER
 from calyapo.utils.sampling import *
 from calyapo.utils.persistence import *
@@ -57,6 +58,190 @@ def indiv_valid_response(indiv_map: Dict, splt: Union[str|Iterable[str]], check:
 
     return has_data
 
+def validity_index_path(path: Path) -> Path:
+    """Validity index persisted next to a fullsplit package, eg. plan_IGS_fullsplit.json -> plan_IGS_fullsplit.validity.npz"""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.validity.npz")
+
+class ValidityIndex:
+    SPLITS = ('train', 'val', 'test')
+
+    def __init__(self, uniqueids: List, columns: List[tuple], present: np.ndarray, valid: np.ndarray, positions: np.ndarray = None, row_of_position: np.ndarray = None, source_digest: str = None):
+        """
+        Respondent x (split, question) bitmaps built in one pass over indiv maps. 
+        present marks the questions in an individual's option maps, valid the ones answered (option letter not NA), so valid implies present.
+        Repeated uniqueids share a row. positions is the first input position of each row, row_of_position the row of every input position.
+        indiv_valid_response over any split combination becomes a mask over these, see mask().
+        source_digest is the file_digest of the fullpack the index was built from, saved with it so load_fresh can tell a stale index apart.
+        """
+        self.uniqueids = list(uniqueids)
+        self.columns = [tuple(col) for col in columns]
+        self.present = present
+        self.valid = valid
+        self.positions = positions
+        self.row_of_position = row_of_position
+        self.source_digest = source_digest
+        self._row_of = {uid: row for row, uid in enumerate(self.uniqueids)}
+        self._split_cols = {
+            split: np.array([i for i, (col_split, _) in enumerate(self.columns) if col_split == split], dtype=np.intp) 
+            for split in self.SPLITS
+        }
+
+    def __len__(self):
+        return len(self.uniqueids)
+
+    @classmethod
+    def build(cls, indiv_maps: Iterable[Dict], splits: Iterable[str] = SPLITS) -> 'ValidityIndex':
+        uniqueids = []
+        row_of = {}
+        row_of_position = []
+        positions = []
+        col_of = {}
+        present_rows, present_cols = [], []
+        valid_rows, valid_cols = [], []
+        for pos, indiv_map in enumerate(indiv_maps):
+            uid = get_unique_id(indiv_map)
+            row = row_of.get(uid)
+            if row is None:
+                row = row_of[uid] = len(uniqueids)
+                uniqueids.append(uid)
+                positions.append(pos)
+            row_of_position.append(row)
+            for split in splits:
+                if isinstance(indiv_map, CompactIndividual):
+                    # straight off the option codes
+                    answers = indiv_map.layout.answered(split, indiv_map.codes)
+                else:
+                    option_map = indiv_map.get(split, {}).get('var_label2qst_option', {})
+                    answers = ((var_label, opt.get('option_letter') != UNIVERSAL_NA_FILLER) for var_label, opt in option_map.items())
+                for var_label, answered in answers:
+                    col = col_of.get((split, var_label))
+                    if col is None:
+                        col = col_of[(split, var_label)] = len(col_of)
+                    present_rows.append(row)
+                    present_cols.append(col)
+                    if answered:
+                        valid_rows.append(row)
+                        valid_cols.append(col)
+        present = np.zeros((len(uniqueids), len(col_of)), dtype=bool)
+        valid = np.zeros((len(uniqueids), len(col_of)), dtype=bool)
+        present[present_rows, present_cols] = True
+        valid[valid_rows, valid_cols] = True
+        return cls(
+            uniqueids=uniqueids, 
+            columns=list(col_of.keys()), 
+            present=present, 
+            valid=valid, 
+            positions=np.array(positions, dtype=np.intp), 
+            row_of_position=np.array(row_of_position, dtype=np.intp)
+        )
+
+    def mask(self, splt: Union[str|Iterable[str]], check: str = None) -> np.ndarray:
+        """Row mask equal to indiv_valid_response(indiv_map, splt, check) for every indexed individual."""
+        if check is None:
+            check = 'all'
+        splts = [splt] if isinstance(splt, str) else list(splt)
+        out = np.ones(len(self), dtype=bool)
+        for curr_split in splts:
+            cols = self._split_cols.get(curr_split, np.array([], dtype=np.intp))
+            if check == 'all':
+                # every question the individual was asked is answered, vacuously true with no questions
+                out &= ~(self.present[:, cols] & ~self.valid[:, cols]).any(axis=1)
+            elif check == 'any':
+                out &= self.valid[:, cols].any(axis=1)
+            else:
+                raise ValueError(f"(ValidityIndex) Unknown check '{check}'")
+        return out
+
+    def rows(self, indiv_maps: Iterable[Dict]) -> np.ndarray:
+        """Hash lookup of each indiv map's row, -1 if its uniqueid isn't indexed."""
+        return np.array([self._row_of.get(get_unique_id(indiv_map), -1) for indiv_map in indiv_maps], dtype=np.intp)
+
+    def merge(self, other: 'ValidityIndex') -> 'ValidityIndex':
+        """Index over this index's indiv maps followed by other's (eg. a newly appended wave). Uniqueids of other already indexed share their row."""
+        columns = self.columns + [col for col in other.columns if col not in set(self.columns)]
+        col_of = {col: i for i, col in enumerate(columns)}
+        other_cols = np.array([col_of[col] for col in other.columns], dtype=np.intp)
+        other_rows = np.array([self._row_of.get(uid, -1) for uid in other.uniqueids], dtype=np.intp)
+        new_rows = np.flatnonzero(other_rows < 0)
+        other_rows[new_rows] = len(self) + np.arange(len(new_rows))
+        num_rows = len(self) + len(new_rows)
+
+        merged = {}
+        for name in ['present', 'valid']:
+            bits = np.zeros((num_rows, len(columns)), dtype=bool)
+            bits[:len(self), :len(self.columns)] = getattr(self, name)
+            bits[other_rows[:, None], other_cols[None, :]] |= getattr(other, name)
+            merged[name] = bits
+        offset = len(self.row_of_position) if self.row_of_position is not None else 0
+        positions = None
+        if self.positions is not None and other.positions is not None:
+            positions = np.concatenate([self.positions, other.positions[new_rows] + offset])
+        row_of_position = None
+        if self.row_of_position is not None and other.row_of_position is not None:
+            row_of_position = np.concatenate([self.row_of_position, other_rows[other.row_of_position]])
+        return ValidityIndex(
+            uniqueids=self.uniqueids + [other.uniqueids[i] for i in new_rows], 
+            columns=columns, 
+            present=merged['present'], 
+            valid=merged['valid'], 
+            positions=positions, 
+            row_of_position=row_of_position
+        )
+
+    # --------------
+    # Persistence
+    # --------------
+    def save(self, path: Path):
+        uniqueids = [uid.item() if isinstance(uid, np.generic) else uid for uid in self.uniqueids]
+        header = {'uniqueids' : uniqueids, 'columns' : self.columns, 'source_digest' : self.source_digest}
+        np.savez_compressed(
+            path, 
+            header=np.array(json.dumps(header)), 
+            shape=np.array(self.present.shape), 
+            present=np.packbits(self.present, axis=None), 
+            valid=np.packbits(self.valid, axis=None), 
+            positions=self.positions if self.positions is not None else np.array([], dtype=np.intp), 
+            row_of_position=self.row_of_position if self.row_of_position is not None else np.array([], dtype=np.intp)
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> 'ValidityIndex':
+        with np.load(path) as npz:
+            header = json.loads(str(npz['header']))
+            shape = tuple(npz['shape'])
+            size = int(np.prod(shape))
+            return cls(
+                uniqueids=header['uniqueids'], 
+                columns=header['columns'], 
+                present=np.unpackbits(npz['present'], count=size).astype(bool).reshape(shape), 
+                valid=np.unpackbits(npz['valid'], count=size).astype(bool).reshape(shape), 
+                positions=npz['positions'], 
+                row_of_position=npz['row_of_position'], 
+                source_digest=header.get('source_digest')
+            )
+
+    @classmethod
+    def load_fresh(cls, path: Path, source_digest: str) -> 'ValidityIndex':
+        """Saved index at path if it was built from the fullpack with this source_digest, None if it's missing or stale."""
+        if source_digest is None or not Path(path).exists():
+            return None
+        index = cls.load(path)
+        return index if index.source_digest == source_digest else None
+
+SPLIT_MODES = ('random', 'stratified', 'hash')
+
+def demographic_strata(indiv_maps: Iterable[Dict], demo_labels: Iterable[str]) -> np.ndarray:
+    """Integer cell code per indiv map, one cell per distinct combination of its demographics on demo_labels. Missing labels count as NA."""
+    demo_labels = list(demo_labels)
+    indiv_maps = indiv_maps if isinstance(indiv_maps, list) else list(indiv_maps)
+    if not indiv_maps or not demo_labels:
+        return np.zeros(len(indiv_maps), dtype=np.int64)
+    values = np.array([[str(indiv_map['demog'].get(label, UNIVERSAL_NA_FILLER)) for label in demo_labels] for indiv_map in indiv_maps], dtype=str)
+    # code each label's column, then each row of codes
+    label_codes = np.stack([np.unique(values[:, j], return_inverse=True)[1].reshape(-1) for j in range(len(demo_labels))], axis=1)
+    return np.unique(label_codes, axis=0, return_inverse=True)[1].reshape(-1).astype(np.int64)
+
 def split_ratio(
         package: DataPackage, 
         target_ratios: Dict[str, float], 
@@ -66,6 +251,12 @@ def split_ratio(
         valid_indiv_setting: str = None, 
         out_path: str = None, 
         seed: int = 42, 
+        persistence_format: str = 'json', 
+        validity_index: ValidityIndex = None, 
+        source_digest: str = None, 
+        split_mode: str = 'random', 
+        stratify_on: Iterable[str] = None, 
+        min_cell_count: int = 0, 
         save: bool = False, 
         debug: bool = False, 
         verbose: bool = False 
@@ -76,6 +267,14 @@ def split_ratio(
     => only select individuals who responded to ALL questions into the validation set. 
 
     Output must put it each unique value into a particular split (train/val/test) with no overlaps in Train Settings 1 and 2
+    Validity is checked with masks over a ValidityIndex of package['full'], built here if not passed in and saved next to the fullsplit.
+    source_digest (file_digest of the fullpack package came from) is saved with the index so later runs on the same fullpack can reuse it.
+    A lazy package['full'] (eg. a JSONLRecords fullpack) is read into a list here, splits pick individuals by position so this stage doesn't stream.
+
+    split_mode 'stratified' splits every demographic cell of stratify_on (eg. ['age', 'partyid']) by the target ratios instead of the whole pool, 
+    with at least min_cell_count of each cell in val and test where the cell allows, taken out of the larger cells' shares so split sizes keep their ratios. 
+    Raises if the minimums need more than a split's share. Train Setting 3 always uses the hierarchal sampler.
+    split_mode 'hash' assigns splits from a hash of each uniqueid and the seed (see hash_split_ratio) so row order doesn't matter.
     """
     def construct_meta(package: DataPackage, split: str, debug: bool = False, verbose: bool = False):
         meta = []
@@ -99,54 +298,72 @@ def split_ratio(
             )
             print(f"(split_ratio | Debug) Length of all splits equal: '{test}'")
 
+    if split_mode not in SPLIT_MODES:
+        raise ValueError(f"(split_ratio) Unknown split mode '{split_mode}'. Choose from: {list(SPLIT_MODES)}")
+    stratified = split_mode == 'stratified'
+    if stratified and not stratify_on:
+        raise ValueError(f"(split_ratio) Stratified split mode needs demographic labels to stratify on")
+
     rng = np.random.default_rng(seed)
+    full_maps = package['full'] if isinstance(package['full'], list) else list(package['full'])
+    if validity_index is None:
+        validity_index = ValidityIndex.build(full_maps)
+    position_mask = lambda splt: validity_index.mask(splt, check=valid_indiv_setting)[validity_index.row_of_position]
 
-    if homogenous_plan and not ques_split_varying or train_setting == 1:
+    if split_mode == 'hash':
+        if debug:
+            print(f"(split_ratio| Debug) Hash split mode, splitting by uniqueid hash")
+        outPack = hash_split_ratio(
+            package=package, 
+            target_ratios=target_ratios, 
+            homogenous_plan=homogenous_plan, 
+            ques_split_varying=ques_split_varying, 
+            train_setting=train_setting, 
+            valid_indiv_setting=valid_indiv_setting, 
+            seed=seed, 
+            validity_index=validity_index, 
+            debug=debug, 
+            verbose=verbose
+        )
+    elif homogenous_plan and not ques_split_varying or train_setting == 1:
         if debug:
             print(f"(split_ratio| Debug) Train Setting 1: Same question, new individual processing active")
         # if you are train, val, testing on the exact same question => exact same variable label
 
-        # remove individuals without a valid response
-        all_valid_indivs = []
-        seen = set()
-        for indiv_map in package['full']:
-            id = get_unique_id(indiv_map)
-            
-            if id in seen:
-                continue
-
-            # doesn't matter which split, all the questions will be the same
-            if indiv_valid_response(indiv_map=indiv_map, splt='train', check=valid_indiv_setting, debug=debug):
-                all_valid_indivs.append(indiv_map)
+        # remove individuals without a valid response, keeping each uniqueid's first indiv map
+        # doesn't matter which split, all the questions will be the same
+        valid_rows = validity_index.mask('train', check=valid_indiv_setting)
+        all_valid_indivs = [full_maps[pos] for pos in validity_index.positions[valid_rows]]
 
         if debug:
             print(f"(split_ratio| Debug) num unique individuals: '{len(all_valid_indivs)}'\n(split_ratio| Debug) length of initial package: '{len(package['full'])}'")
         
-        indices = rng.permutation(len(all_valid_indivs)) # shuffle using more up to date numpy rng generator
-        
-        n = len(all_valid_indivs)
-        train_end = int(n * target_ratios['train'])
-        val_end = train_end + int(n * target_ratios['val'])
-        
         outPack = DataPackage(package.dataset_name, package.train_plan, package.time_period)
-        outPack['train'] = [all_valid_indivs[i] for i in indices[:train_end]]
-        outPack['val'] = [all_valid_indivs[i] for i in indices[train_end:val_end]]
-        outPack['test'] = [all_valid_indivs[i] for i in indices[val_end:]]
+        if stratified:
+            strata = demographic_strata(all_valid_indivs, stratify_on)
+            assignment = stratified_assign(strata, target_ratios, min_cell_count=min_cell_count, rng=rng)
+            if verbose: print(f"(split_ratio) Stratified {len(all_valid_indivs)} individuals across {len(np.unique(strata))} demographic cells")
+            for split_idx, splt in enumerate(['train', 'val', 'test']):
+                outPack[splt] = [all_valid_indivs[i] for i in np.flatnonzero(assignment == split_idx)]
+        else:
+            indices = rng.permutation(len(all_valid_indivs)) # shuffle using more up to date numpy rng generator
+            
+            n = len(all_valid_indivs)
+            train_end = int(n * target_ratios['train'])
+            val_end = train_end + int(n * target_ratios['val'])
+            
+            outPack['train'] = [all_valid_indivs[i] for i in indices[:train_end]]
+            outPack['val'] = [all_valid_indivs[i] for i in indices[train_end:val_end]]
+            outPack['test'] = [all_valid_indivs[i] for i in indices[val_end:]]
         
     elif train_setting == 2:
         if debug:
             print(f"(split_ratio| Debug) Train Setting 2: New question, same individual processing active")
 
-        train_valid_indivs = []
-        val_valid_indivs = []
-        test_valid_indivs = []
-        for indiv_map in package['full']:
-            if indiv_valid_response(indiv_map=indiv_map, splt='train', check=valid_indiv_setting, debug=debug):
-                train_valid_indivs.append(indiv_map)
-            if indiv_valid_response(indiv_map=indiv_map, splt=['train', 'val'], check=valid_indiv_setting, debug=debug):
-                val_valid_indivs.append(indiv_map)
-            if indiv_valid_response(indiv_map=indiv_map, splt=['train', 'test'], check=valid_indiv_setting, debug=debug):
-                test_valid_indivs.append(indiv_map)
+        train_mask = position_mask('train')
+        train_valid_indivs = [full_maps[pos] for pos in np.flatnonzero(train_mask)]
+        val_valid_indivs = [full_maps[pos] for pos in np.flatnonzero(train_mask & position_mask('val'))]
+        test_valid_indivs = [full_maps[pos] for pos in np.flatnonzero(train_mask & position_mask('test'))]
 
         if debug:
             print(f"(split_ratio| Debug) num train individuals: '{len(train_valid_indivs)}'\n(split_ratio| Debug) num val individuals: '{len(val_valid_indivs)}'\n(split_ratio| Debug) num val individuals: '{len(test_valid_indivs)}'")
@@ -157,8 +374,13 @@ def split_ratio(
         num_train = len(train_valid_indivs)
         val_size = int(num_train * target_ratios['val'])
         test_size = int(num_train * target_ratios['test'])
-        val_idx = rng.choice(len(val_valid_indivs), size=min(len(val_valid_indivs), val_size), replace=False)
-        test_idx = rng.choice(len(test_valid_indivs), size=min(len(test_valid_indivs), test_size), replace=False)
+        if stratified:
+            # same sizes, drawn proportionally from every demographic cell
+            val_idx = stratified_choice(demographic_strata(val_valid_indivs, stratify_on), size=val_size, min_cell_count=min_cell_count, rng=rng)
+            test_idx = stratified_choice(demographic_strata(test_valid_indivs, stratify_on), size=test_size, min_cell_count=min_cell_count, rng=rng)
+        else:
+            val_idx = rng.choice(len(val_valid_indivs), size=min(len(val_valid_indivs), val_size), replace=False)
+            test_idx = rng.choice(len(test_valid_indivs), size=min(len(test_valid_indivs), test_size), replace=False)
 
         outPack = DataPackage(package.dataset_name, package.train_plan, package.time_period)
         outPack['train'] = train_valid_indivs
@@ -174,23 +396,23 @@ def split_ratio(
 
         if debug:
             print(f"(split_ratio| Debug) Train Setting 3: New question, new individual processing active")
+        if stratified:
+            print(f"(split_ratio) Stratified split mode not supported on Train Setting 3, using the hierarchal sampler")
         sets = ['train', 'val', 'test']
         splits: List[Dict] = [0] * 3
         for i in range(len(sets)):
             spl = sets[i]
-            valid_indivs = [] # assemble all the individual ids
-            for indiv_map in package[spl]:
-                indiv_map: Dict
-                if indiv_valid_response(indiv_map=indiv_map, splt=spl, check=valid_indiv_setting, debug=debug):
-                    all_valid_indivs.append(indiv_map)
-            
-            splits[i] = valid_indivs
+            split_maps = package[spl] if isinstance(package[spl], list) else list(package[spl])
+            # split maps are looked up by uniqueid, they don't need to line up with package['full']
+            rows = validity_index.rows(split_maps)
+            split_valid = validity_index.mask(spl, check=valid_indiv_setting)
+            splits[i] = [split_maps[pos] for pos in np.flatnonzero((rows >= 0) & split_valid[rows])]
 
         if debug:
             print(f"(split_ratio | Debug) num datapoints per split:\nTrain: '{len(splits[0])}'\nVal: '{len(splits[1])}'\nTest: '{len(splits[2])}'")
         unpacked_distribution = [target_ratios['train'], target_ratios['val'], target_ratios['test']]
         min_bucket_idx = np.argmin([len(splits[i]) for i in range(len(splits))])
-        sampler_output = exhaustive_hierarchal_sample(value_buckets=splits, targ_bucket_idx=min_bucket_idx, bucket_distrib=unpacked_distribution, debug=debug)
+        sampler_output = exhaustive_hierarchal_sample(value_buckets=splits, targ_bucket_idx=min_bucket_idx, bucket_distrib=unpacked_distribution, rng=rng, debug=debug)
 
         outPack = DataPackage(package.dataset_name, package.train_plan, package.time_period)
         outPack['train'] = sampler_output[0]
@@ -202,48 +424,123 @@ def split_ratio(
     if save:
         assert out_path is not None, f"(split_ratio) Cannot save if out_path not specified"
         
-        file_name = f"{package.train_plan}_{package.dataset_name}_fullsplit.json"
+        suffix, data_type = PACKAGE_FORMATS[persistence_format]
+        file_name = f"{package.train_plan}_{package.dataset_name}_fullsplit{suffix}"
         full_path = Path(out_path) / file_name
-        file_saver(out_path=full_path, data=outPack, data_type='DataPackage', indnt=2, verbose=verbose)
+        file_saver(out_path=full_path, data=outPack, data_type=data_type, indnt=2, verbose=verbose)
+        validity_index.source_digest = source_digest
+        validity_index.save(validity_index_path(full_path))
+        if verbose: print(f"(split_ratio) Validity index saved to: {validity_index_path(full_path)}")
 
     return outPack
 
-def split_ratio_validator(pack: DataPackage, valid_indiv_setting: str = None, verbose: bool = False, debug: bool = False):
+def hash_split_ratio(
+        package: DataPackage, 
+        target_ratios: Dict[str, float], 
+        homogenous_plan: bool, 
+        ques_split_varying: bool, 
+        train_setting: int, 
+        valid_indiv_setting: str = None, 
+        seed: int = 42, 
+        validity_index: ValidityIndex = None, 
+        debug: bool = False, 
+        verbose: bool = False 
+    ) -> DataPackage:
+    """
+    Splits package['full'] (eg. a whole dataset or one newly ingested wave) with a uid_uniform draw per uniqueid instead of a permutation, 
+    so an individual's split doesn't depend on row order or on which other individuals are being split alongside them. 
+    Draws are hashed once per ValidityIndex row over the whole id column.
+    Train Setting 1 cuts each draw at the train/val/test ratios, a pure function of uniqueid and seed. 
+    Train Setting 2 keeps every valid individual in train and takes val and test from independent draws, 
+    thresholded so their sizes match split_ratio's (a ratio of the train size), so only the threshold depends on the pool sizes. 
+    Train Setting 3 needs every split's pool at once and isn't supported.
+    Like split_ratio, a lazy package['full'] is read into a list.
+    """
+    full_maps = package['full'] if isinstance(package['full'], list) else list(package['full'])
+    if validity_index is None:
+        validity_index = ValidityIndex.build(full_maps)
+    outPack = DataPackage(package.dataset_name, package.train_plan, package.time_period)
+    row_draws = lambda salt: uid_uniform(validity_index.uniqueids, seed=seed, salt=salt)
+
+    if homogenous_plan and not ques_split_varying or train_setting == 1:
+        valid_rows = validity_index.mask('train', check=valid_indiv_setting)
+        positions = validity_index.positions[valid_rows]
+        draws = row_draws('')[valid_rows]
+        train_end = target_ratios['train']
+        val_end = train_end + target_ratios['val']
+        outPack['train'] = [full_maps[pos] for pos in positions[draws < train_end]]
+        outPack['val'] = [full_maps[pos] for pos in positions[(draws >= train_end) & (draws < val_end)]]
+        outPack['test'] = [full_maps[pos] for pos in positions[draws >= val_end]]
+    elif train_setting == 2:
+        position_mask = lambda splt: validity_index.mask(splt, check=valid_indiv_setting)[validity_index.row_of_position]
+        train_mask = position_mask('train')
+        train_positions = np.flatnonzero(train_mask)
+        outPack['train'] = [full_maps[pos] for pos in train_positions]
+        for splt in ['val', 'test']:
+            split_positions = np.flatnonzero(train_mask & position_mask(splt))
+            if len(split_positions) == 0:
+                outPack[splt] = []
+                continue
+            threshold = len(train_positions) * target_ratios[splt] / len(split_positions)
+            draws = row_draws(splt)[validity_index.row_of_position[split_positions]] # val and test drawn independently, like split_ratio
+            outPack[splt] = [full_maps[pos] for pos in split_positions[draws < threshold]]
+    else:
+        raise ValueError(f"(hash_split_ratio) Train Setting 3 splits need every split's pool at once and can't be hashed per individual")
+
+    if debug:
+        print(f"(hash_split_ratio | Debug) num datapoints per split:\nTrain: '{len(outPack['train'])}'\nVal: '{len(outPack['val'])}'\nTest: '{len(outPack['test'])}'")
+    if verbose:
+        print(f"(hash_split_ratio) Split {len(full_maps)} indiv maps by uniqueid hash")
+    return outPack
+
+def split_ratio_validator(pack: DataPackage, valid_indiv_setting: str = None, validity_index: ValidityIndex = None, verbose: bool = False, debug: bool = False):
     """
     Ensures every unique individual exists in exactly one split with no overlaps.
     Catch both duplicates within a set and leakage across sets.
+    Appearances are counted over ValidityIndex rows, so only offending individuals are walked to build the error report.
+    Lazy splits (eg. JSONLRecords) are read into lists.
 
     TODO: Build out to also validate training setting #2 to make sure individuals in test are also in train
     """
-    id_registry = defaultdict(list) # maps individuals : splits they're in
-    
-    splits = ['train', 'val', 'test']
-    
-    # append all the individuals into a registry first
-    for splt in splits:
-        if splt not in pack:
-            if verbose: print(f"(split_ratio_validator | INFO) split '{splt}' missing from package keys")
-            continue
-            
-        # handles for individuals being in train multiple times
-        for indiv_map in pack[splt]:
-            indiv_id = get_unique_id(indiv_map)
-            id_registry[indiv_id].append(splt)
-            if not indiv_valid_response(indiv_map=indiv_map, splt=splt, check=valid_indiv_setting, debug=debug):
-                id_registry[indiv_id].append(f"{splt}-contains NaN")
-
-    leaks = {
-        idx: appearances 
-        for idx, appearances in id_registry.items() 
-        if len(appearances) > 1
-    }
-
-    if leaks:
-        error_report = "\n".join([f"ID {k}: found in {v}" for k, v in leaks.items()])
+    splits = [splt for splt in ['train', 'val', 'test'] if splt in pack]
+    for splt in ['train', 'val', 'test']:
+        if splt not in pack and verbose: 
+            print(f"(split_ratio_validator | INFO) split '{splt}' missing from package keys")
+    split_maps = {splt: pack[splt] if isinstance(pack[splt], list) else list(pack[splt]) for splt in splits}
+
+    split_rows = {}
+    if validity_index is not None:
+        split_rows = {splt: validity_index.rows(maps) for splt, maps in split_maps.items()}
+    if validity_index is None or any((rows < 0).any() for rows in split_rows.values()):
+        # index the package itself, split maps of the same individual share a row
+        validity_index = ValidityIndex.build(indiv_map for maps in split_maps.values() for indiv_map in maps)
+        split_rows = {splt: validity_index.rows(maps) for splt, maps in split_maps.items()}
+
+    # appearances per individual, an invalid response counts as an extra appearance
+    appearances = np.zeros(len(validity_index), dtype=np.int64)
+    invalid = {}
+    for splt, rows in split_rows.items():
+        appearances += np.bincount(rows, minlength=len(validity_index))
+        invalid[splt] = rows[~validity_index.mask(splt, check=valid_indiv_setting)[rows]]
+        appearances += np.bincount(invalid[splt], minlength=len(validity_index))
+
+    leak_rows = np.flatnonzero(appearances > 1)
+    if len(leak_rows):
+        leak_set = set(leak_rows.tolist())
+        id_registry = defaultdict(list) # maps offending individuals : splits they're in
+        for splt, rows in split_rows.items():
+            invalid_set = set(invalid[splt].tolist())
+            for row in rows.tolist():
+                if row in leak_set:
+                    indiv_id = validity_index.uniqueids[row]
+                    id_registry[indiv_id].append(splt)
+                    if row in invalid_set:
+                        id_registry[indiv_id].append(f"{splt}-contains NaN")
+        error_report = "\n".join([f"ID {k}: found in {v}" for k, v in id_registry.items()])
         msg = f"(split_ratio_validator | ERROR) Data leakage/duplicates detected!\n{error_report}"
         
         raise ValueError(msg)
     
     if verbose:
-        total_unique = len(id_registry)
+        total_unique = int((appearances > 0).sum())
         print(f"(split_ratio_validator | SUCCESS) No leakage detected across {total_unique} individuals.")
@@ -1,15 +1,33 @@
 import pandas as pd
 import numpy as np
-from typing import List, Union
+from typing import List, Union, Iterable
 from pathlib import Path
 
 from calyapo.configurations.config import IGS_RACE_MAP, UNIVERSAL_NA_FILLER
 from calyapo.configurations.data_mappings import IGS_MAPS
+from calyapo.configurations.data_map_config import ALL_DATA_MAPS
 from calyapo.data_preprocessing.cleaning_objects import unique_id_generator
 
 from calyapo.data_preprocessing.cleaning_objects import DataPackage
 from calyapo.utils.persistence import *
 
+def required_raw_columns(dataset_name: str, labels: Iterable[str] = None) -> List[str]:
+    """
+    Raw columns the cleaning and splitting stages ever read for a dataset, across all of its time periods.
+    That is every var2label column (or just those mapping to labels, eg. a train plan's labels), 
+    each wave's id column, and for IGS the race indicator columns collapsed into racial_id.
+    """
+    labels = set(labels) if labels is not None else None
+    columns = set()
+    for maps in ALL_DATA_MAPS.get(dataset_name, {}).values():
+        for var, label in maps.get('var2label', {}).items():
+            if labels is None or label in labels or label == 'dataset_id':
+                columns.add(var)
+    if dataset_name == 'IGS':
+        for race_map in IGS_RACE_MAP.values():
+            columns.update(race_map.keys())
+    return sorted(columns)
+
 def _process_single_df(df: pd.DataFrame, period: str, mode: str = 'IGS', debug: bool = False) -> pd.DataFrame:
     """
     Hidden helper: Performs the actual vectorized race collapse and metadata tagging.
@@ -56,6 +74,7 @@ def _process_single_df(df: pd.DataFrame, period: str, mode: str = 'IGS', debug:
 def IGS_raw_clean(
         dataPackage: DataPackage, 
         out_path: str = None, 
+        intermediate_format: str = 'csv', 
         save: bool = False, 
         debug: bool = False, 
         verbose: bool = False
@@ -63,6 +82,7 @@ def IGS_raw_clean(
     """
     Main entry point for IGS cleaning. Handles both single DFs and 
     vectorized lists of DFs (e.g., from a directory load).
+    intermediate_format picks how cleaned waves are saved, see INTERMEDIATE_FORMATS.
     """
     
     data = dataPackage['data'] # list of dataframes for different time periods
@@ -78,15 +98,16 @@ def IGS_raw_clean(
         if save:
             assert out_path is not None, f"(IGS_raw) Cannot save file without valid out path"
                 
-            data_name = out_path / f"IGS_cleaned_{cleaned_df['time_period'].iloc[0]}.csv"
+            data_name = Path(out_path) / f"IGS_cleaned_{cleaned_df['time_period'].iloc[0]}{INTERMEDIATE_FORMATS[intermediate_format]}"
             
-            file_saver(Path(data_name), cleaned_df, 'csv', verbose=verbose)
+            file_saver(Path(data_name), cleaned_df, intermediate_format, verbose=verbose)
     
     return output
 
 def CES_raw_clean(
         dataPackage: DataPackage, 
         out_path: str = None, 
+        intermediate_format: str = 'csv', 
         save: bool = False, 
         debug: bool = False, 
         verbose: bool = False
@@ -94,6 +115,7 @@ def CES_raw_clean(
     """
     Main entry point for CES cleaning. Handles both single DFs and 
     vectorized lists of DFs (e.g., from a directory load).
+    intermediate_format picks how cleaned waves are saved, see INTERMEDIATE_FORMATS.
     """
     
     data = dataPackage['data'] # list of dataframes for different time periods
@@ -109,8 +131,34 @@ def CES_raw_clean(
         if save:
             assert out_path is not None, f"(CES_raw) Cannot save file without valid out path"
                 
-            data_name = out_path / f"CES_cleaned_{cleaned_df['time_period'].iloc[0]}.csv"
+            data_name = Path(out_path) / f"CES_cleaned_{cleaned_df['time_period'].iloc[0]}{INTERMEDIATE_FORMATS[intermediate_format]}"
             
-            file_saver(Path(data_name), cleaned_df, 'csv', verbose=verbose)
+            file_saver(Path(data_name), cleaned_df, intermediate_format, verbose=verbose)
     
-    return output
\ No newline at end of file
+    return output
+
+def raw_clean_file(
+        file_path: Path, 
+        dataset_name: str, 
+        path_extract: str, 
+        out_path: str = None, 
+        intermediate_format: str = 'csv', 
+        columns: Iterable[str] = None, 
+        save: bool = False, 
+        debug: bool = False, 
+        verbose: bool = False
+    ) -> pd.DataFrame:
+    """
+    Loads and raw cleans a single wave file. 
+    Module level so RawHandler can fan waves out across worker processes.
+    If columns is given, only those raw columns are loaded.
+    """
+    data, time_period = file_loader(in_path=Path(file_path), data_type=['csv', 'dta'], path_extract=path_extract, columns=columns, debug=debug, verbose=verbose)
+    inpack = DataPackage(
+        dataset_name=dataset_name, 
+        train_plan='N/A, this is a raw cleaning inpack', 
+        time_period=time_period, 
+    )
+    inpack['data'] = [data]
+    inpack['time_periods'] = [time_period]
+    return IGS_raw_clean(dataPackage=inpack, out_path=out_path, intermediate_format=intermediate_format, save=save, debug=debug, verbose=verbose)[0]
@@ -1,6 +1,10 @@
+import re
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
-from calyapo.configurations.config import DATA_PATHS
+from calyapo.configurations.config import DATA_PATHS, IGS_RACE_MAP
+from calyapo.configurations.data_map_config import ALL_DATA_MAPS
 from calyapo.configurations.data_map_config import TRAIN_PLANS
 from calyapo.data_preprocessing.funcs.raw_cleaners import *
 from calyapo.data_preprocessing.cleaning_objects import DataPackage
@@ -13,8 +17,27 @@ class RawHandler:
     """
     NAME = 'Raw Handler'
 
-    def __init__(self, special_cond: str = None):
+    def __init__(self, special_cond: str = None, num_workers: int = None, intermediate_format: str = 'csv', project_columns: bool = False, train_plan: str = None, sort_files: bool = False):
         self.special_cond = special_cond
+        self.num_workers = num_workers # >1 loads and cleans each wave in its own process
+        validate_intermediate_format(intermediate_format)
+        self.intermediate_format = intermediate_format # 'columnar'/'parquet' keep dtypes and allow column-projected reads
+        self.project_columns = project_columns # only load the raw columns the dataset maps (or train_plan if given) use
+        if train_plan is not None and train_plan not in TRAIN_PLANS:
+            raise ValueError(f"(Raw Handler) Unknown train plan '{train_plan}'")
+        self.train_plan = train_plan
+        self.sort_files = sort_files # load waves in file name order instead of filesystem order, can reassign existing splits
+
+    def raw_columns(self, dataset_name: str) -> List[str]:
+        """Columns to load from raw files, None loads every column."""
+        if not self.project_columns:
+            return None
+        labels = None
+        if self.train_plan is not None:
+            labels = set()
+            for var_labels in TRAIN_PLANS[self.train_plan]['variable_map'].values():
+                labels.update(var_labels)
+        return required_raw_columns(dataset_name, labels=labels)
 
     def clean_dataset(
             self, 
@@ -33,20 +56,95 @@ class RawHandler:
             out_path = DATA_PATHS[dataset_name]['intermediate']
 
         end_of_str_time_pat = r'_([^_]+)\.'
-        data, time_periods = file_loader(in_path=in_path, data_type=['csv', 'dta'], path_extract=end_of_str_time_pat, always_return_lst=True, debug=debug, verbose=verbose)
-        inpack = DataPackage(
-            dataset_name=dataset_name, 
-            train_plan='N/A, this is a raw cleaning inpack', 
-            time_period='multiple, this is a raw cleaning inpack', 
-        )
-        inpack['data'] = data
-        inpack['time_periods'] = time_periods
+        columns = self.raw_columns(dataset_name)
+        if verbose and columns is not None: print(f"(Raw Handler) Projecting raw files down to {len(columns)} columns")
+        if self.num_workers is not None and self.num_workers > 1:
+            # waves are independent, results come back in the same order file_loader would load them
+            target_files = list_target_files(in_path=Path(in_path), data_type=['csv', 'dta'], sort_files=self.sort_files)
+            if verbose: print(f"(Raw Handler) Cleaning {len(target_files)} files across {self.num_workers} workers")
+            worker = partial(raw_clean_file, dataset_name=dataset_name, path_extract=end_of_str_time_pat, out_path=out_path, intermediate_format=self.intermediate_format, columns=columns, save=save, debug=debug, verbose=verbose)
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                raw_cleaned_dfs: List[pd.DataFrame] = list(executor.map(worker, target_files))
+        else:
+            data, time_periods = file_loader(in_path=in_path, data_type=['csv', 'dta'], path_extract=end_of_str_time_pat, always_return_lst=True, columns=columns, sort_files=self.sort_files, debug=debug, verbose=verbose)
+            inpack = DataPackage(
+                dataset_name=dataset_name, 
+                train_plan='N/A, this is a raw cleaning inpack', 
+                time_period='multiple, this is a raw cleaning inpack', 
+            )
+            inpack['data'] = data
+            inpack['time_periods'] = time_periods
 
-        raw_cleaned_dfs: List[pd.DataFrame] = IGS_raw_clean(dataPackage=inpack, out_path=out_path, save=save, debug=debug, verbose=verbose)
+            raw_cleaned_dfs: List[pd.DataFrame] = IGS_raw_clean(dataPackage=inpack, out_path=out_path, intermediate_format=self.intermediate_format, save=save, debug=debug, verbose=verbose)
         outpack = DataPackage(
             dataset_name=dataset_name, 
             train_plan='N/A, this is a raw cleaning outpack', 
             time_period='multiple, this is a raw cleaning outpack', 
         )
         outpack['data'] = raw_cleaned_dfs
-        return outpack
\ No newline at end of file
+        return outpack
+
+    def clean_wave(
+            self, 
+            dataset_name: str, 
+            time_period: str, 
+            in_path: str = None, 
+            out_path: str = None, 
+            save: bool = False, 
+            debug: bool = False, 
+            verbose: bool = False
+        ):
+        """Raw cleans only the file of one wave, eg. a newly added survey wave. Same outpack as clean_dataset."""
+        if in_path is None:
+            in_path = DATA_PATHS[dataset_name]['raw']
+        if out_path is None:
+            out_path = DATA_PATHS[dataset_name]['intermediate']
+
+        end_of_str_time_pat = r'_([^_]+)\.'
+        target_files = [
+            path for path in list_target_files(in_path=Path(in_path), data_type=['csv', 'dta']) 
+            if (match := re.search(end_of_str_time_pat, path.name)) and match.group(1) == str(time_period)
+        ]
+        if not target_files:
+            raise ValueError(f"(Raw Handler) No raw file for wave '{time_period}' of '{dataset_name}' in {in_path}")
+        if verbose: print(f"(Raw Handler) Cleaning wave '{time_period}' from {target_files[0].name}")
+        raw_cleaned_df = raw_clean_file(
+            target_files[0], 
+            dataset_name=dataset_name, 
+            path_extract=end_of_str_time_pat, 
+            out_path=out_path, 
+            intermediate_format=self.intermediate_format, 
+            columns=self.raw_columns(dataset_name), 
+            save=save, 
+            debug=debug, 
+            verbose=verbose
+        )
+        outpack = DataPackage(
+            dataset_name=dataset_name, 
+            train_plan='N/A, this is a raw cleaning outpack', 
+            time_period=time_period, 
+        )
+        outpack['data'] = [raw_cleaned_df]
+        return outpack
+
+    # -----------------
+    # Stage cache funcs
+    # -----------------
+    def stage_files(self, dataset_name: str) -> Tuple[List[Path], List[Path]]:
+        """Returns (inputs, outputs) file paths of clean_dataset for StageCache."""
+        inputs = list_target_files(in_path=DATA_PATHS[dataset_name]['raw'], data_type=['csv', 'dta'])
+        outputs = list(Path(DATA_PATHS[dataset_name]['intermediate']).glob(f"{dataset_name}_cleaned_*{INTERMEDIATE_FORMATS[self.intermediate_format]}"))
+        if self.intermediate_format == 'columnar':
+            outputs += [columnar_schema_path(p) for p in outputs]
+        return inputs, outputs
+
+    def stage_config(self, dataset_name: str) -> Dict:
+        """Config entries clean_dataset depends on, hashed into its StageCache key."""
+        return {
+            'race_map' : IGS_RACE_MAP, 
+            'raw_columns' : self.raw_columns(dataset_name), 
+            'id_cols' : {
+                period: [var for var, label in maps.get('var2label', {}).items() if label == 'dataset_id'] 
+                for period, maps in ALL_DATA_MAPS.get(dataset_name, {}).items()
+            }
+        }
@@ -1,3 +1,6 @@
+import json
+import shutil
+import tempfile
 from typing import List, Dict, Any, Iterable
 from collections import defaultdict
 
@@ -6,8 +9,8 @@ from calyapo.data_preprocessing.funcs.clean_datasets import *
 from calyapo.data_preprocessing.funcs.data_combiner import *
 from calyapo.data_preprocessing.funcs.ratioed import *
 from calyapo.data_preprocessing.raw_handler import RawHandler
-from calyapo.configurations.data_map_config import TRAIN_PLANS
-from calyapo.configurations.config import UNIVERSAL_PENULTIMATE_FOLDER, DATA_PATHS
+from calyapo.configurations.data_map_config import TRAIN_PLANS, ALL_DATA_MAPS, VARLABEL_DESC
+from calyapo.configurations.config import UNIVERSAL_PENULTIMATE_FOLDER, UNIVERSAL_FINAL_FOLDER, UNIVERSAL_NA_FILLER, DATA_PATHS, IGS_SURVEY_WAVE_DESC, POLLING_FIRM_DESC
 from calyapo.utils.persistence import *
 
 class SplitHandler:
@@ -24,7 +27,18 @@ class SplitHandler:
         train_ratio: float = None, 
         val_ratio: float = None, 
         test_ratio: float = None, 
-        seed: int = 42
+        seed: int = 42, 
+        vectorized: bool = False, 
+        compact: bool = False, 
+        num_workers: int = None, 
+        persistence_format: str = 'json', 
+        intermediate_format: str = 'csv', 
+        stream_subproportions: bool = False, 
+        stratify_subproportions: Iterable[str] = None, 
+        split_mode: str = 'random', 
+        stratify_on: Iterable[str] = None, 
+        min_cell_count: int = 0, 
+        sort_files: bool = False
     ):
         
         
@@ -39,6 +53,31 @@ class SplitHandler:
         self.reduction_modifier = self.plan_config.get('reduction_modifier', None)
         self.subproportions = subproportions
         self.seed = seed
+        self.vectorized = vectorized # decode whole columns at once in split_on_questions
+        self.compact = compact # keep indiv maps as CompactIndividual records until serialized
+        self.num_workers = num_workers # >1 splits each wave on questions in its own process
+        if persistence_format not in PACKAGE_FORMATS:
+            raise ValueError(f"(Split Handler) Unknown persistence format '{persistence_format}'. Choose from: {list(PACKAGE_FORMATS.keys())}")
+        self.persistence_format = persistence_format # 'jsonl' streams processed/fullsplit packages to compact JSONL, split_on_ratio still loads the whole fullpack
+        validate_intermediate_format(intermediate_format)
+        self.intermediate_format = intermediate_format # format RawHandler saved the cleaned waves in
+        self.stream_subproportions = stream_subproportions # single pass over the saved train jsonl, nested subsets
+        self.stratify_subproportions = list(stratify_subproportions) if stratify_subproportions else None # meta fields or demographic labels to balance subsets on
+        if self.stratify_subproportions and not self.stream_subproportions:
+            raise ValueError(f"(Split Handler) stratify_subproportions requires stream_subproportions")
+        if split_mode not in SPLIT_MODES:
+            raise ValueError(f"(Split Handler) Unknown split mode '{split_mode}'. Choose from: {list(SPLIT_MODES)}")
+        self.split_mode = split_mode # 'stratified' splits each demographic cell by the ratios, 'hash' splits by uniqueid hash
+        if split_mode == 'stratified':
+            # the cross product of every demographic leaves about one individual per cell, so the labels are picked explicitly
+            if not stratify_on:
+                raise ValueError(f"(Split Handler) Stratified split mode needs stratify_on labels, eg. ['age', 'partyid']. Choose from: {self.variable_map['demo']}")
+            unknown_labels = [label for label in stratify_on if label not in self.variable_map['demo']]
+            if unknown_labels:
+                raise ValueError(f"(Split Handler) Can't stratify on {unknown_labels}, not demographics of train plan '{train_plan}'. Choose from: {self.variable_map['demo']}")
+        self.stratify_on = list(stratify_on) if stratify_on else None # demographic labels whose cross product cells are split by the ratios
+        self.min_cell_count = min_cell_count # least individuals per demographic cell in val and test when stratified
+        self.sort_files = sort_files # reload cleaned waves in file name order, match it with RawHandler's sort_files
 
         self.training_ratios = {
             'train' : float(train_ratio), 
@@ -46,6 +85,17 @@ class SplitHandler:
             'test' : float(test_ratio)
         }
 
+    def _package_path(self, directory: Path, name: str) -> Path:
+        suffix, _ = PACKAGE_FORMATS[self.persistence_format]
+        return Path(directory) / f"{name}{suffix}"
+
+    def _load_package(self, path: Path, verbose: bool = False) -> DataPackage:
+        if self.persistence_format == 'jsonl':
+            # records stay on disk and are decoded lazily as they're iterated
+            return file_loader(in_path=path, data_type='DataPackageJSONL', verbose=verbose)
+        raw_json = file_loader(in_path=path, data_type='json', verbose=verbose)
+        return DataPackage.from_dict(raw_json) 
+
     def split_on_questions(self, package: DataPackage = None, dataset_name: str = None, save: bool = False, debug: bool = False, verbose: bool = False):
         """
         Splits data based on specific questions. 
@@ -57,15 +107,18 @@ class SplitHandler:
             assert dataset_name is not None, f"(Split Handler | Splitting) cannot file pull if no dataset_name given"
             
             interim_in_path = DATA_PATHS[dataset_name]['intermediate']
-            all_in_paths = list(Path(interim_in_path).glob('*.csv'))
+            all_in_paths = list(Path(interim_in_path).glob(f"*{INTERMEDIATE_FORMATS[self.intermediate_format]}"))
+            if self.sort_files:
+                all_in_paths = sorted(all_in_paths) # same wave order as in-memory packages from a sort_files RawHandler
             if all_in_paths is None:
                 # directly call clean funcs
-                rawHand = RawHandler(special_cond = 'fallback handler created in Split Handler Splitting logic')
+                rawHand = RawHandler(special_cond = 'fallback handler created in Split Handler Splitting logic', intermediate_format=self.intermediate_format, sort_files=self.sort_files)
                 tempPack = rawHand.clean_dataset(dataset_name=dataset_name)
                 interim_data = tempPack['data']
             else:
-                # rely on default path pull
-                interim_data = [file_loader(in_path=path, data_type='csv', debug=debug, verbose=verbose) for path in all_in_paths]
+                # rely on default path pull, only reading the columns this plan maps to
+                columns = self._plan_columns(dataset_name)
+                interim_data = [file_loader(in_path=path, data_type=self.intermediate_format, columns=columns, debug=debug, verbose=verbose) for path in all_in_paths]
             if verbose: print(f"(Split Handler | Splitting) Found {len(all_in_paths)} files for {dataset_name}.")
         else:
             # use data passed in-memory
@@ -81,10 +134,17 @@ class SplitHandler:
             reduction_modifier=self.reduction_modifier, 
             out_path=out_path, 
             seed=self.seed, 
+            vectorized=self.vectorized, 
+            compact=self.compact, 
+            num_workers=self.num_workers, 
+            persistence_format=self.persistence_format, 
             save=save, 
             debug=debug, 
             verbose=verbose
         )
+        if save and out_pack is not None:
+            # lets split_on_ratio reuse the validity index saved from this same fullpack
+            out_pack['fullpack_digest'] = file_digest(self._package_path(out_path, f"{self.train_plan}_{dataset_name}_fullpack_processed"))
         # split on questions compiles data from all time periods per dataset
         # train plan is written onto out_pack
         return out_pack
@@ -97,12 +157,12 @@ class SplitHandler:
         if package is None or package['full'] is None:
             # default path pull
             processed_dir = DATA_PATHS[dataset_name]['processed']    
-            target_json = processed_dir / f"{self.train_plan}_{dataset_name}_fullpack_processed.json"
+            target_json = self._package_path(processed_dir, f"{self.train_plan}_{dataset_name}_fullpack_processed")
             
             if target_json.exists():
                 if verbose: print(f"(Split Handler | Ratioing) Loading existing package: {target_json.name}")
-                raw_json = file_loader(in_path=target_json, data_type='json', verbose=verbose)
-                package = DataPackage.from_dict(raw_json) 
+                package = self._load_package(target_json, verbose=verbose)
+                package['fullpack_digest'] = file_digest(target_json)
             else:
                 # if we cannot pull from path generate from scratch
                 if verbose: print(f"(Split Handler | Ratioing) No processed data found. Building steering dataset for {dataset_name}...")
@@ -111,6 +171,16 @@ class SplitHandler:
             data: List[pd.DataFrame] = package['full']
             if verbose: print(f"(Split Handler | Ratioing) Processing {len(data)} individual maps passed in-memory.")
 
+        # one pass over the indiv maps, shared by splitting and validation, unless the last fullsplit saved one for this same fullpack
+        source_digest = package['fullpack_digest'] if 'fullpack_digest' in package else None
+        fullsplit_path = self._package_path(UNIVERSAL_PENULTIMATE_FOLDER, f"{package.train_plan}_{package.dataset_name}_fullsplit")
+        validity_index = ValidityIndex.load_fresh(validity_index_path(fullsplit_path), source_digest)
+        if validity_index is not None:
+            if verbose: print(f"(Split Handler | Ratioing) Loaded validity index of {len(validity_index)} individuals from {validity_index_path(fullsplit_path).name}")
+        else:
+            validity_index = ValidityIndex.build(package['full'])
+            if verbose: print(f"(Split Handler | Ratioing) Indexed validity of {len(validity_index)} individuals over {len(validity_index.columns)} split questions")
+
         out_path = UNIVERSAL_PENULTIMATE_FOLDER
         out_pack = split_ratio(
             package=package, 
@@ -121,13 +191,19 @@ class SplitHandler:
             valid_indiv_setting=self.valid_indiv_setting,
             out_path=out_path, 
             seed=self.seed, 
+            persistence_format=self.persistence_format, 
+            validity_index=validity_index, 
+            source_digest=source_digest, 
+            split_mode=self.split_mode, 
+            stratify_on=self.stratify_on, 
+            min_cell_count=self.min_cell_count, 
             save=save, 
             debug=debug, 
             verbose=verbose
         )
 
         if self.train_setting == 1 or self.train_setting == 3:
-            split_ratio_validator(pack=out_pack, valid_indiv_setting=self.valid_indiv_setting, verbose=verbose, debug=debug)
+            split_ratio_validator(pack=out_pack, valid_indiv_setting=self.valid_indiv_setting, validity_index=validity_index, verbose=verbose, debug=debug)
         else:
             if verbose: print(f"(Split Handler | Ratioing) On training setting {self.train_setting}, validator inactive")
 
@@ -142,11 +218,10 @@ class SplitHandler:
         outPack = DataPackage(dataset_name='multiple, combing', train_plan=self.train_plan, time_period='multiple, combining')
         outPack['dataset_packages'] = {} # maps dataset_name : split_ratio out pack
         for dataset_name in self.plan_config['datasets']:
-            target_json = penult_dir / f"{self.train_plan}_{dataset_name}_fullsplit.json"
+            target_json = self._package_path(penult_dir, f"{self.train_plan}_{dataset_name}_fullsplit")
             
             if target_json.exists():
-                raw_json = file_loader(in_path=target_json, data_type='json', verbose=verbose)
-                package = DataPackage.from_dict(raw_json) 
+                package = self._load_package(target_json, verbose=verbose)
                 if verbose: print(f"(Split Handler | Pre-Combining) pulled data for '{dataset_name}' from path")
             else:
                 # if we cannot pull from path generate from scratch
@@ -175,9 +250,33 @@ class SplitHandler:
         Takes in a fully combined dataset of prompts then creates subsamples of just the training dataset. 
         Eg. given train_plan_train.jsonl --> creates train_plan_train_0.1.jsonl, train_plan_train_0.25.json, etc
         """
+        final_dir = UNIVERSAL_FINAL_FOLDER
+        train_jsonl = final_dir / f"{self.train_plan}_train.jsonl"
+        train_meta_jsonl = final_dir / f"{self.train_plan}_train_meta.jsonl"
+        if self.stream_subproportions:
+            if save and train_jsonl.exists() and train_meta_jsonl.exists():
+                if verbose: print(f"(Split Handler | Subproportions) Streaming subproportions from: {train_jsonl.name}")
+                return stream_subdivide_training_set(
+                    train_path=train_jsonl, 
+                    train_meta_path=train_meta_jsonl, 
+                    subproportions=self.subproportions, 
+                    train_plan=self.train_plan, 
+                    out_path=final_dir, 
+                    seed=self.seed, 
+                    stratify_on=self.stratify_subproportions, 
+                    debug=debug, 
+                    verbose=verbose
+                )
+            print(f"(Split Handler | Subproportions) streaming needs a saved training set, falling back to in memory subdivision")
         if package is None or package['train'] is None:
-            if verbose: print(f"(Split Handler | Subproportions) no package passed in memory, calling SplitHandler combine_datasets")
-            package = self.combine_datasets(save=save, debug=debug, verbose=verbose)
+            if train_jsonl.exists() and train_meta_jsonl.exists():
+                if verbose: print(f"(Split Handler | Subproportions) Loading existing training set: {train_jsonl.name}")
+                package = DataPackage(dataset_name='multiple, combined', train_plan=self.train_plan, time_period='multiple, combined')
+                package['train'] = file_loader(in_path=train_jsonl, data_type='jsonl', verbose=verbose)
+                package['train_meta'] = file_loader(in_path=train_meta_jsonl, data_type='jsonl', verbose=verbose)
+            else:
+                if verbose: print(f"(Split Handler | Subproportions) no package passed in memory, calling SplitHandler combine_datasets")
+                package = self.combine_datasets(save=save, debug=debug, verbose=verbose)
         else:
             if verbose: print(f"(Split Handler | Subproportions) received package passed in memory")
         out_path = UNIVERSAL_FINAL_FOLDER
@@ -190,4 +289,239 @@ class SplitHandler:
             debug=debug, 
             verbose=verbose
         )       
-        return out_dict
\ No newline at end of file
+        return out_dict
+
+    # -----------------
+    # Incremental waves
+    # -----------------
+    def _append_package(self, path: Path, additions: Dict[str, Iterable], verbose: bool = False):
+        """Rewrites a saved package with additions' records after each key's existing records."""
+        existing = self._load_package(path, verbose=verbose)
+        if self.persistence_format == 'jsonl':
+            # existing records are spooled by the writer before the file is rewritten on close
+            with JSONLPackageWriter(path, meta=existing.meta) as writer:
+                for key, value in existing.items():
+                    if isinstance(value, JSONLRecords):
+                        writer.extend(key, value)
+                    else:
+                        writer.extras[key] = value
+                for key, records in additions.items():
+                    writer.extend(key, records)
+        else:
+            for key, records in additions.items():
+                existing[key] = list(existing.get(key) or []) + list(records)
+            file_saver(out_path=path, data=existing, data_type='DataPackage', indnt=2, verbose=verbose)
+
+    def _package_has_wave(self, path: Path, keys: Iterable[str], time_period: str) -> bool:
+        """Whether any of a saved package's keys already holds records from the wave, ie. an earlier append got that far."""
+        package = self._load_package(path)
+        return any(str(record.get('time')) == str(time_period) for key in keys for record in package.get(key) or [])
+
+    def _final_has_wave(self, time_period: str) -> bool:
+        """Whether the final train/val/test jsonls already hold prompts from the wave, read off their meta lines."""
+        for split in ['train', 'val', 'test']:
+            meta_path = Path(UNIVERSAL_FINAL_FOLDER) / f"{self.train_plan}_{split}_meta.jsonl"
+            if not meta_path.exists():
+                continue
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                if any(str(json.loads(line).get('time_period')) == str(time_period) for line in f if line.strip()):
+                    return True
+        return False
+
+    def _append_final(self, split_pack: DataPackage, time_period: str, debug: bool = False, verbose: bool = False) -> DataPackage:
+        """
+        Compiles the split wave's prompts to a scratch folder first, then appends each file onto its final jsonl, 
+        so a failed compile never leaves half a wave in the final files.
+        """
+        combine_pack = DataPackage(dataset_name='multiple, combined', train_plan=self.train_plan, time_period=time_period)
+        combine_pack['dataset_packages'] = {split_pack.dataset_name: split_pack}
+        final_dir = Path(UNIVERSAL_FINAL_FOLDER)
+        out_pack = DataPackage(combine_pack.dataset_name, self.train_plan, time_period)
+        with tempfile.TemporaryDirectory(dir=final_dir) as scratch_dir:
+            scratch_pack = split_combine(package=combine_pack, out_path=scratch_dir, save=True, mode='w', debug=debug, verbose=verbose)
+            for key, records in scratch_pack.items():
+                final_path = final_dir / records.path.name
+                with open(records.path, 'rb') as src, open(final_path, 'ab') as dst:
+                    offset = dst.tell()
+                    shutil.copyfileobj(src, dst)
+                out_pack[key] = JSONLRecords(final_path, offset=offset, count=len(records))
+        return out_pack
+
+    def append_wave(self, dataset_name: str, time_period: str, raw_handler: RawHandler = None, save: bool = True, debug: bool = False, verbose: bool = False):
+        """
+        Ingests one new wave (eg. a new IGS_MAPS key) without rebuilding the others. 
+        Only that wave is raw cleaned and split on questions, then it's appended to the saved fullpack, fullsplit (and its validity index) 
+        and the final train/val/test jsonls. The wave's individuals are split by uniqueid hash (hash_split_ratio) and nobody already 
+        split moves, so existing val and test sets stay intact. Subproportions are rebuilt afterwards, with stream_subproportions 
+        the existing lines keep their subsets.
+        The wave is processed, split and validated in memory before any saved output is touched (only its raw cleaned intermediate is written), 
+        and each output is skipped if it already holds the wave, so rerunning after a failure finishes the outputs it didn't reach.
+        Train Setting 3 can't be hashed per individual and is rejected.
+        """
+        if time_period not in ALL_DATA_MAPS.get(dataset_name, {}):
+            raise ValueError(f"(Split Handler | Appending) No data map for wave '{time_period}' of '{dataset_name}'")
+        if not save:
+            raise ValueError(f"(Split Handler | Appending) Appending a wave writes to the saved outputs, save must be True")
+        if self.train_setting not in (1, 2) and not (self.homogenous_plan and not self.ques_split_varying):
+            raise ValueError(f"(Split Handler | Appending) Train Setting {self.train_setting} splits can't be hashed per individual, rebuild the plan instead")
+        processed_dir = Path(DATA_PATHS[dataset_name]['processed'])
+        penult_dir = Path(UNIVERSAL_PENULTIMATE_FOLDER)
+        fullpack_path = self._package_path(processed_dir, f"{self.train_plan}_{dataset_name}_fullpack_processed")
+        fullsplit_path = self._package_path(penult_dir, f"{self.train_plan}_{dataset_name}_fullsplit")
+        for path in [fullpack_path, fullsplit_path]:
+            if not path.exists():
+                raise ValueError(f"(Split Handler | Appending) Nothing to append to, '{path}' missing. Run the full pipeline first")
+        pending = {
+            'fullpack' : not self._package_has_wave(fullpack_path, ['full'], time_period), 
+            'fullsplit' : not self._package_has_wave(fullsplit_path, ['train', 'val', 'test'], time_period), 
+            'final' : not self._final_has_wave(time_period), 
+        }
+        if not any(pending.values()):
+            print(f"(Split Handler | Appending) Wave '{time_period}' of {dataset_name} already appended, skipping")
+            return None
+
+        # ---- Process and split in memory ----
+        if raw_handler is None:
+            raw_handler = RawHandler(special_cond='fallback handler created in Split Handler Appending logic', intermediate_format=self.intermediate_format, sort_files=self.sort_files)
+        raw_pack = raw_handler.clean_wave(dataset_name=dataset_name, time_period=time_period, save=save, debug=debug, verbose=verbose)
+        wave_pack = process_wave(
+            raw_pack['data'][0], 
+            dataset_name=dataset_name, 
+            train_plan=self.train_plan, 
+            reduction_modifier=self.reduction_modifier, 
+            seed=self.seed, 
+            vectorized=self.vectorized, 
+            compact=self.compact, 
+            persistence_format=self.persistence_format, 
+            save=False, 
+            debug=debug, 
+            verbose=verbose
+        )
+        if wave_pack is None:
+            raise ValueError(f"(Split Handler | Appending) Wave '{time_period}' of '{dataset_name}' produced no individuals")
+        validity_index = ValidityIndex.build(wave_pack['full'])
+        split_pack = hash_split_ratio(
+            package=wave_pack, 
+            target_ratios=self.training_ratios, 
+            homogenous_plan=self.homogenous_plan, 
+            ques_split_varying=self.ques_split_varying, 
+            train_setting=self.train_setting, 
+            valid_indiv_setting=self.valid_indiv_setting, 
+            seed=self.seed, 
+            validity_index=validity_index, 
+            debug=debug, 
+            verbose=verbose
+        )
+        if self.train_setting == 1:
+            split_ratio_validator(pack=split_pack, valid_indiv_setting=self.valid_indiv_setting, validity_index=validity_index, verbose=verbose, debug=debug)
+
+        # ---- Append to the saved outputs ----
+        if pending['fullpack']:
+            saved_index = ValidityIndex.load_fresh(validity_index_path(fullsplit_path), file_digest(fullpack_path)) # before the fullpack changes
+            self._append_package(fullpack_path, {split: wave_pack[split] for split in ['full', 'train', 'val', 'test']}, verbose=verbose)
+            if verbose: print(f"(Split Handler | Appending) Appended {len(wave_pack['full'])} individual maps to {fullpack_path.name}")
+            if saved_index is not None:
+                # rows of the appended wave follow the existing fullpack's, same as the appended records
+                validity_index = saved_index.merge(validity_index)
+                validity_index.source_digest = file_digest(fullpack_path)
+                validity_index.save(validity_index_path(fullsplit_path))
+        if pending['fullsplit']:
+            self._append_package(fullsplit_path, {split: split_pack[split] for split in ['train', 'val', 'test']}, verbose=verbose)
+            if verbose: print(f"(Split Handler | Appending) Appended split wave to {fullsplit_path.name}")
+        out_pack = self._append_final(split_pack, time_period, debug=debug, verbose=verbose) if pending['final'] else None
+        save_wave(wave_pack, out_path=processed_dir, persistence_format=self.persistence_format, verbose=verbose)
+        self.subproportion_dataset(save=save, debug=debug, verbose=verbose)
+        return out_pack
+
+    # -----------------
+    # Stage cache funcs
+    # -----------------
+    def _plan_labels(self) -> set:
+        labels = set(['dataset_id'])
+        for var_labels in self.variable_map.values():
+            labels.update(var_labels)
+        return labels
+
+    def _plan_columns(self, dataset_name: str) -> List[str]:
+        """Intermediate columns split_on_questions reads for this plan, across every time period of the dataset."""
+        labels = self._plan_labels()
+        columns = set(['time_period'])
+        for maps in ALL_DATA_MAPS.get(dataset_name, {}).values():
+            columns.update(var for var, label in maps.get('var2label', {}).items() if label in labels)
+        return sorted(columns)
+
+    def stage_files(self, stage: str, dataset_name: str = None) -> Tuple[List[Path], List[Path]]:
+        """Returns (inputs, outputs) file paths of a stage for StageCache."""
+        penult_dir = Path(UNIVERSAL_PENULTIMATE_FOLDER)
+        final_dir = Path(UNIVERSAL_FINAL_FOLDER)
+        suffix, _ = PACKAGE_FORMATS[self.persistence_format]
+        if stage == 'split_on_questions':
+            processed_dir = Path(DATA_PATHS[dataset_name]['processed'])
+            inputs = list(Path(DATA_PATHS[dataset_name]['intermediate']).glob(f"{dataset_name}_cleaned_*{INTERMEDIATE_FORMATS[self.intermediate_format]}"))
+            if self.intermediate_format == 'columnar':
+                inputs += [columnar_schema_path(p) for p in inputs]
+            outputs = list(processed_dir.glob(f"{self.train_plan}_{dataset_name}_*_processed{suffix}"))
+        elif stage == 'split_on_ratio':
+            inputs = [self._package_path(DATA_PATHS[dataset_name]['processed'], f"{self.train_plan}_{dataset_name}_fullpack_processed")]
+            fullsplit_path = self._package_path(penult_dir, f"{self.train_plan}_{dataset_name}_fullsplit")
+            outputs = [fullsplit_path, validity_index_path(fullsplit_path)]
+        elif stage == 'combine_datasets':
+            inputs = [self._package_path(penult_dir, f"{self.train_plan}_{name}_fullsplit") for name in self.datasets]
+            outputs = [final_dir / f"{self.train_plan}_{split}{suffix}.jsonl" for split in ['train', 'val', 'test'] for suffix in ['', '_meta']]
+        elif stage == 'subproportion_dataset':
+            inputs = [final_dir / f"{self.train_plan}_train.jsonl", final_dir / f"{self.train_plan}_train_meta.jsonl"]
+            outputs = [final_dir / f"{self.train_plan}_train_{str(proportion)}{suffix}.jsonl" for proportion in self.subproportions for suffix in ['', '_meta']]
+        else:
+            raise ValueError(f"(Split Handler | Stage Cache) Unknown stage '{stage}'")
+        if self.persistence_format == 'jsonl':
+            # streamed packages are only readable alongside their sidecar headers
+            inputs += [package_header_path(p) for p in inputs if p.suffix == suffix]
+            outputs += [package_header_path(p) for p in outputs if p.suffix == suffix]
+        return [p for p in inputs if p.exists()], [p for p in outputs if p.exists()]
+
+    def stage_config(self, stage: str, dataset_name: str = None) -> Dict:
+        """
+        Config entries a stage depends on, hashed into its StageCache key.
+        split_on_questions only hashes the mappings of labels this plan uses so unrelated label edits don't rebuild it.
+        """
+        if stage == 'split_on_questions':
+            labels = self._plan_labels()
+            return {
+                'variable_map' : self.variable_map, 
+                'reduction_modifier' : self.reduction_modifier, 
+                'seed' : self.seed, 
+                'na_filler' : UNIVERSAL_NA_FILLER, 
+                'sort_files' : self.sort_files, 
+                'maps' : {
+                    period: {
+                        'var2label' : {var: label for var, label in maps.get('var2label', {}).items() if label in labels}, 
+                        'label2opt' : {label: opt for label, opt in maps.get('label2opt', {}).items() if label in labels}, 
+                        'label2qes' : {label: qes for label, qes in maps.get('label2qes', {}).items() if label in labels}
+                    }
+                    for period, maps in ALL_DATA_MAPS.get(dataset_name, {}).items()
+                }
+            }
+        elif stage == 'split_on_ratio':
+            return {
+                'plan_config' : self.plan_config, 
+                'training_ratios' : self.training_ratios, 
+                'seed' : self.seed, 
+                'split_mode' : self.split_mode, 
+                'stratify_on' : self.stratify_on if self.split_mode == 'stratified' else None, 
+                'min_cell_count' : self.min_cell_count if self.split_mode == 'stratified' else None
+            }
+        elif stage == 'combine_datasets':
+            return {
+                'datasets' : self.datasets, 
+                'varlabel_desc' : VARLABEL_DESC, 
+                'survey_wave_desc' : IGS_SURVEY_WAVE_DESC, 
+                'polling_firm_desc' : POLLING_FIRM_DESC
+            }
+        elif stage == 'subproportion_dataset':
+            return {
+                'subproportions' : self.subproportions, 
+                'seed' : self.seed, 
+                'stream_subproportions' : self.stream_subproportions, 
+                'stratify_subproportions' : self.stratify_subproportions
+            }
+        raise ValueError(f"(Split Handler | Stage Cache) Unknown stage '{stage}'")
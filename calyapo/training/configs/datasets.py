@@ -47,6 +47,9 @@ class calyapo_dataset_config:
     dataset: str = "calyapo_dataset"
     file: str = "calyapo/training/datasets/calyapo_dataset.py:get_calyapo_dataset"
     predict_eos: bool = True
+    token_cache: bool = False # tokenize once into memory-mapped .npy arrays, reused across epochs and runs
+    token_cache_dir: str = None # defaults to a token_cache folder next to the split's jsonl
+    batch_tokenize: bool = False # tokenize the whole split up front with batched tokenizer calls into int32 arrays
 
 @dataclass
 class ideology_to_trump_dataset (calyapo_dataset_config):
@@ -16,13 +16,17 @@ class train_config:
     run_validation: bool=True
     batch_size_training: int=4 
     batching_strategy: str="packing" #alternative: padding
+    packing_isolate_examples: bool=False # packing emits per example position_ids so each example only attends to itself, needs flash_attention_2 (Ampere+ GPUs)
     context_length: int=4096
+    completion_only_loss: bool=False # runs the LM head only on positions with a label (the answer letter) instead of the whole sequence, saves the (batch, seq, vocab) logits
     gradient_accumulation_steps: int=4
     gradient_clipping: bool = False
     gradient_clipping_threshold: float = 1.0
     num_epochs: int=3
     max_train_step: int=0
     max_eval_step: int=0
+    eval_answer_choices: bool=False # evaluation only scores the answer letters at the answer position, saving per example choice distributions instead of decoding full sequences
+    answer_letters: str="ABCDEFGH" # choice letters the answer distribution covers, see _get_choices_string
     num_workers_dataloader: int=2
     lr: float=1e-4
     weight_decay: float=0.0
@@ -45,9 +49,13 @@ class train_config:
     dist_checkpoint_root_folder: str="PATH/to/save/FSDP/model" # will be used if using FSDP
     dist_checkpoint_folder: str="fine-tuned" # will be used if using FSDP
     save_optimizer: bool=False # will be used if using FSDP
+    resume_checkpoint_steps: int=0 # every n optimizer steps each rank writes a resumable checkpoint (trainable params, optimizer, scheduler, data position, RNG) to output_dir/resume in the background, 0 = off
+    resume_keep_last: int=2 # resume checkpoints kept on disk, at least 2
+    auto_resume: bool=False # continue from the latest complete checkpoint in output_dir/resume, needs the same world size and FSDP/PEFT setup
     use_fast_kernels: bool = False # Enable using SDPA from PyTroch Accelerated Transformers, make use Flash Attention and Xformer memory-efficient kernels
     use_wandb: bool = True # Enable wandb for experient tracking
-    save_metrics: bool = True # saves training metrics to a json file for later plotting
+    save_metrics: bool = True # appends training metrics to a jsonl file for later plotting
+    metrics_flush_interval: float = 30.0 # seconds between flushes of the metrics file, written from a background thread
     flop_counter: bool = False # Enable flop counter to measure model throughput, can not be used with pytorch profiler at the same time.
     flop_counter_start: int = 3 # The step to start profiling, default is 3, which means after 3 steps of warmup stage, the profiler will start to count flops.
     use_profiler: bool = False # Enable pytorch profiler, can not be used with flop counter at the same time.
@@ -2,33 +2,76 @@
 # This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
 
 from tqdm import tqdm
-from itertools import chain
 
+import numpy as np
 from torch.utils.data import Dataset
 
 
 class ConcatDataset(Dataset):
-    def __init__(self, dataset, chunk_size=4096):
+    def __init__(self, dataset, chunk_size=4096, isolate_examples=False):
+        """
+        Packs every sample of dataset back to back into chunk_size token chunks.
+        Samples are concatenated once into flat numpy buffers and each chunk is a view into them.
+        Datasets that already hold flat token arrays (CalyapoDataset's flat_tokens) are packed without touching individual samples.
+        As before, the trailing partial chunk is dropped.
+        Sample boundaries are kept, boundaries(idx) gives the in-chunk positions where a new sample starts, eg. for attention masking.
+        If isolate_examples, chunks carry position_ids that restart at every sample (and at the chunk start) instead of an attention_mask, 
+        which flash_attention_2 turns into per-sample variable length attention, and the label of each sample's first token is masked 
+        so no sample is trained to predict the next one.
+        """
         self.dataset = dataset
         self.chunk_size = chunk_size
+        self.isolate_examples = isolate_examples
 
-        self.samples = []
+        flat = getattr(dataset, "flat_tokens", lambda: None)()
+        if flat is None:
+            flat = self._gather(dataset)
+        self.buffers, self.offsets = flat
 
-        buffer = {
+        total = int(self.offsets[-1])
+        self.num_chunks = max(total - 1, 0) // self.chunk_size # a chunk is only cut once the buffer holds more than chunk_size tokens
+
+    @staticmethod
+    def _gather(dataset):
+        """Concatenates each key of every sample into one flat int64 buffer, returns (buffers, sample offsets)."""
+        pieces = {
             "input_ids": [],
             "attention_mask": [],
             "labels": [],
             }
+        lengths = []
+        for sample in tqdm(dataset, desc="Preprocessing dataset", dynamic_ncols=True):
+            for k, v in pieces.items():
+                v.append(np.asarray(sample[k], dtype=np.int64))
+            lengths.append(len(pieces["input_ids"][-1]))
+        buffers = {k: np.concatenate(v) if v else np.zeros(0, dtype=np.int64) for k, v in pieces.items()}
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return buffers, offsets
 
-        for sample in tqdm(self.dataset, desc="Preprocessing dataset", dynamic_ncols=True):
-            buffer = {k: v + sample[k] for k,v in buffer.items()}
-
-            while len(next(iter(buffer.values()))) > self.chunk_size:
-                self.samples.append({k: v[:self.chunk_size] for k,v in buffer.items()})
-                buffer = {k: v[self.chunk_size:] for k,v in buffer.items()}
+    def boundaries(self, idx):
+        """In-chunk positions where a sample starts, position 0 is always a boundary."""
+        start = idx * self.chunk_size
+        end = start + self.chunk_size
+        first = np.searchsorted(self.offsets, start, side="right")
+        last = np.searchsorted(self.offsets, end, side="left")
+        return np.concatenate([[0], self.offsets[first:last] - start]).astype(np.int64)
 
     def __getitem__(self, idx):
-        return self.samples[idx]
+        if idx < 0:
+            idx += self.num_chunks
+        if not 0 <= idx < self.num_chunks:
+            raise IndexError(f"chunk index {idx} out of range for {self.num_chunks} chunks")
+        start = idx * self.chunk_size
+        chunk = {k: v[start:start + self.chunk_size] for k, v in self.buffers.items()}
+        if self.isolate_examples:
+            starts = self.boundaries(idx)
+            segment_starts = np.repeat(starts, np.diff(np.append(starts, self.chunk_size)))
+            chunk["position_ids"] = np.arange(self.chunk_size, dtype=np.int64) - segment_starts
+            chunk["labels"] = chunk["labels"].copy()
+            chunk["labels"][starts[1:]] = -100
+            del chunk["attention_mask"] # an all ones mask would send flash attention down the padded path, ignoring position_ids
+        return chunk
 
     def __len__(self):
-        return len(self.samples)
+        return self.num_chunks
@@ -1,11 +1,19 @@
 import copy
+import hashlib
 import json
+import os
+from itertools import chain
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 from pathlib import Path
 
 from calyapo.training.configs.datasets import calyapo_dataset_config
 
+IGNORE_INDEX = -100  # PyTorch CrossEntropyLoss ignores this value
+TOKEN_CACHE_ARRAYS = ("input_ids", "labels", "offsets")
+TOKENIZE_BATCH_SIZE = 2048 # examples per batched tokenizer call
+
 class Tokens():
     def __init__(self):
         """
@@ -25,33 +33,140 @@ class CalyapoDataset(Dataset):
                 - we let get_preprocessed_dataset()'s internal get_split() function pull the path
                 - this function is loacted in training/utils/dataset_utils.py
                 - it gets called in finetuning.py to construct the datasets
+        If dataset_config.token_cache is set, examples are tokenized once into memory-mapped .npy arrays (see _load_token_cache) 
+        and __getitem__ slices them instead of tokenizing.
+        If dataset_config.batch_tokenize is set, every example is tokenized up front with batched tokenizer calls 
+        into compact int32 arrays (see _tokenize_all) instead of on every access.
         """
         self.tokenizer = tokenizer
         self.predict_eos = dataset_config.predict_eos
+        self.token_cache = getattr(dataset_config, "token_cache", False)
+        self.token_cache_dir = getattr(dataset_config, "token_cache_dir", None)
+        self.batch_tokenize = getattr(dataset_config, "batch_tokenize", False)
 
         path_obj = Path(filepath)
         if not path_obj.exists():
             raise FileNotFoundError(f"Dataset file not found at: {filepath}")      
+        self.filepath = path_obj
+
+        self.data = None
+        self.cache = None # token_cache arrays, name : memmapped np.ndarray
+        self.tokens = None # batch_tokenize arrays, name : np.ndarray
+        if self.token_cache:
+            self._load_token_cache()
+        elif self.batch_tokenize:
+            self.tokens = self._tokenize_all(self._read_data())
+        else:
+            self.data = self._read_data()
 
+    def _read_data(self):
         # Alpaca uses json.load (for a single list), but we use line-by-line for JSONL
-        self.data = []
-        with open(filepath, 'r') as f:
+        data = []
+        with open(self.filepath, 'r') as f:
             for line in f:
                 if line.strip(): # Skip empty lines
-                    self.data.append(json.loads(line))
+                    data.append(json.loads(line))
+        return data
 
     def update_eos_pred(self, tf: bool):
         self.predict_eos = tf
+        if self.token_cache:
+            self._load_token_cache() # cache is keyed on predict_eos
+        elif self.batch_tokenize:
+            self.tokens = self._tokenize_all(self._read_data())
         print(f"(calyapo_dataset obj | Debug) updated EOS awarness: {'ENABLED' if self.predict_eos else 'DISABLED'}")
 
-    def __len__(self):
-        return len(self.data)
+    # -----------
+    # Token cache
+    # -----------
+    def _token_cache_prefix(self) -> Path:
+        """
+        Cache files are keyed by the data file's name, size and mtime, the tokenizer and predict_eos, 
+        eg. presidents_to_abortion_train.Llama-3.1-8B.eos.3f2a9c1b7d04.input_ids.npy
+        """
+        stat = self.filepath.stat()
+        tokenizer_name = str(getattr(self.tokenizer, "name_or_path", "") or type(self.tokenizer).__name__)
+        key = json.dumps({
+            "file" : [self.filepath.name, stat.st_size, stat.st_mtime_ns], 
+            "tokenizer" : [tokenizer_name, type(self.tokenizer).__name__, len(self.tokenizer), self.tokenizer.bos_token, self.tokenizer.eos_token], 
+            "predict_eos" : self.predict_eos
+        })
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+        cache_dir = Path(self.token_cache_dir) if self.token_cache_dir else self.filepath.parent / "token_cache"
+        return cache_dir / f"{self.filepath.stem}.{Path(tokenizer_name).name}.{'eos' if self.predict_eos else 'noeos'}.{digest}"
 
-    def __getitem__(self, index):
-        IGNORE_INDEX = -100  # PyTorch CrossEntropyLoss ignores this value
+    def _load_token_cache(self):
+        """Memory-maps the token arrays for this file, tokenizing and writing them first if they don't exist yet."""
+        prefix = self._token_cache_prefix()
+        paths = {name: Path(f"{prefix}.{name}.npy") for name in TOKEN_CACHE_ARRAYS}
+        if not all(path.exists() for path in paths.values()):
+            self._build_token_cache(paths)
+        self.cache = {name: np.load(path, mmap_mode="r") for name, path in paths.items()}
+
+    def _build_token_cache(self, paths):
+        """
+        Tokenizes every example into flat input_ids/labels arrays with an offsets index (example i is offsets[i]:offsets[i+1]).
+        Arrays are int64 so slices go straight to the embedding and loss without a cast. 
+        Each array is written to a temp file and renamed into place, so concurrent ranks never read a partial cache.
+        """
+        data = self.data if self.data is not None else self._read_data()
+        print(f"(calyapo_dataset obj) building token cache for {len(data)} examples at {paths['input_ids'].parent}")
+        tokens = self._tokenize_all(data)
+        input_ids = tokens["input_ids"].astype(np.int64)
+        arrays = {
+            "input_ids" : input_ids, 
+            "labels" : np.where(self._prompt_mask(tokens), IGNORE_INDEX, input_ids), 
+            "offsets" : tokens["offsets"]
+        }
+        paths["input_ids"].parent.mkdir(parents=True, exist_ok=True)
+        for name, path in paths.items():
+            tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, arrays[name])
+            os.replace(tmp_path, path)
+
+    # -----------
+    # Tokenizing
+    # -----------
+    def _tokenize_all(self, data):
+        """
+        Tokenizes every example with batched (fast tokenizer) calls, same ids as _tokenize_example. 
+        Returns flat int32 input_ids, int64 offsets (example i is offsets[i]:offsets[i+1]) and int32 prompt_lens, 
+        labels are the input ids with each example's first prompt_lens tokens masked.
+        """
+        bos, eos = self.tokenizer.bos_token, self.tokenizer.eos_token if self.predict_eos else ""
+        input_ids, lengths, prompt_lens = [], [], []
+        for start in range(0, len(data), TOKENIZE_BATCH_SIZE):
+            batch = data[start:start + TOKENIZE_BATCH_SIZE]
+            prompt_ids = self.tokenizer([bos + ann["prompt"] for ann in batch], add_special_tokens=False)["input_ids"]
+            example_ids = self.tokenizer([bos + ann["prompt"] + ann["completion"] + eos for ann in batch], add_special_tokens=False)["input_ids"]
+            lengths.append(np.fromiter(map(len, example_ids), dtype=np.int64, count=len(batch)))
+            prompt_lens.append(np.fromiter(map(len, prompt_ids), dtype=np.int32, count=len(batch)))
+            input_ids.append(np.fromiter(chain.from_iterable(example_ids), dtype=np.int32, count=int(lengths[-1].sum())))
+        lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+        prompt_lens = np.concatenate(prompt_lens) if prompt_lens else np.zeros(0, dtype=np.int32)
         
+        too_long = np.flatnonzero(prompt_lens >= lengths)
+        if len(too_long):
+            ann = data[too_long[0]]
+            raise AssertionError(f"Prompt is longer (len {prompt_lens[too_long[0]]}) than full text (len {lengths[too_long[0]]}) for {len(too_long)} examples. Printing first prompt below\nPrompt:\n{ann['prompt']}")
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return {
+            "input_ids" : np.concatenate(input_ids) if input_ids else np.zeros(0, dtype=np.int32), 
+            "offsets" : offsets, 
+            "prompt_lens" : prompt_lens
+        }
+
+    @staticmethod
+    def _prompt_mask(tokens):
+        """True for every flat token position that's part of its example's prompt."""
+        lengths = np.diff(tokens["offsets"])
+        positions = np.arange(tokens["offsets"][-1]) - np.repeat(tokens["offsets"][:-1], lengths)
+        return positions < np.repeat(tokens["prompt_lens"], lengths)
+
+    def _tokenize_example(self, ann):
+        """Returns (input ids, labels) of one prompt/completion pair, labels have the prompt tokens masked."""
         # retrieve and construct raw texts
-        ann = self.data[index]
         prompt_text = ann["prompt"]
         completion_text = ann["completion"]
         full_text = prompt_text + completion_text
@@ -84,6 +199,58 @@ class CalyapoDataset(Dataset):
         num_prompt_tokens = len(prompt_ids)
         assert num_prompt_tokens < len(labels), f"Prompt is longer (len {num_prompt_tokens}) than full text (len {len(labels)}). Printing both texts below\nPrompt:\n{prompt_text}\nFull Text:\n{full_text}"
         labels[:num_prompt_tokens] = [IGNORE_INDEX] * num_prompt_tokens
+        return example_ids, labels
+
+    def flat_tokens(self):
+        """
+        (buffers, offsets) of every example back to back, used by ConcatDataset to pack without going through __getitem__.
+        None when examples are tokenized on access.
+        """
+        if self.cache is not None:
+            arrays = self.cache
+            input_ids, labels = arrays["input_ids"], arrays["labels"] # memmapped, never loaded as a whole
+        elif self.tokens is not None:
+            arrays = self.tokens
+            input_ids = arrays["input_ids"].astype(np.int64)
+            labels = np.where(self._prompt_mask(arrays), IGNORE_INDEX, input_ids)
+        else:
+            return None
+        buffers = {
+            "input_ids": input_ids, 
+            "attention_mask": np.broadcast_to(np.int64(1), input_ids.shape), 
+            "labels": labels
+        }
+        return buffers, np.asarray(arrays["offsets"])
+
+    def __len__(self):
+        if self.cache is not None:
+            return len(self.cache["offsets"]) - 1
+        if self.tokens is not None:
+            return len(self.tokens["offsets"]) - 1
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if self.cache is not None:
+            # zero-copy views into the memory-mapped arrays
+            start, end = self.cache["offsets"][index], self.cache["offsets"][index + 1]
+            return {
+                "input_ids": self.cache["input_ids"][start:end],
+                "labels": self.cache["labels"][start:end], 
+                "attention_mask": np.ones(end - start, dtype=np.int64), 
+            }
+
+        if self.tokens is not None:
+            start, end = self.tokens["offsets"][index], self.tokens["offsets"][index + 1]
+            example_ids = self.tokens["input_ids"][start:end].astype(np.int64) # embedding and loss want int64
+            labels = example_ids.copy()
+            labels[:self.tokens["prompt_lens"][index]] = IGNORE_INDEX
+            return {
+                "input_ids": example_ids,
+                "labels": labels, 
+                "attention_mask": np.ones(end - start, dtype=np.int64), 
+            }
+
+        example_ids, labels = self._tokenize_example(self.data[index])
 
         # convert to tensors
         # rely on finetuning.py DataCollator
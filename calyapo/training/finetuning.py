@@ -161,13 +161,18 @@ def main(**kwargs):
         target_dtype = torch.float16
     else:
         target_dtype = "auto"
+    # isolated packing relies on flash attention reading example boundaries off position_ids
+    if train_config.batching_strategy == "packing" and train_config.packing_isolate_examples:
+        attn_implementation = "flash_attention_2"
+    else:
+        attn_implementation = "sdpa" if train_config.use_fast_kernels else None
     # ----- ADDED -----
     if config.model_type == "mllama":
         is_vision = True
         model = MllamaForConditionalGeneration.from_pretrained(
             train_config.model_name,
             quantization_config=bnb_config,
-            attn_implementation="sdpa" if train_config.use_fast_kernels else None,
+            attn_implementation=attn_implementation,
             device_map=(
                 "auto"
                 if train_config.quantization and not train_config.enable_fsdp
@@ -197,7 +202,7 @@ def main(**kwargs):
                     train_config.model_name,
                     quantization_config=bnb_config,
                     use_cache=use_cache,
-                    attn_implementation="sdpa" if train_config.use_fast_kernels else None,
+                    attn_implementation=attn_implementation,
                     device_map=(
                         "auto"
                         if train_config.quantization and not train_config.enable_fsdp
@@ -219,7 +224,7 @@ def main(**kwargs):
                 train_config.model_name,
                 quantization_config=bnb_config,
                 use_cache=use_cache,
-                attn_implementation="sdpa" if train_config.use_fast_kernels else None,
+                attn_implementation=attn_implementation,
                 device_map=(
                     "auto"
                     if train_config.quantization and not train_config.enable_fsdp
@@ -238,7 +243,7 @@ def main(**kwargs):
                 model = AutoModelForCausalLM.from_pretrained(
                     train_config.model_name,
                     quantization_config=bnb_config,
-                    attn_implementation="sdpa" if train_config.use_fast_kernels else None,
+                    attn_implementation=attn_implementation,
                     torch_dtype=target_dtype,
                     low_cpu_mem_usage=train_config.low_cpu_mem_usage
                 )
@@ -261,7 +266,7 @@ def main(**kwargs):
                 model = AutoModelForCausalLM.from_pretrained(
                     train_config.model_name,
                     quantization_config=bnb_config,
-                    attn_implementation="sdpa" if train_config.use_fast_kernels else None,
+                    attn_implementation=attn_implementation,
                     torch_dtype=target_dtype,
                     low_cpu_mem_usage=train_config.low_cpu_mem_usage
                 )
@@ -284,7 +289,7 @@ def main(**kwargs):
                 model = MistralForCausalLM.from_pretrained(
                     train_config.model_name,
                     quantization_config=bnb_config, 
-                    attn_implementation="sdpa" if train_config.use_fast_kernels else None,
+                    attn_implementation=attn_implementation,
                     device_map="auto" if train_config.quantization and not train_config.enable_fsdp else None,
                     torch_dtype=target_dtype,
                 )
@@ -297,7 +302,7 @@ def main(**kwargs):
             model = MistralForCausalLM.from_pretrained(
                 train_config.model_name,
                 quantization_config=bnb_config,
-                attn_implementation="sdpa" if train_config.use_fast_kernels else None,
+                attn_implementation=attn_implementation,
                 device_map="auto" if train_config.quantization and not train_config.enable_fsdp else None,
                 torch_dtype=target_dtype,
             )
@@ -479,7 +484,7 @@ def main(**kwargs):
             raise ValueError("Packing is not supported for vision datasets")
         else:
             dataset_train = ConcatDataset(
-                dataset_train, chunk_size=train_config.context_length
+                dataset_train, chunk_size=train_config.context_length, isolate_examples=train_config.packing_isolate_examples
             )
 
     train_dl_kwargs = get_dataloader_kwargs(
@@ -506,7 +511,7 @@ def main(**kwargs):
                 raise ValueError("Packing is not supported for vision datasets")
             else:
                 dataset_val = ConcatDataset(
-                    dataset_val, chunk_size=train_config.context_length
+                    dataset_val, chunk_size=train_config.context_length, isolate_examples=train_config.packing_isolate_examples
                 )
 
         val_dl_kwargs = get_dataloader_kwargs(
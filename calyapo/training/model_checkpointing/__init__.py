@@ -11,5 +11,10 @@ from calyapo.training.model_checkpointing.checkpoint_handler import (
     save_model_and_optimizer_sharded,
     load_model_sharded,
     load_sharded_model_single_gpu, 
-    generate_timestamped_folder
+    generate_timestamped_folder,
+    get_rng_state,
+    set_rng_state,
+    find_resume_checkpoint,
+    load_resume_checkpoint,
+    ResumeCheckpointer,
 )
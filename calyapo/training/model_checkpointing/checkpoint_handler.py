@@ -1,8 +1,12 @@
 # Copyright (c) Meta Platforms, Inc. and affiliates.
 # This software may be used and distributed according to the terms of the Llama 2 Community License Agreement.
 
+import os
+import random
+import threading
 from pathlib import Path
 from datetime import datetime
+import numpy as np
 import torch
 import time
 
@@ -303,3 +307,115 @@ def save_model_checkpoint(model, output_dir):
     
     torch.save(state_dict, output_file)
     
+
+
+# ------ RESUMABLE CHECKPOINTS ------
+RESUME_FOLDER = "resume"
+
+def _to_cpu(obj):
+    """Copies every tensor in a (nested) state dict to cpu so it can be written while training keeps updating the originals."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+def get_rng_state():
+    """Python, numpy, torch and accelerator RNG states of this process."""
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state()
+    return state
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state(state["cuda"])
+
+def find_resume_checkpoint(cfg, world_size=1):
+    """
+    Latest step folder under output_dir/resume that every rank finished writing, None if there isn't one.
+    Each rank writes its own rank{r}.pt shard so resuming needs the same world size (and FSDP/PEFT setup) as the run that saved it.
+    """
+    root = Path(cfg.output_dir) / RESUME_FOLDER
+    if not root.is_dir():
+        return None
+    for step_dir in sorted(root.glob("step_*"), reverse=True):
+        if all((step_dir / f"rank{r}.pt").is_file() for r in range(world_size)):
+            return step_dir
+    return None
+
+def load_resume_checkpoint(model, optimizer, lr_scheduler, scaler, checkpoint_dir, rank=0):
+    """
+    Restores this rank's trainable parameters (sharded under FSDP, adapters only under PEFT), optimizer, scheduler and grad scaler
+    from a folder written by ResumeCheckpointer. Returns the training progress dict saved with them (epoch, step, RNG state, ...).
+    """
+    rank = rank or 0
+    state = torch.load(Path(checkpoint_dir) / f"rank{rank}.pt", map_location="cpu", weights_only=False)
+    params = dict(model.named_parameters())
+    with torch.no_grad():
+        for name, value in state["model"].items():
+            params[name].copy_(value)
+    optimizer.load_state_dict(state["optimizer"])
+    lr_scheduler.load_state_dict(state["lr_scheduler"])
+    if scaler is not None and state["scaler"] is not None:
+        scaler.load_state_dict(state["scaler"])
+    if rank == 0:
+        print(f"--> resumed from {checkpoint_dir} at epoch {state['progress']['epoch'] + 1}, step {state['progress']['step']}")
+    return state["progress"]
+
+class ResumeCheckpointer:
+    def __init__(self, cfg, rank=0):
+        """
+        Mid-epoch checkpoints to resume training after preemption or a wall clock limit.
+        save() takes a cpu snapshot of this rank's trainable parameters, optimizer, scheduler, grad scaler and the progress dict
+        and hands it to a background thread that writes output_dir/resume/step_<n>/rank<r>.pt, so training only waits for the copy.
+        Only the resume_keep_last newest checkpoints are kept (at least 2, so one complete checkpoint survives a crash mid-write).
+        """
+        self.root = Path(cfg.output_dir) / RESUME_FOLDER
+        self.rank = rank or 0
+        self.keep_last = max(cfg.resume_keep_last, 2)
+        self.thread = None
+
+    def save(self, step_id, model, optimizer, lr_scheduler, scaler, progress):
+        self.wait() # one write in flight at a time
+        state = {
+            "model": {name: p.detach().to("cpu", copy=True) for name, p in model.named_parameters() if p.requires_grad},
+            "optimizer": _to_cpu(optimizer.state_dict()),
+            "lr_scheduler": lr_scheduler.state_dict(),
+            "scaler": scaler.state_dict() if scaler is not None else None,
+            "progress": _to_cpu(progress),
+        }
+        path = self.root / f"step_{step_id:09d}" / f"rank{self.rank}.pt"
+        self.thread = threading.Thread(target=self._write, args=(state, path)) # not a daemon, interpreter exit waits for the write
+        self.thread.start()
+
+    def _write(self, state, path):
+        t0 = time.perf_counter()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path) # rank files only appear once complete
+        for old_dir in sorted(self.root.glob("step_*"), reverse=True)[self.keep_last:]:
+            (old_dir / f"rank{self.rank}.pt").unlink(missing_ok=True)
+            (old_dir / f"rank{self.rank}.tmp").unlink(missing_ok=True) # left over from a write that crashed
+            try:
+                old_dir.rmdir() # the last rank to clean up removes the folder
+            except OSError:
+                pass
+        if self.rank == 0:
+            print(f"--> resume checkpoint saved to {path.parent} in {time.perf_counter() - t0:.2f}s")
+
+    def wait(self):
+        """Blocks until the last save is on disk."""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
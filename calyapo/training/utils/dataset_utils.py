@@ -43,7 +43,7 @@ def get_dataloader(tokenizer, dataset_config, train_config, split: str = "train"
     dl_kwargs = get_dataloader_kwargs(train_config, dataset, tokenizer, split)
     
     if split == "train" and train_config.batching_strategy == "packing":
-        dataset = ConcatDataset(dataset, chunk_size=train_config.context_length)
+        dataset = ConcatDataset(dataset, chunk_size=train_config.context_length, isolate_examples=train_config.packing_isolate_examples)
 
     # Create data loader
     dataloader = torch.utils.data.DataLoader(
@@ -1,9 +1,9 @@
 import torch
 
-def compute_accuracy(logits, labels, ignore_index=-100):
+def accuracy_counts(logits, labels, ignore_index=-100):
     """
-    Computes accuracy for the non-masked tokens (the completion).
-    Works for both training and evaluation steps.
+    Counts correct and total predictions for the non-masked tokens (the completion).
+    Both counts stay device tensors so callers can accumulate them without a host sync.
 
     logits: tensor of dimension (batch_size x sequence_length x llama_vocab_space)
         - for each indiviudal (first dim)
@@ -11,25 +11,83 @@ def compute_accuracy(logits, labels, ignore_index=-100):
         - each token is not yet collapsed down but a vector of logit scores over the whole vocab space (third dim)
     """
     # shift for Causal LM: token at N predicts label at N+1
-    shift_logits = logits[..., :-1, :].contiguous() # '...' means keep all leading dimensions (eg. batch size and sequence length)
-    shift_labels = labels[..., 1:].contiguous()
+    shift_logits = logits[..., :-1, :] # '...' means keep all leading dimensions (eg. batch size and sequence length)
+    shift_labels = labels[..., 1:]
     
     # collapse down logit vectors to calculated predicted token at each point in the response sequence
     preds = torch.argmax(shift_logits, dim=-1)
     
     # create mask for tokens we actually want to predict (completion)
     mask = shift_labels != ignore_index
-    
-    if not mask.any():
-        return 0.0, 0
         
     # perform elementwise comparison between LLM predictions and labels
     # handles for if LLM generates more than it's supposed to or generates token in the wrong spot
-    correct = (preds[mask] == shift_labels[mask]).sum().item()
-    total = mask.sum().item()
-    
+    correct = ((preds == shift_labels) & mask).sum()
+    total = mask.sum()
     return correct, total
 
+def compute_accuracy(logits, labels, ignore_index=-100):
+    """
+    Computes accuracy for the non-masked tokens (the completion).
+    Works for both training and evaluation steps. Same as accuracy_counts but returns python numbers.
+    """
+    correct, total = accuracy_counts(logits, labels, ignore_index)
+    total = total.item()
+    if total == 0:
+        return 0.0, 0
+    return correct.item(), total
+
+def completion_accuracy_counts(logits, labels):
+    """
+    accuracy_counts for logits that were already cut down to the completion positions (see train_utils.completion_forward).
+    logits: (num_completion_tokens x vocab), labels: (num_completion_tokens), already shifted so logits[i] predicts labels[i].
+    """
+    correct = (torch.argmax(logits, dim=-1) == labels).sum()
+    return correct, torch.tensor(labels.numel(), device=labels.device)
+
+def answer_token_ids(tokenizer, letters="ABCDEFGH", prompt_suffix="Answer:"):
+    """
+    Token id of every answer letter as it's tokenized in training text, ie. right after the prompt's closing prompt_suffix.
+    Letters are tokenized in context since a standalone letter can encode differently (eg. SentencePiece's "▁A").
+    Raises if a letter merges with the suffix or doesn't come out as exactly one token of its own.
+    """
+    prefix_ids = tokenizer.encode(prompt_suffix, add_special_tokens=False)
+    ids, bad = [], []
+    for letter in letters:
+        in_context = tokenizer.encode(prompt_suffix + letter, add_special_tokens=False)
+        if in_context[:len(prefix_ids)] != prefix_ids or len(in_context) != len(prefix_ids) + 1:
+            bad.append(letter)
+        ids.append(in_context[-1])
+    if bad:
+        raise ValueError(f"(answer_token_ids) answer letters {bad} don't tokenize to a single token after '{prompt_suffix}' with {getattr(tokenizer, 'name_or_path', 'this tokenizer')}")
+    return ids
+
+def answer_positions(labels, ignore_index=-100):
+    """
+    Finds the position predicting the first token of every completion (the answer letter), works for padded and packed batches.
+    Returns a (batch_size x sequence_length) bool mask of those positions and the answer label at each of them, in row-major order.
+    """
+    shift_labels = labels[..., 1:]
+    labelled = shift_labels != ignore_index
+    starts = labelled & ~torch.nn.functional.pad(labelled[..., :-1], (1, 0), value=False)
+    return torch.nn.functional.pad(starts, (0, 1), value=False), shift_labels[starts]
+
+def choice_distribution(logits, answer_labels, letter_ids):
+    """
+    Restricts answer position logits (num_answers x vocab) to the answer letters and softmaxes them into a distribution over choices.
+    Counts stay on the logits' device, an answer counts as correct when its most likely letter is the labelled one.
+    Raises if an answer label isn't one of letter_ids (checking costs one host sync per call).
+
+    Returns: probs (num_answers x num_letters), correct, total
+    """
+    letter_ids = torch.as_tensor(letter_ids, device=logits.device)
+    if not torch.isin(answer_labels, letter_ids).all():
+        unknown = sorted(set(answer_labels[~torch.isin(answer_labels, letter_ids)].tolist()))
+        raise ValueError(f"(choice_distribution) answer labels {unknown} aren't answer letter tokens {letter_ids.tolist()}, scoring would use the wrong vocab columns")
+    probs = torch.softmax(logits.float().index_select(-1, letter_ids), dim=-1)
+    correct = (letter_ids[probs.argmax(dim=-1)] == answer_labels).sum()
+    return probs, correct, torch.tensor(answer_labels.numel(), device=logits.device)
+
 # def save_prediction_to_rollup(output_dir, local_rank, epoch, step, predictions, targets, tokenizer):
 #     """Streams decoded predictions to disk to avoid System RAM OOM."""
 #     rollup_path = os.path.join(output_dir, f"kl_rollup_rank_{local_rank}.jsonl")
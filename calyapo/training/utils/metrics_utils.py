@@ -0,0 +1,115 @@
+import json
+import math
+import queue
+import threading
+import time
+
+import torch
+import torch.distributed as dist
+
+
+class MetricAccumulator:
+    def __init__(self, step_loss_divisor=1):
+        """
+        Keeps per step loss and accuracy counts as device tensors so a training step never waits on the GPU.
+        Steps are buffered and copied to host in a single sync by flush(), eg. at gradient accumulation or logging boundaries.
+        Running epoch sums stay on device and are only all-reduced by reduce_epoch().
+        step_loss_divisor scales the per step loss series (train logs the loss divided by gradient_accumulation_steps), epoch sums are unscaled.
+        """
+        self.step_loss_divisor = step_loss_divisor
+        self.pending = [] # one (loss, correct, total) device row per step since the last flush
+        self.sums = None # (loss, correct, total) summed over the epoch, device tensor
+        self.step_loss = []
+        self.step_perplexity = []
+        self.step_accuracy = []
+
+    def update(self, loss, correct, total):
+        """Records one step, loss is the step's mean loss and correct/total its accuracy counts (device tensors or numbers)."""
+        row = torch.stack([
+            loss.detach().float(),
+            torch.as_tensor(correct, device=loss.device).float(),
+            torch.as_tensor(total, device=loss.device).float(),
+            ])
+        self.pending.append(row)
+        self.sums = row.clone() if self.sums is None else self.sums + row
+
+    def flush(self):
+        """
+        Copies every buffered step to host at once and appends them to the step series.
+        Returns the flushed steps as dicts with loss, perplexity and accuracy, oldest first.
+        """
+        if not self.pending:
+            return []
+        rows = torch.stack(self.pending).tolist()
+        self.pending = []
+        flushed = []
+        for loss, correct, total in rows:
+            step_loss = loss / self.step_loss_divisor
+            flushed.append({
+                "loss": step_loss,
+                "perplexity": math.exp(step_loss) if step_loss < 709 else math.inf, # torch.exp overflows to inf, math.exp raises
+                "accuracy": correct / total if total > 0 else 0,
+                })
+        self.step_loss.extend(r["loss"] for r in flushed)
+        self.step_perplexity.extend(r["perplexity"] for r in flushed)
+        self.step_accuracy.extend(r["accuracy"] for r in flushed)
+        return flushed
+
+    def state_dict(self):
+        """Epoch sums for a resume checkpoint, flush() first so no step is only in pending."""
+        return {"sums": self.sums}
+
+    def load_state_dict(self, state, device=None):
+        self.sums = state["sums"].to(device) if state["sums"] is not None else None
+
+    def reduce_epoch(self, distributed=False):
+        """
+        Epoch loss sum (device tensor), correct and total counts, summed over all ranks when distributed.
+        One all-reduce and one host sync for the whole epoch.
+        """
+        sums = self.sums if self.sums is not None else torch.zeros(3)
+        if distributed:
+            sums = sums.clone()
+            dist.all_reduce(sums, op=dist.ReduceOp.SUM)
+        correct, total = sums[1:].tolist()
+        return sums[0], int(correct), int(total)
+
+
+class MetricsWriter:
+    def __init__(self, filename, flush_interval=30.0):
+        """
+        Append-only JSONL metrics sink, a background thread does all the disk writes so the training loop never waits on I/O.
+        Every line is one record {"split": "train" | "val", "scope": "step" | "accumulation" | "epoch", <metric>: <value>, ...},
+        plot_metrics.load_metrics rebuilds the old per series lists (eg. train_step_loss) from them.
+        The file is flushed every flush_interval seconds and on close(), a crash loses at most that much.
+        """
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.records = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, split, scope, **values):
+        """Queues one record, returns immediately."""
+        self.records.put({"split": split, "scope": scope, **values})
+
+    def _run(self):
+        last_flush = time.monotonic()
+        with open(self.filename, "a") as f:
+            while True:
+                try:
+                    record = self.records.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    record = {}
+                if record is None: # close() sentinel
+                    break
+                if record:
+                    f.write(json.dumps(record) + "\n")
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = time.monotonic()
+
+    def close(self):
+        """Writes everything still queued and stops the writer thread."""
+        self.records.put(None)
+        self.thread.join()
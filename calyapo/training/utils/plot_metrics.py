@@ -5,6 +5,27 @@ import json
 import matplotlib.pyplot as plt
 import argparse
 import os
+from collections import defaultdict
+
+def load_metrics(file_path):
+    """
+    Rebuilds the per series lists (eg. train_step_loss, val_epoch_accuracy) from a metrics file.
+    Reads the JSONL records train writes ({"split", "scope", <metric>: <value>, ...} per line) as well as the older single JSON dump.
+    """
+    with open(file_path, 'r') as f:
+        if not file_path.endswith('.jsonl'):
+            return json.load(f)
+        data = defaultdict(list)
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            split, scope = record.pop('split'), record.pop('scope')
+            record.pop('epoch', None)
+            record.pop('step', None)
+            for metric, value in record.items():
+                data[f'{split}_{scope}_{metric}'].append(value)
+    return data
 
 def plot_metric(data, metric_name, x_label, y_label, title, colors):
     plt.figure(figsize=(7, 6))
@@ -40,12 +61,11 @@ def plot_metrics(file_path):
         print(f"File {file_path} does not exist.")
         return
 
-    with open(file_path, 'r') as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            print("Invalid JSON file.")
-            return
+    try:
+        data = load_metrics(file_path)
+    except json.JSONDecodeError:
+        print("Invalid metrics file.")
+        return
 
     directory = os.path.dirname(file_path)
     filename_prefix = os.path.basename(file_path).split('.')[0]
@@ -67,8 +87,8 @@ def plot_metrics(file_path):
     plt.close()
     
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Plot metrics from JSON file.')
-    parser.add_argument('--file_path', required=True, type=str, help='Path to the metrics JSON file.')
+    parser = argparse.ArgumentParser(description='Plot metrics from a metrics JSONL (or older JSON) file.')
+    parser.add_argument('--file_path', required=True, type=str, help='Path to the metrics JSONL or JSON file.')
     args = parser.parse_args()
 
     plot_metrics(args.file_path)
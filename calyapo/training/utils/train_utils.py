@@ -21,11 +21,44 @@ import json
 from datetime import timedelta
 
 from calyapo.training.model_checkpointing import save_fsdp_model_checkpoint_full, save_model_and_optimizer_sharded, save_optimizer_checkpoint, save_peft_checkpoint, save_model_checkpoint, generate_timestamped_folder
+from calyapo.training.model_checkpointing import get_rng_state, set_rng_state, find_resume_checkpoint, load_resume_checkpoint, ResumeCheckpointer
 from calyapo.training.policies import fpSixteen,bfSixteen, get_llama_wrapper
 from calyapo.training.utils.memory_utils import MemoryTrace
 from accelerate.utils import is_xpu_available, is_ccl_available
 from calyapo.training.utils.flop_utils import FlopMeasure
-from calyapo.training.utils.eval_utils import compute_accuracy
+from calyapo.training.utils.eval_utils import accuracy_counts, completion_accuracy_counts, answer_positions, answer_token_ids, choice_distribution
+from calyapo.training.utils.metrics_utils import MetricAccumulator, MetricsWriter
+
+def project_positions(model, batch, keep):
+    """
+    Runs model(...) without labels and only feeds the hidden states at keep (batch x seq bool mask) to the LM head.
+    A forward pre-hook on the output embeddings does the selection, so logits come out as (num kept x vocab) instead of (batch x seq x vocab).
+    Going through model(...) rather than model.model keeps FSDP/PEFT wrappers in charge of the forward.
+    """
+    def select_positions(module, args):
+        return (args[0][keep],) + tuple(args[1:])
+
+    handle = model.get_output_embeddings().register_forward_pre_hook(select_positions)
+    try:
+        outputs = model(**{k: v for k, v in batch.items() if k != "labels"})
+    finally:
+        handle.remove()
+    return outputs.logits
+
+def completion_forward(model, batch, ignore_index=-100):
+    """
+    Forward pass that only projects completion positions (the ones whose next label isn't ignore_index) through the LM head.
+    The loss is the mean cross entropy over those positions, same value as the full forward's loss.
+
+    Returns: loss, logits, labels with logits[i] predicting labels[i]
+    """
+    shift_labels = batch["labels"][..., 1:]
+    mask = shift_labels != ignore_index
+    keep = torch.nn.functional.pad(mask, (0, 1), value=False) # the last position never predicts a label
+    logits = project_positions(model, batch, keep)
+    labels = shift_labels[mask]
+    loss = torch.nn.functional.cross_entropy(logits.float(), labels)
+    return loss, logits, labels
 
 def set_tokenizer_params(tokenizer: LlamaTokenizer):
     tokenizer.pad_token_id = 0
@@ -88,6 +121,7 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
     Returns: results dictionary containing average training and validation perplexity and loss
     """
     # Create a gradient scaler for fp16
+    scaler = None
     if train_config.use_fp16 and train_config.enable_fsdp:
         scaler = ShardedGradScaler()
     elif train_config.use_fp16 and not train_config.enable_fsdp:
@@ -107,6 +141,19 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
         unique_folder = folder_list[0]
     # ------ ADDED ------
 
+    # ------ RESUME ------
+    # every rank saves its own shard every resume_checkpoint_steps optimizer steps, auto_resume picks up the latest complete one
+    resume_checkpointer = ResumeCheckpointer(train_config, rank) if train_config.resume_checkpoint_steps > 0 else None
+    progress = None
+    if train_config.auto_resume:
+        resume_dir = find_resume_checkpoint(train_config, world_size if train_config.enable_fsdp else 1)
+        if resume_dir is not None:
+            progress = load_resume_checkpoint(model, optimizer, lr_scheduler, scaler, resume_dir, rank)
+            unique_folder = Path(progress["unique_folder"]) # keep saving into the interrupted run's folder
+        elif not train_config.enable_fsdp or rank == 0:
+            print(f"no resume checkpoint found in {Path(train_config.output_dir) / 'resume'}, starting from scratch")
+    # ------ RESUME ------
+
     autocast = torch.cuda.amp.autocast if train_config.use_fp16 else nullcontext
     train_prep = []
     train_loss = []
@@ -118,19 +165,11 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
     if train_config.save_metrics:
         if not os.path.exists(train_config.output_dir):
             os.makedirs(train_config.output_dir, exist_ok=True)
-        metrics_filename = f"{train_config.output_dir}/metrics_data_{local_rank}_{train_config.model_nickname}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
-        train_step_perplexity = []
-        train_step_loss = []
-        # train_accumulation_loss = [] # ADDED
-        train_step_accuracy = [] # ADDED
-        train_accumulation_accuracy = [] # ADDED
+        metrics_filename = f"{train_config.output_dir}/metrics_data_{local_rank}_{train_config.model_nickname}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.jsonl"
+        if progress is not None and progress["metrics_filename"]:
+            metrics_filename = progress["metrics_filename"] # keep appending to the interrupted run's records
+        metrics_writer = MetricsWriter(metrics_filename, flush_interval=train_config.metrics_flush_interval) # appends records off the training thread
         # train_step_predictions = [] # ADDED
-        val_step_perplexity = []
-        val_step_loss = []
-        # val_accumulation_loss = [] # ADDED
-        val_step_accuracy = [] # ADDED
-        # val_accumulation_accuracy = [] # ADDED
-        
         # val_step_predictions = [] # ADDED
 
     epoch_times = []
@@ -138,29 +177,74 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
     results = {}
     best_val_loss = float("inf")
     total_train_steps = 0
+    total_optimizer_steps = 0
+    start_epoch = 0
+    if progress is not None:
+        train_prep, train_loss, train_acc = progress["train_prep"], progress["train_loss"], progress["train_acc"]
+        val_prep, val_loss, val_acc = progress["val_prep"], progress["val_loss"], progress["val_acc"]
+        epoch_times, checkpoint_times = progress["epoch_times"], progress["checkpoint_times"]
+        best_val_loss = progress["best_val_loss"]
+        total_train_steps = progress["total_train_steps"]
+        total_optimizer_steps = progress["total_optimizer_steps"]
+        start_epoch = progress["epoch"]
     max_steps_reached = False  # Flag to indicate max training steps reached
     # Start the training loop
-    for epoch in range(train_config.num_epochs):
+    for epoch in range(start_epoch, train_config.num_epochs):
         print(f"Starting epoch {epoch}/{train_config.num_epochs}")
         print(f"train_config.max_train_step: {train_config.max_train_step}")
         # stop when the maximum number of training steps is reached
         if max_steps_reached:
             break
         epoch_start_time = time.perf_counter()
-        epoch_correct, epoch_total = 0, 0 # ADDED
+        train_metrics = MetricAccumulator(step_loss_divisor=gradient_accumulation_steps) # ADDED
+        resuming = progress is not None and epoch == progress["epoch"]
+        first_step = progress["step"] if resuming else 0
+        if resuming:
+            train_metrics.load_state_dict(progress["train_metrics"], device=next(model.parameters()).device)
+            epoch_rng_state = progress["epoch_rng_state"]
+            set_rng_state(epoch_rng_state) # the sampler draws this epoch's order again when the dataloader is iterated
+        else:
+            epoch_rng_state = get_rng_state()
+
+        def log_window(first_step):
+            """Pulls the steps since the last optimizer update off the GPU in one sync and logs them."""
+            window = train_metrics.flush()
+            if not window:
+                return
+            # store everytime we go thru enough batches to fulfill the accumulation window
+            # eg for accumulation = 4 we update the weights every 4 batches
+            # then store the mean step accuracy at the last step
+            save_accumulation_acc = sum(row["accuracy"] for row in window) / len(window)
+            last_step = first_step + len(window) - 1
+            if train_config.save_metrics:
+                for i, row in enumerate(window):
+                    metrics_writer.write("train", "step", epoch=epoch + 1, step=first_step + i, **row)
+                metrics_writer.write("train", "accumulation", epoch=epoch + 1, step=last_step, accuracy=save_accumulation_acc) # ADDED
+            if wandb_run:
+                if not train_config.enable_fsdp or rank==0:
+                    for i, row in enumerate(window):
+                        wandb_run.log({
+                            'train/epoch': epoch + 1,
+                            'train/step': epoch * len(train_dataloader) + first_step + i,
+                            'train/loss': row["loss"],
+                            'train/accuracy': row["accuracy"],  # ADDED
+                            'train/accumulation_accuracy': save_accumulation_acc if i == len(window) - 1 else None # ADDED, so WanDB doesn't log values at the other steps
+                        })
+            pbar.set_description(f"Training Epoch: {epoch+1}/{train_config.num_epochs}, step {last_step}/{len(train_dataloader)} completed (loss: {window[-1]['loss']} / accuracy: {window[-1]['accuracy']})")
+
         with MemoryTrace() as memtrace:  # track the memory usage
             model.train()
-            total_loss = 0.0
             total_length = len(train_dataloader)//gradient_accumulation_steps
-            pbar = tqdm(colour="blue", desc=f"Training Epoch: {epoch+1}", total=total_length, dynamic_ncols=True)
+            pbar = tqdm(colour="blue", desc=f"Training Epoch: {epoch+1}", total=total_length, initial=first_step//gradient_accumulation_steps, dynamic_ncols=True)
             with profile(train_config,local_rank) as profile_context:
-                # ------ ADDED -----
-                running_step_acc = 0.0
-                # running_step_loss = 0.0
-                # save_accumulation_loss = None
-                save_accumulation_acc = None
-                 # ------ ADDED -----
-                for step, batch in enumerate(train_dataloader):
+                window_start = first_step # first step of the current accumulation window
+                batches = enumerate(train_dataloader)
+                if resuming:
+                    # skip the batches trained on before the checkpoint (loads them but runs no forward), then continue the saved RNG stream
+                    for _ in range(first_step):
+                        next(batches)
+                    set_rng_state(progress["rng_state"])
+                for step, batch in batches:
                     total_train_steps += 1
                     # stop when the maximum number of training steps is reached
                     if train_config.max_train_step > 0 and total_train_steps > train_config.max_train_step:
@@ -180,22 +264,20 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
                             elif torch.cuda.is_available():
                                 batch[key] = batch[key].to('cuda:0')
                     with autocast():
-                        outputs = model(**batch)
-                        loss = outputs.loss
-                        # raw_micro_loss = outputs.loss.detach().item() # ADDED
-                        logits = outputs.logits # ADDED
-                        batch_size, seq_length, embed_dim = logits.shape # ADDED NOT USED
+                        if train_config.completion_only_loss:
+                            loss, logits, completion_labels = completion_forward(model, batch)
+                        else:
+                            outputs = model(**batch)
+                            loss = outputs.loss
+                            logits = outputs.logits # ADDED
 
                     # --- NEW ---
-                    # epoch accuracy tracking
-                    step_correct, step_total_tokens = compute_accuracy(logits, batch["labels"])
-                    epoch_correct += step_correct
-                    epoch_total += step_total_tokens
-                    step_acc = step_correct / step_total_tokens if step_total_tokens > 0 else 0
-
-                    # gradient accumulation based tracking
-                    running_step_acc += step_acc # ADDED
-                    # running_step_loss += raw_micro_loss # ADDED
+                    # loss and accuracy counts stay on the GPU, log_window syncs them once per accumulation window
+                    if train_config.completion_only_loss:
+                        step_correct, step_total_tokens = completion_accuracy_counts(logits, completion_labels)
+                    else:
+                        step_correct, step_total_tokens = accuracy_counts(logits, batch["labels"])
+                    train_metrics.update(loss, step_correct, step_total_tokens)
 
                     # epoch prediction roll up (STREAM TO DISK EVERY 100 STEPS) 
                     # if train_config.save_metrics and total_train_steps % 100 == 0:
@@ -205,38 +287,13 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
                     #     )
                     # --- NEW ---
 
-                    total_loss += loss.detach().float()
                     loss = loss / gradient_accumulation_steps
-
-                    if train_config.save_metrics:
-                        train_step_loss.append(loss.detach().float().item())
-                        train_step_perplexity.append(float(torch.exp(loss.detach().float())))
-
-                        # track accuracy
-                        train_step_accuracy.append(step_acc) # ADDED
-
-                        # track grad accumulation based loss and accuracy
-                        if (step + 1) % gradient_accumulation_steps == 0 or step == len(train_dataloader) - 1:
-                            # store everytime we go thru enough batches to fulfill the accumulation window
-                            # eg for accumulation = 4 we update the weights every 4 batches
-                            # then store the accuracy at the last step
-                            actual_steps_accumulated = (step % gradient_accumulation_steps) + 1 
-                            save_accumulation_acc = running_step_acc / actual_steps_accumulated
-                            # save_accumulation_loss = running_step_loss / actual_steps_accumulated
-
-                            train_accumulation_accuracy.append(save_accumulation_acc)
-                            
-                            # save it in a pointer so we can save it in the wandb log
-                            running_step_acc = 0
-                            # running_step_loss = 0 
-                        else:
-                            save_accumulation_acc = None # so WanDB doesn't log values at these stepss 
-                            # save_accumulation_loss = None
+                    accumulation_boundary = (step + 1) % gradient_accumulation_steps == 0 or step == len(train_dataloader) - 1
 
                     if train_config.use_fp16:
                         # if fp16 is enabled, use gradient scaler to handle gradient update
                         scaler.scale(loss).backward()
-                        if (step + 1) % gradient_accumulation_steps == 0 or step == len(train_dataloader) - 1:
+                        if accumulation_boundary:
                             if train_config.gradient_clipping and train_config.gradient_clipping_threshold > 0.0:
                                 scaler.unscale_(optimizer)
                                 if train_config.enable_fsdp:
@@ -250,7 +307,7 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
                     else:
                         # regular backpropagation when fp16 is not used
                         loss.backward()
-                        if (step + 1) % gradient_accumulation_steps == 0 or step == len(train_dataloader) - 1:
+                        if accumulation_boundary:
                             if train_config.gradient_clipping and train_config.gradient_clipping_threshold > 0.0:
                                 if train_config.enable_fsdp:
                                     model.clip_grad_norm_(train_config.gradient_clipping_threshold)
@@ -263,31 +320,35 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
                         profile_context.step()
                     if train_config.flop_counter and profile_context.is_done():
                         TFlops = profile_context.get_flops_per_sec() / 1e12
-                    if wandb_run:
-                        if not train_config.enable_fsdp or rank==0:
-                            wandb_run.log({
-                                'train/epoch': epoch + 1,
-                                'train/step': epoch * len(train_dataloader) + step,
-                                'train/loss': loss.detach().float(),
-                                'train/accuracy': step_acc,  # ADDED
-                                'train/accumulation_accuracy': save_accumulation_acc # ADDED    
-                                # 'train/accumulation_loss': save_accumulation_loss, # ADDED
-                            
-                            })
-
-                    pbar.set_description(f"Training Epoch: {epoch+1}/{train_config.num_epochs}, step {step}/{len(train_dataloader)} completed (loss: {loss.detach().float()} / accuracy: {step_acc})")
-
-                    if train_config.save_metrics:
-                        save_to_json(metrics_filename, train_step_loss, train_loss, train_step_perplexity, train_prep, train_step_accuracy, train_acc, train_accumulation_accuracy, val_step_loss, val_loss, val_step_perplexity, val_prep, val_step_accuracy, val_acc)
+
+                    if accumulation_boundary:
+                        log_window(window_start)
+                        window_start = step + 1
+                        total_optimizer_steps += 1
+                        if resume_checkpointer is not None and total_optimizer_steps % train_config.resume_checkpoint_steps == 0:
+                            resume_checkpointer.save(total_train_steps, model, optimizer, lr_scheduler, scaler, {
+                                "epoch": epoch,
+                                "step": step + 1, # first step of this epoch still to run
+                                "total_train_steps": total_train_steps,
+                                "total_optimizer_steps": total_optimizer_steps,
+                                "best_val_loss": best_val_loss,
+                                "train_prep": train_prep, "train_loss": train_loss, "train_acc": train_acc,
+                                "val_prep": val_prep, "val_loss": val_loss, "val_acc": val_acc,
+                                "epoch_times": epoch_times, "checkpoint_times": checkpoint_times,
+                                "unique_folder": str(unique_folder),
+                                "metrics_filename": metrics_filename if train_config.save_metrics else None,
+                                "train_metrics": train_metrics.state_dict(),
+                                "epoch_rng_state": epoch_rng_state,
+                                "rng_state": get_rng_state(),
+                                })
+                log_window(window_start) # steps left over when max_train_step cut the window short
                 pbar.close()
 
         epoch_end_time = time.perf_counter()-epoch_start_time
         epoch_times.append(epoch_end_time)
-        # Reducing total_loss across all devices if there's more than one CUDA device
-        if is_xpu_available() and (torch.xpu.device_count() > 1 and train_config.enable_fsdp):
-            dist.all_reduce(total_loss, op=dist.ReduceOp.SUM)
-        elif torch.cuda.device_count() > 1 and train_config.enable_fsdp:
-            dist.all_reduce(total_loss, op=dist.ReduceOp.SUM)
+        # Reducing the epoch sums across all devices if there's more than one device
+        distributed = train_config.enable_fsdp and ((is_xpu_available() and torch.xpu.device_count() > 1) or torch.cuda.device_count() > 1)
+        total_loss, epoch_correct, epoch_total = train_metrics.reduce_epoch(distributed)
         train_epoch_loss = total_loss / len(train_dataloader)
         if train_config.enable_fsdp:
             train_epoch_loss = train_epoch_loss/world_size
@@ -307,9 +368,8 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
         if train_config.run_validation:
             eval_ppl, eval_epoch_loss, temp_val_loss, temp_step_perplexity, temp_val_accuracy, eval_epoch_accuracy = evaluation(model, train_config, eval_dataloader, local_rank, tokenizer, wandb_run) # ADDED
             if train_config.save_metrics:
-                val_step_loss.extend(temp_val_loss)
-                val_step_perplexity.extend(temp_step_perplexity)
-                val_step_accuracy.extend(temp_val_accuracy) # ADDED
+                for val_step, (step_loss, step_ppl, step_acc) in enumerate(zip(temp_val_loss, temp_step_perplexity, temp_val_accuracy)):
+                    metrics_writer.write("val", "step", epoch=epoch + 1, step=val_step, loss=step_loss, perplexity=step_ppl, accuracy=step_acc)
             should_save_model = train_config.save_model and eval_epoch_loss < best_val_loss
         
         checkpoint_start_time = time.perf_counter()
@@ -388,7 +448,9 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
 
         # Saving the results every epoch to plot later
         if train_config.save_metrics:
-            save_to_json(metrics_filename, train_step_loss, train_loss, train_step_perplexity, train_prep, train_step_accuracy, train_acc, train_accumulation_accuracy, val_step_loss, val_loss, val_step_perplexity, val_prep, val_step_accuracy, val_acc)
+            metrics_writer.write("train", "epoch", epoch=epoch + 1, loss=train_loss[-1], perplexity=train_prep[-1], accuracy=train_acc[-1])
+            if train_config.run_validation:
+                metrics_writer.write("val", "epoch", epoch=epoch + 1, loss=val_loss[-1], perplexity=val_prep[-1], accuracy=val_acc[-1])
 
     avg_epoch_time = sum(epoch_times)/ len(epoch_times)
     avg_checkpoint_time = sum(checkpoint_times)/ len(checkpoint_times) if len(checkpoint_times) > 0 else 0
@@ -409,7 +471,10 @@ def train(model, train_dataloader, eval_dataloader, tokenizer, optimizer, lr_sch
         results['avg_eval_accuracy'] = avg_eval_acc # ADDED
     results["avg_epoch_time"] = avg_epoch_time
     results["avg_checkpoint_time"] = avg_checkpoint_time
+    if resume_checkpointer is not None:
+        resume_checkpointer.wait()
     if train_config.save_metrics:
+        metrics_writer.close()
         results["metrics_filename"] = metrics_filename
     if train_config.flop_counter:
         results["model_tflops"]= TFlops
@@ -435,14 +500,12 @@ def evaluation(model,train_config, eval_dataloader, local_rank, tokenizer, wandb
         world_size = int(os.environ["WORLD_SIZE"])
     model.eval()
     eval_preds = []
-    val_step_loss = []
-    val_step_perplexity = []
-    val_step_accuracy = [] # ADDED
     # val_step_preds = [] # ADDED
-    eval_loss = 0.0  # Initialize evaluation loss
-    total_correct = 0 # ADDED
-    total_tokens = 0 # ADDED
+    val_metrics = MetricAccumulator() # ADDED, step losses and accuracy counts stay on the GPU until the pass is done
     total_eval_steps = 0
+    choice_probs = [] # per answer distribution over the answer letters, only filled with eval_answer_choices
+    if train_config.eval_answer_choices:
+        letter_ids = answer_token_ids(tokenizer, train_config.answer_letters)
     with MemoryTrace() as memtrace:
         for step, batch in enumerate(tqdm(eval_dataloader,colour="green", desc="evaluating Epoch", dynamic_ncols=True)):
             total_eval_steps += 1
@@ -462,37 +525,33 @@ def evaluation(model,train_config, eval_dataloader, local_rank, tokenizer, wandb
             # Ensure no gradients are computed for this scope to save memory
             with torch.no_grad():
                 # Forward pass and compute loss
-                outputs = model(**batch)
-                loss = outputs.loss
-                logits = outputs.logits # ADDED
-                batch_size, seq_length, embed_dim = logits.shape # ADDED NOT USED 
-                if train_config.save_metrics:
-                    val_step_loss.append(loss.detach().float().item())
-                    val_step_perplexity.append(float(torch.exp(loss.detach().float())))
-
-                    # track accuracy
-                    step_correct, step_total = compute_accuracy(logits, batch["labels"]) # ADDED
-                    step_acc = step_correct / step_total if step_total > 0 else 0 # ADDED
-                    val_step_accuracy.append(step_acc) # ADDED
-
-                    total_correct += step_correct
-                    total_tokens += step_total
-
-                    # save predictions for future roll-up
-                    # val_step_preds.append(logits.argmax(dim=-1).detach().cpu()) # ADDED
-
-                eval_loss += loss.detach().float()
+                if train_config.eval_answer_choices:
+                    # only the answer position goes through the LM head, loss is the answer letter's cross entropy
+                    keep, answer_labels = answer_positions(batch["labels"])
+                    logits = project_positions(model, batch, keep)
+                    loss = torch.nn.functional.cross_entropy(logits.float(), answer_labels)
+                    probs, step_correct, step_total = choice_distribution(logits, answer_labels, letter_ids)
+                    choice_probs.append(probs)
+                else:
+                    outputs = model(**batch)
+                    loss = outputs.loss
+                    logits = outputs.logits # ADDED
+                    step_correct, step_total = accuracy_counts(logits, batch["labels"]) # ADDED
+                val_metrics.update(loss, step_correct, step_total)
+
+                # save predictions for future roll-up
+                # val_step_preds.append(logits.argmax(dim=-1).detach().cpu()) # ADDED
             # Decode predictions and add to evaluation predictions list
-            preds = torch.argmax(outputs.logits, -1)
-            eval_preds.extend(
-                tokenizer.batch_decode(preds.detach().cpu().numpy(), skip_special_tokens=True)
-            )
+            if not train_config.eval_answer_choices:
+                preds = torch.argmax(outputs.logits, -1)
+                eval_preds.extend(
+                    tokenizer.batch_decode(preds.detach().cpu().numpy(), skip_special_tokens=True)
+                )
 
-    # If there's more than one CUDA device, reduce evaluation loss across all devices
-    if is_xpu_available() and (torch.xpu.device_count() > 1 and train_config.enable_fsdp):
-        dist.all_reduce(eval_loss, op=dist.ReduceOp.SUM)
-    if torch.cuda.device_count() > 1 and train_config.enable_fsdp:
-        dist.all_reduce(eval_loss, op=dist.ReduceOp.SUM)
+    # one host sync for the step series, then reduce the evaluation sums across all devices if there's more than one
+    val_metrics.flush()
+    distributed = train_config.enable_fsdp and ((is_xpu_available() and torch.xpu.device_count() > 1) or torch.cuda.device_count() > 1)
+    eval_loss, total_correct, total_tokens = val_metrics.reduce_epoch(distributed)
 
     # Compute average loss and perplexity
     eval_epoch_loss = eval_loss / len(eval_dataloader)
@@ -503,6 +562,12 @@ def evaluation(model,train_config, eval_dataloader, local_rank, tokenizer, wandb
     # compute average accuracy
     eval_epoch_accuracy = total_correct / total_tokens if total_tokens > 0 else 0
 
+    # one device to host copy for the whole pass, distributions are rows over train_config.answer_letters in eval order
+    if train_config.eval_answer_choices and train_config.save_metrics and choice_probs:
+        os.makedirs(train_config.output_dir, exist_ok=True)
+        probs_filename = f"{train_config.output_dir}/choice_probs_{local_rank}_{train_config.model_nickname}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.pt"
+        torch.save({"letters": train_config.answer_letters, "probs": torch.cat(choice_probs).cpu()}, probs_filename)
+
     # Print evaluation metrics
     if train_config.enable_fsdp:
         if local_rank==0:
@@ -517,7 +582,7 @@ def evaluation(model,train_config, eval_dataloader, local_rank, tokenizer, wandb
                         'eval/accuracy': eval_epoch_accuracy # ADDED
                     }, commit=False)
 
-    return eval_ppl, eval_epoch_loss, val_step_loss, val_step_perplexity, val_step_accuracy, eval_epoch_accuracy # ADDED
+    return eval_ppl, eval_epoch_loss, val_metrics.step_loss, val_metrics.step_perplexity, val_metrics.step_accuracy, eval_epoch_accuracy # ADDED
 
 def freeze_transformer_layers(model, num_layer):
    for i, layer in enumerate(model.model.layers):
@@ -687,31 +752,3 @@ def save_train_params(train_config, fsdp_config, rank):
             f.write(config_yaml)
         if rank==0:
             print(f"training params are saved in {file_name}")
-
-def save_to_json(
-        output_filename, 
-        train_step_loss, train_epoch_loss, 
-        train_step_ppl, train_epoch_ppl, 
-        train_step_accuracy, train_epoch_accuracy, 
-        train_accumulation_accuracy, # ADDED
-        val_step_loss, val_epoch_loss, 
-        val_step_ppl, val_epoch_ppl, 
-        val_step_accuracy, val_epoch_accuracy, 
-    ):
-    metrics_data = {
-        "train_step_loss": train_step_loss,
-        "train_epoch_loss": train_epoch_loss,
-        "train_step_perplexity": train_step_ppl,
-        "train_epoch_perplexity": train_epoch_ppl,
-        "train_step_accuracy": train_step_accuracy, # ADDED
-        "train_epoch_accuracy": train_epoch_accuracy, # ADDED
-        "train_accumulation_accuracy": train_accumulation_accuracy, # ADDED
-        "val_step_loss": val_step_loss,
-        "val_epoch_loss": val_epoch_loss,
-        "val_step_perplexity": val_step_ppl,
-        "val_epoch_perplexity": val_epoch_ppl, 
-        "val_step_accuracy": val_step_accuracy, # ADDED
-        "val_epoch_accuracy": val_epoch_accuracy, # ADDED
-    }
-    with open(output_filename, "w") as f:
-        json.dump(metrics_data, f)
@@ -1 +1,2 @@
 from calyapo.utils.persistence import *
+from calyapo.utils.stage_cache import *
\ No newline at end of file
@@ -2,21 +2,268 @@ import numpy as np
 import pandas as pd
 import re
 import json
+import hashlib
+import shutil
+import tempfile
+import importlib.util
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Any, List, Tuple, Iterable, Union, Callable
 from calyapo.data_preprocessing.cleaning_objects import DataPackage
 from calyapo.configurations.data_map_config import TRAIN_PLANS
 
 
+def _json_default(obj: Any) -> Any:
+    """Lets json serialize lazily materialized records (eg. CompactIndividual) one at a time."""
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def file_digest(path: Path) -> str:
+    """sha256 of a file's bytes, read in 1MB chunks."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def package_header_path(path: Path) -> Path:
+    """Sidecar header of a streamed DataPackage, eg. plan_IGS_fullsplit.jsonl -> plan_IGS_fullsplit.header.json"""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.header.json")
+
+class JSONLRecords:
+    def __init__(self, path: Path, offset: int, count: int):
+        """
+        Lazy, re-iterable view over one key's records in a streamed DataPackage file.
+        Only one record is decoded at a time.
+        """
+        self.path = Path(path)
+        self.offset = offset
+        self.count = count
+
+    def __iter__(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            f.seek(self.offset)
+            for _ in range(self.count):
+                yield json.loads(f.readline())
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"<JSONLRecords: {self.path.name} offset={self.offset} count={self.count}>"
+
+class JSONLPackageWriter:
+    FORMAT = 'calyapo-datapackage-jsonl'
+
+    def __init__(self, out_path: Path, meta: Dict = None):
+        """
+        Streams a DataPackage to compact JSONL as records are produced.
+        Each key is spooled to its own temp file then concatenated on close, so a key's records stay contiguous 
+        and the sidecar header can point at them by byte offset. Memory stays flat with respondent count.
+        """
+        self.out_path = Path(out_path)
+        self.out_path.parent.mkdir(parents=True, exist_ok=True)
+        self.meta = dict(meta) if meta else {}
+        self.extras = {} # non-list data_store values, small enough to live in the header
+        self._spools = {}
+        self._counts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def _spool(self, key: str):
+        if key not in self._spools:
+            self._spools[key] = tempfile.TemporaryFile(mode='w+b', dir=self.out_path.parent)
+            self._counts[key] = 0
+        return self._spools[key]
+
+    def write(self, key: str, record: Any):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+        self._spool(key).write(line.encode('utf-8') + b'\n')
+        self._counts[key] += 1
+
+    def extend(self, key: str, records: Iterable[Any]):
+        self._spool(key)
+        for record in records:
+            self.write(key, record)
+
+    def close(self, meta: Dict = None):
+        if meta:
+            self.meta.update(meta)
+        keys = {}
+        with open(self.out_path, 'wb') as out:
+            for key, spool in self._spools.items():
+                keys[key] = {'offset' : out.tell(), 'count' : self._counts[key]}
+                spool.seek(0)
+                shutil.copyfileobj(spool, out)
+                spool.close()
+        header = {
+            'format' : self.FORMAT, 
+            'meta' : self.meta, 
+            'keys' : keys, 
+            'extras' : self.extras
+        }
+        package_header_path(self.out_path).write_text(json.dumps(header, indent=2, default=_json_default))
+        self._spools = {}
+
+    def _discard(self):
+        for spool in self._spools.values():
+            spool.close()
+        self._spools = {}
+
+def load_package_jsonl(path: Path) -> DataPackage:
+    """Reads a streamed DataPackage back with every key as a lazy JSONLRecords iterable."""
+    path = Path(path)
+    header = json.loads(package_header_path(path).read_text())
+    if header.get('format') != JSONLPackageWriter.FORMAT:
+        raise ValueError(f"(load_package_jsonl) '{path}' has no valid DataPackage header")
+    meta = header['meta']
+    package = DataPackage(meta.get('dataset_name', 'unknown'), meta.get('train_plan', 'unknown'), meta.get('time_period', 'unknown'))
+    package.meta.update(meta)
+    for key, value in header.get('extras', {}).items():
+        package[key] = value
+    for key, loc in header['keys'].items():
+        package[key] = JSONLRecords(path, offset=loc['offset'], count=loc['count'])
+    return package
+
+# ---- Columnar intermediate formats ----
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+def columnar_schema_path(path: Path) -> Path:
+    """Sidecar schema of a columnar frame, eg. IGS_cleaned_20240819.cols -> IGS_cleaned_20240819.schema.json"""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.schema.json")
+
+def _categorize(column: pd.Series) -> pd.Categorical:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.array
+    return pd.Categorical(column)
+
+def save_columnar(df: pd.DataFrame, out_path: Path, align: int = 64):
+    """
+    Writes a DataFrame as back to back raw column buffers plus a sidecar json schema.
+    Numeric, bool and datetime columns keep their numpy dtype, everything else (strings, mixed objects) 
+    is stored as int32 categorical codes with its categories in the schema.
+    Each column sits at its own aligned offset so readers can memory-map just the columns they need.
+    """
+    out_path = Path(out_path)
+    schema = {'format' : 'calyapo-columnar', 'nrows' : len(df), 'columns' : {}}
+    with open(out_path, 'wb') as f:
+        for col in df.columns:
+            column = df[col]
+            if isinstance(column.dtype, np.dtype) and column.dtype.kind in 'biufcmM':
+                values = column.to_numpy()
+                entry = {}
+            else:
+                cat = _categorize(column)
+                values = cat.codes.astype(np.int32)
+                entry = {'categories' : cat.categories.tolist()}
+            f.write(b'\0' * (-f.tell() % align))
+            entry.update({'dtype' : values.dtype.str, 'offset' : f.tell()})
+            f.write(np.ascontiguousarray(values).tobytes())
+            schema['columns'][str(col)] = entry
+    columnar_schema_path(out_path).write_text(json.dumps(schema, indent=2, default=str))
+
+def load_columnar(path: Path, columns: Iterable[str] = None) -> pd.DataFrame:
+    """
+    Memory-maps a columnar frame, only touching the columns asked for. 
+    Requested columns the frame doesn't have are skipped, same as a usecols filter.
+    """
+    path = Path(path)
+    schema = json.loads(columnar_schema_path(path).read_text())
+    nrows = schema['nrows']
+    wanted = schema['columns'].keys() if columns is None else [col for col in schema['columns'] if col in set(columns)]
+    data = {}
+    for col in wanted:
+        entry = schema['columns'][col]
+        if nrows == 0:
+            values = np.empty(0, dtype=entry['dtype'])
+        else:
+            values = np.memmap(path, dtype=entry['dtype'], mode='r', offset=entry['offset'], shape=(nrows,))
+        if 'categories' in entry:
+            data[col] = pd.Categorical.from_codes(values, categories=entry['categories'])
+        else:
+            data[col] = values
+    return pd.DataFrame(data, columns=list(wanted))
+
+def save_parquet(df: pd.DataFrame, out_path: Path):
+    """Parquet via pyarrow, string columns are stored dictionary encoded and come back categorical."""
+    if not HAS_PYARROW:
+        raise ImportError("(save_parquet) The 'parquet' format needs pyarrow, install it or use the 'columnar' format")
+    df = df.copy()
+    for col in df.columns:
+        if not (isinstance(df[col].dtype, np.dtype) and df[col].dtype.kind in 'biufcmM'):
+            df[col] = _categorize(df[col])
+    df.to_parquet(out_path, index=False)
+
+def load_parquet(path: Path, columns: Iterable[str] = None) -> pd.DataFrame:
+    if columns is not None:
+        import pyarrow.parquet as pq
+        present = set(pq.read_schema(path).names)
+        columns = [col for col in columns if col in present]
+    return pd.read_parquet(path, columns=columns, memory_map=True)
+
+STATA_CHUNKSIZE = 50_000 # rows decoded at a time when projecting wide .dta files
+
+def load_stata(path: Path, columns: Iterable[str] = None, chunksize: int = STATA_CHUNKSIZE) -> pd.DataFrame:
+    """
+    Reads a .dta file without converting categoricals. 
+    If columns is given, only those present in the file are kept, and rows are read chunksize at a time 
+    so the full-width frame is never held in memory at once.
+    """
+    if columns is None:
+        return pd.read_stata(path, convert_categoricals=False)
+    with pd.read_stata(path, iterator=True) as reader:
+        present = set(reader.variable_labels().keys())
+    columns = [col for col in columns if col in present]
+    chunks = pd.read_stata(path, convert_categoricals=False, columns=columns, chunksize=chunksize)
+    with chunks:
+        frames = list(chunks)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+INTERMEDIATE_FORMATS = {
+    # intermediate_format : file suffix, the format name doubles as the file_saver/LOADERS data type
+    'csv' : '.csv', 
+    'columnar' : '.cols', 
+    'parquet' : '.parquet'
+}
+
+def validate_intermediate_format(intermediate_format: str):
+    if intermediate_format not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"Unknown intermediate format '{intermediate_format}'. Choose from: {list(INTERMEDIATE_FORMATS.keys())}")
+    if intermediate_format == 'parquet' and not HAS_PYARROW:
+        raise ImportError("The 'parquet' intermediate format needs pyarrow, install it or use the 'columnar' format")
+
+PACKAGE_FORMATS = {
+    # persistence_format : (file suffix, file_saver/LOADERS data type)
+    'json' : ('.json', 'DataPackage'), 
+    'jsonl' : ('.jsonl', 'DataPackageJSONL')
+}
+
 LOADERS: dict[str, Callable[[Path], Any]] = {
-    'csv': pd.read_csv,
-    'dta': lambda p: pd.read_stata(p, convert_categoricals=False),
+    'csv': lambda p, columns=None: pd.read_csv(p, usecols=None if columns is None else (lambda col, keep=set(columns): col in keep)),
+    'dta': load_stata,
     'json': lambda p: json.loads(p.read_text()),
-    'DataPackage': lambda p: DataPackage.from_dict(json.loads(p.read_text()))
+    'jsonl': lambda p: [json.loads(line) for line in p.read_text(encoding='utf-8').splitlines() if line.strip()],
+    'DataPackage': lambda p: DataPackage.from_dict(json.loads(p.read_text())), 
+    'DataPackageJSONL': load_package_jsonl, 
+    'columnar': load_columnar, 
+    'parquet': load_parquet
 }
 
-def _try_load(file_path: Path, dtype: str, debug: str = False, verbose: str = False) -> Any:
-    """Loads file or returns none."""
+def _try_load(file_path: Path, dtype: str, columns: Iterable[str] = None, debug: str = False, verbose: str = False) -> Any:
+    """Loads file or returns none. Tabular loaders (csv, columnar, parquet) only read the given columns."""
     loader = LOADERS.get(dtype)
     if not loader:
         if verbose or debug: 
@@ -25,15 +272,52 @@ def _try_load(file_path: Path, dtype: str, debug: str = False, verbose: str = Fa
     try:
         if verbose: 
             print(f"(try_load) Loader '{loader}' for datatype '{dtype}' active for file path '{file_path}'")
+        if columns is not None:
+            return loader(file_path, columns=columns)
         return loader(file_path)
     except Exception:
         return None
 
-def _file_load_helper(file_path, data_type: Iterable, debug: str = False, verbose: str = False):
+MAGIC_BYTES = {
+    # leading bytes : datatype, checked when a file's extension doesn't name one of the candidate datatypes
+    b'<stata_dta>' : 'dta', # stata 117+
+    # stata 113-115, release byte then byte order (1 = hilo, 2 = lohi) then filetype (always 1)
+    **{bytes([release, byteorder, 1]) : 'dta' for release in (0x71, 0x72, 0x73) for byteorder in (1, 2)}, 
+    b'PAR1' : 'parquet'
+}
+
+def sniff_data_type(file_path: Path, data_type: Iterable[str]) -> List[str]:
+    """
+    Orders candidate datatypes so the one a file actually is gets tried first, 
+    going off its extension then its magic bytes. The rest stay in order as fallbacks.
+    """
+    data_type = list(data_type)
+    if len(data_type) < 2:
+        return data_type
+    sniffed = None
+    suffix = Path(file_path).suffix.lstrip('.').lower()
+    if suffix in data_type:
+        sniffed = suffix
+    else:
+        try:
+            with open(file_path, 'rb') as f:
+                head = f.read(16)
+        except OSError:
+            head = b''
+        for magic, dtype in MAGIC_BYTES.items():
+            if head.startswith(magic) and dtype in data_type:
+                sniffed = dtype
+                break
+    if sniffed is None:
+        return data_type
+    return [sniffed] + [dtype for dtype in data_type if dtype != sniffed]
+
+def _file_load_helper(file_path, data_type: Iterable, columns: Iterable[str] = None, debug: str = False, verbose: str = False):
     data = None
+    data_type = sniff_data_type(file_path, data_type)
     for dtype in data_type:
         if data is None:
-            data = _try_load(file_path=file_path, dtype=dtype, debug=debug, verbose=verbose)
+            data = _try_load(file_path=file_path, dtype=dtype, columns=columns, debug=debug, verbose=verbose)
         else:
             break
     if data is None:
@@ -41,43 +325,73 @@ def _file_load_helper(file_path, data_type: Iterable, debug: str = False, verbos
     return data
 
 
+def list_target_files(in_path: Path, data_type: Union[str|Iterable], sort_files: bool = False) -> List[Path]:
+    """
+    Lists the files file_loader would load from in_path, in the order it would load them.
+    Files come in glob (filesystem) order per datatype, the order existing splits were built with. 
+    sort_files sorts them by name within each datatype so the order is stable across filesystems, this can reassign val/test individuals of existing splits.
+    Files matched by more than one pattern are only listed once.
+    """
+    if isinstance(in_path, str):
+        in_path = Path(in_path)
+    if isinstance(data_type, str):
+        data_type = [data_type]
+    
+    if not in_path.is_dir():
+        return [in_path]
+    target_files = []
+    for dtype in data_type: 
+        files = in_path.glob(f"*.{dtype}")
+        if sort_files:
+            files = sorted(files)
+        target_files.extend(files)
+    return list(dict.fromkeys(target_files))
+
 def file_loader(
             in_path: Path, 
             data_type: str, 
             path_extract: Union[str|Iterable] = None, 
             always_return_lst: bool = False, 
+            columns: Iterable[str] = None, 
+            num_workers: int = None, 
+            sort_files: bool = False, 
             debug: bool = False, 
             verbose: bool = False
         ) -> Tuple[List[pd.DataFrame], List[str]]:
         """
         Handles extracting data. Returns a list of data objects if given a 
         directory, or a single data object if given a file.
+        If columns is given, tabular files are projected down to just those columns on read.
+        Directories are loaded across num_workers threads (default one per file, capped at the cpu count), 
+        results keep list_target_files order (sort_files sorts a directory's files by name).
         """
-        if not in_path.exists():
-            raise FileNotFoundError(f"(File Loader) Inputted path '{in_path}' not found")
-
         if isinstance(in_path, str):
             in_path = Path(in_path)
 
+        if not in_path.exists():
+            raise FileNotFoundError(f"(File Loader) Inputted path '{in_path}' not found")
+
         if isinstance(data_type, str):
             data_type = [data_type]
 
-        if in_path.is_dir():
-            if verbose: print(f"(File Loader) Scanning directory for {data_type} files...")
-            target_files = []
-            for dtype in data_type: 
-                files = list(in_path.glob(f"*.{dtype}"))
-                target_files.extend(files)
+        if verbose and in_path.is_dir(): print(f"(File Loader) Scanning directory for {data_type} files...")
+        target_files = list_target_files(in_path=in_path, data_type=data_type, sort_files=sort_files)
+
+        def load(file_path: Path):
+            if verbose: print(f"(File Loader) Loading {file_path.name}...")
+            return _file_load_helper(file_path=file_path, data_type=data_type, columns=columns, debug=debug, verbose=verbose)
+
+        if num_workers is None:
+            num_workers = min(len(target_files), os.cpu_count() or 1)
+        if num_workers > 1 and len(target_files) > 1:
+            # parsers spend most of their time in C (read_csv, read_stata unpacking) so threads overlap well and skip pickling frames back
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                data = list(executor.map(load, target_files))
         else:
-            target_files = [in_path]
+            data = [load(file_path) for file_path in target_files]
 
-        data = []
         path_extractions = []
         for file_path in target_files:
-            if verbose: print(f"(File Loader) Loading {file_path.name}...")
-            
-            data.append(_file_load_helper(file_path=file_path, data_type=data_type, debug=debug, verbose=verbose))
-
             if path_extract is not None:
                 if debug:
                     print(f"(File Loader | Debug) scanning file path: {file_path}")
@@ -124,20 +438,38 @@ def file_saver(out_path: Path, data: Any, data_type: str, indnt: int = 4, verbos
             
     if data_type == "csv":
         data.to_csv(out_path, index=False)
+    elif data_type == "columnar":
+        save_columnar(data, out_path)
+    elif data_type == "parquet":
+        save_parquet(data, out_path)
     elif data_type == "json":
         with open(out_path, 'w') as f:
-            json.dump(data, f, indent=indnt)
+            json.dump(data, f, indent=indnt, default=_json_default)
     elif data_type == "jsonl":
         with open(out_path, 'w', encoding='utf-8') as f:
             for entry in data:
-                json_record = json.dumps(entry, ensure_ascii=False)
+                json_record = json.dumps(entry, ensure_ascii=False, default=_json_default)
                 f.write(json_record + '\n')
+    elif data_type == "DataPackageJSONL":
+        # lists (eg. a single wave's indiv maps) are streamed under the 'full' key
+        meta = getattr(data, 'meta', {})
+        with JSONLPackageWriter(out_path, meta=meta) as writer:
+            items = data.items() if hasattr(data, 'items') else [('full', data)]
+            for key, value in items:
+                if isinstance(value, (list, tuple, JSONLRecords)):
+                    writer.extend(key, value)
+                else:
+                    writer.extras[key] = value
+    elif data_type == "DataPackage" and isinstance(data, list):
+        # per-wave saves pass the wave's list of indiv maps
+        with open(out_path, 'w') as f:
+            json.dump(data, f, indent=indnt, default=_json_default)
     elif data_type == "DataPackage" and hasattr(data, 'to_dict'):
         with open(out_path, 'w') as f:
-            json.dump(data.to_dict(debug=True), f, indent=indnt)
+            json.dump(data.to_dict(debug=True), f, indent=indnt, default=_json_default)
     elif hasattr(data, 'to_dict'):
         with open(out_path, 'w') as f:
-            json.dump(data.to_dict(), f, indent=indnt)
+            json.dump(data.to_dict(), f, indent=indnt, default=_json_default)
     
     if verbose: print(f"(File Saver) Results saved to: {out_path}")
 
@@ -1,147 +1,203 @@
-from typing import Iterable, List, Dict    
-import random
+from typing import Iterable, List, Dict, Tuple
 import numpy as np
 
 from calyapo.configurations.config import UNIVERSAL_RANDOM_SEED
 
-random.seed(UNIVERSAL_RANDOM_SEED)
-np.random.seed(UNIVERSAL_RANDOM_SEED)
-
-class ReservoirSample:
-    def __init__(self, values: Iterable, k: int, n: int):
-        self.reservoir = []
-        self.out_sample = []
-
-        self.k = k
-        self.n = n
-
-        # begin sampling initially inputed list of values
-        for i in range(k):
-            self.reservoir.append(values[k])
-
-        counter = k
-        while counter < n:
-            j = random.randrange(counter+1)
-
-            if j < k:
-                self.out_sample.append(self.reservoir[j])
-                self.reservoir[j] = values[counter]
-            else:
-                # datapoint didn't roll into sample
-                self.out_sample.append(values[counter])
-            
-            counter +=1 
-    
-    def get(self, sample: str):
-        if sample == 'reservoir':
-            return self.reservoir
-        elif sample == 'out_sample':
-            return self.out_sample
-        
-def _num_unique_individuals(value_buckets: Iterable[Iterable], debug: bool = False):
-    # unify
-    unique_pool = set()
-    for b in value_buckets:
-        for item in b:
-            if 'uniqueid' in item:
-                if debug: print(f"(num_unique_individuals | Debug) Grabbing 'uniqueids' ")
-                uid = item.get('uniqueid')
-            else:
-                if debug: print(f"(num_unique_individuals | Debug) Grabbing normal 'ids' ")
-                uid = item.get('id')
-            unique_pool.add(uid)
-    return len(unique_pool), unique_pool
-
-# def assign_to_eligible_bucket(val_id, eligibility_map, current_val):
-#         eligible_for = eligibility_map[val_id]
-        
-#         # We can only pick buckets that are:
-#         # A) Not the target bucket (already handled)
-#         # B) The individual actually exists in (has valid data for)
-#         potential_targets = [b for b in remaining_buckets if b in eligible_for]
-        
-#         if not potential_targets:
-#             if debug: print(f"Warning: ID {val_id} has no valid alternative buckets. Skipping.")
-#             return
-
-#         # Re-normalize distribution for the specific valid targets for this person
-#         # e.g. if they only fit in 'Train', p becomes [1.0]
-#         specific_probs = [bucket_distrib[b] for b in potential_targets]
-#         norm_probs = [p / sum(specific_probs) for p in specific_probs]
-        
-#         chosen_idx = np.random.choice(potential_targets, p=norm_probs)
-#         output_buckets[chosen_idx].append(current_val)
-#         consumed_ids.add(val_id)
-        
-def exhaustive_hierarchal_sample(value_buckets: Iterable[Iterable[Dict]], targ_bucket_idx: int, bucket_distrib: Iterable, silent_handle: bool = False, debug: bool = False):
+def _get_uid(item: Dict):
+    return item.get('uniqueid') if 'uniqueid' in item else item.get('id')
+
+def _bucket_uids(value_buckets: Iterable[Iterable[Dict]]) -> Tuple[int, List[np.ndarray]]:
+    """
+    Deduplicates uniqueids across buckets with np.unique.
+    Returns the number of unique individuals and, per bucket, each entry's index into the unique ids.
+    """
+    uids = np.array([str(_get_uid(item)) for b in value_buckets for item in b], dtype=str) # fixed width strings sort in C, mixed id types sort together
+    unique_uids, inverse = np.unique(uids, return_inverse=True)
+    bounds = np.cumsum([0] + [len(b) for b in value_buckets])
+    return len(unique_uids), [inverse[bounds[i]:bounds[i + 1]] for i in range(len(value_buckets))]
+
+def exhaustive_hierarchal_sample(
+        value_buckets: Iterable[Iterable[Dict]],
+        targ_bucket_idx: int,
+        bucket_distrib: Iterable,
+        rng: np.random.Generator = None,
+        silent_handle: bool = False,
+        debug: bool = False
+    ):
+    """
+    Assigns every unique individual to exactly one bucket.
+    The target bucket (eg. the one with the least datapoints) gets a uniform sample of bucket_distrib[targ] * num unique individuals,
+    everyone else is assigned to one of the remaining buckets they're eligible for (have an entry in),
+    with bucket_distrib renormalized over those buckets. Individuals with no eligible remaining bucket are dropped.
+    All assignments are drawn at once from rng, pass an explicit np.random.Generator for reproducible output.
+    """
     assert targ_bucket_idx < len(bucket_distrib), f"Target bucket idx '{targ_bucket_idx}' exceeds number of buckets given distribution '{len(bucket_distrib)}'"
     assert len(value_buckets) == len(bucket_distrib), f"Number of values buckets '{len(value_buckets)}' does not match distributions specified '{len(bucket_distrib)}'"
-    
-    if debug:
-        ids_in_targ = [indiv.get('id') for indiv in value_buckets[targ_bucket_idx]]
-        print(f"(exhaus_heir_samp | Debug) bucket cleanliness check: total entries '{len(ids_in_targ)}' vs num unique entries: '{len(set(ids_in_targ))}'")
+    if rng is None:
+        rng = np.random.default_rng(UNIVERSAL_RANDOM_SEED)
+    num_buckets = len(value_buckets)
+    bucket_distrib = np.asarray(bucket_distrib, dtype=float)
 
     num_elem_lst = [len(sublist) for sublist in value_buckets]
-    total_unique_count, global_id_pool = _num_unique_individuals(value_buckets)
+    total_unique_count, bucket_uids = _bucket_uids(value_buckets)
     targ_num = bucket_distrib[targ_bucket_idx] * total_unique_count
 
     if debug:
-        print(f"(exhaus_heir_samp | Debug) smallest bucket length <idx = '{targ_bucket_idx}'>: '{len(value_buckets[targ_bucket_idx])}'")
+        print(f"(exhaus_heir_samp | Debug) bucket cleanliness check: total entries '{num_elem_lst[targ_bucket_idx]}' vs num unique entries: '{len(np.unique(bucket_uids[targ_bucket_idx]))}'")
+        print(f"(exhaus_heir_samp | Debug) smallest bucket length <idx = '{targ_bucket_idx}'>: '{num_elem_lst[targ_bucket_idx]}'")
         print(f"(exhaus_heir_samp | Debug) distrib: '{bucket_distrib}'")
         print(f"(exhaus_heir_samp | Debug) num unique indivs: '{total_unique_count}'")
         print(f"(exhaus_heir_samp | Debug) targ num: '{targ_num}'")
 
     if targ_num > num_elem_lst[targ_bucket_idx]:
         err_msg = f"(exhaustive sampler) target number '{targ_num}' higher than total number of elements in given bucket '{num_elem_lst[targ_bucket_idx]}' exiting"
-        if silent_handle: 
+        if silent_handle:
             print(err_msg)
-            return 
+            return
         else:
             raise ValueError(err_msg)
-    
-    # for the bucket with the least datapoints (eg. val w/ only 1169) --> we reservoir sample until we meet 10% (eg. 900 individuals) then redistribute
-    sampler = ReservoirSample(values=value_buckets[targ_bucket_idx], k=int(targ_num), n=num_elem_lst[targ_bucket_idx])
-
-    output_buckets = [[] for _ in range(len(value_buckets))]
-    output_buckets[targ_bucket_idx] = sampler.get(sample='reservoir')
-    consumed_ids = set([
-        indiv_map.get('uniqueid') if 'uniqueid' in indiv_map else indiv_map.get('id') 
-        for indiv_map in output_buckets[targ_bucket_idx]
-    ])
 
-    remaining_distribution = [prob / (1 - bucket_distrib[targ_bucket_idx]) for i, prob in enumerate(bucket_distrib) if i != targ_bucket_idx]
-    remaining_buckets = [i for i in range(len(value_buckets)) if i != targ_bucket_idx]
+    # each individual's first entry per bucket, -1 where they're not eligible for that bucket
+    first_entry = np.full((total_unique_count, num_buckets), -1, dtype=np.int64)
+    for b, uids in enumerate(bucket_uids):
+        bucket_unique, first_positions = np.unique(uids, return_index=True)
+        first_entry[bucket_unique, b] = first_positions
+    eligible = first_entry >= 0
+
+    # for the bucket with the least datapoints (eg. val w/ only 1169) --> sample until we meet its ratio (eg. 900 individuals) then redistribute the rest
+    assignment = np.full(total_unique_count, -1, dtype=np.int64)
+    targ_candidates = np.flatnonzero(eligible[:, targ_bucket_idx])
+    chosen = rng.choice(targ_candidates, size=min(int(targ_num), len(targ_candidates)), replace=False)
+    assignment[chosen] = targ_bucket_idx
+
+    # everyone else picks a remaining bucket they're eligible for, one uniform draw per individual
+    remaining_buckets = [i for i in range(num_buckets) if i != targ_bucket_idx]
+    rest = np.flatnonzero(assignment < 0)
+    weights = eligible[rest][:, remaining_buckets] * bucket_distrib[remaining_buckets]
+    totals = weights.sum(axis=1)
+    draws = rng.random(len(rest)) * totals
+    picks = (np.cumsum(weights, axis=1) <= draws[:, None]).sum(axis=1)
+    has_option = totals > 0
+    assignment[rest[has_option]] = np.asarray(remaining_buckets)[np.minimum(picks[has_option], len(remaining_buckets) - 1)]
 
     if debug:
-        print(f"(exhaus_heir_samp | Debug) remaining distrib: '{remaining_distribution}'")
         print(f"(exhaus_heir_samp | Debug) remaining buckets: '{remaining_buckets}'")
-        print(f"(exhaus_heir_samp | Debug) num in out_sample: '{len(sampler.get(sample='out_sample'))}'")
-        
-    # sweep through out sample 
-    for val in sampler.get(sample='out_sample'):
-        if 'uniqueid' in val:
-            val_id = val.get('uniqueid')
-        else:
-            val_id = val.get('id')
-        if val_id in consumed_ids:
-            continue
-
-        bucket_idx = np.random.choice(remaining_buckets, p=remaining_distribution)
-        output_buckets[bucket_idx].append(val)
+        print(f"(exhaus_heir_samp | Debug) individuals without an eligible remaining bucket: '{int((~has_option).sum())}'")
 
-        consumed_ids.add(val_id)
+    output_buckets = []
+    for b in range(num_buckets):
+        # bucket entries come out in their original order
+        positions = np.sort(first_entry[assignment == b, b])
+        output_buckets.append([value_buckets[b][i] for i in positions])
 
     if debug:
-        print(f"(exhaus_heir_samp | Debug) initial counts per bucket after processing out sample:\n")
+        print(f"(exhaus_heir_samp | Debug) final counts per bucket:\n")
         for i in range(len(output_buckets)):
             print(f"Index '{i}'; length '{len(output_buckets[i])}'")
 
-    # sweep thru everyone else
-    for val_id in global_id_pool:
-        if val_id not in consumed_ids:
-            # need to assign individual to a split they're actually eligible for not just random choice it
-            bucket_idx = np.random.choice(remaining_buckets, p=remaining_distribution)
-            output_buckets[bucket_idx].append(indiv_map)
-            consumed_ids.add(val_id)
-
     return output_buckets
+
+# ---- Stratified allocation ----
+def _cell_ranks(strata: np.ndarray, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """Size of every cell and each element's uniformly random rank within its cell."""
+    order = rng.permutation(len(strata))
+    order = order[np.argsort(strata[order], kind='stable')] # grouped by cell, shuffled within
+    sizes = np.bincount(strata)
+    starts = np.cumsum(sizes) - sizes
+    ranks = np.empty(len(strata), dtype=np.int64)
+    ranks[order] = np.arange(len(strata)) - starts[strata[order]]
+    return sizes, ranks
+
+def _cell_quotas(sizes: np.ndarray, total: float, min_cell_count: int, rng: np.random.Generator, capacity: np.ndarray = None) -> np.ndarray:
+    """
+    Integer quota per cell summing to total (rounded, as far as capacity allows). 
+    Quotas are proportional to cell size, cells below min_cell_count (or their capacity if smaller) are raised to it 
+    and every other cell's proportional share is scaled down to make room, so the minimums never push the total past the split's budget.
+    Quotas are rounded systematically over a random cell order, each cell is rounded up or down and the total is kept.
+    Raises if the minimums alone need more than total.
+    """
+    capacity = sizes if capacity is None else capacity
+    floors = np.minimum(min_cell_count, capacity)
+    if floors.sum() > total:
+        raise ValueError(
+            f"(stratified split) min_cell_count {min_cell_count} over {int((floors > 0).sum())} demographic cells needs {int(floors.sum())} individuals "
+            f"but the split's budget is {total:.0f}, lower min_cell_count or stratify on fewer labels"
+        )
+    share = sizes * (total / max(sizes.sum(), 1))
+    fill = lambda scale: np.clip(share * scale, floors, capacity)
+    # scale the proportional shares until the raised and capped quotas add up to total
+    low, high = 0.0, 1.0
+    while fill(high).sum() < total and high < 2.0 ** 32:
+        low, high = high, high * 2
+    for _ in range(64):
+        mid = (low + high) / 2
+        if fill(mid).sum() < total:
+            low = mid
+        else:
+            high = mid
+    quotas = fill(high)
+
+    order = rng.permutation(len(quotas))
+    cumulative = np.floor(np.cumsum(quotas[order]) + rng.random())
+    rounded = np.empty(len(quotas), dtype=np.int64)
+    rounded[order] = np.diff(cumulative, prepend=0)
+    return np.minimum(rounded, capacity)
+
+def stratified_assign(strata: np.ndarray, target_ratios: Dict[str, float], min_cell_count: int = 0, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Assigns each element to a split (0 = train, 1 = val, 2 = test) so every cell (eg. an age x party combination) is split by target_ratios.
+    val and test get at least min_cell_count of each cell before train, as far as the cell allows, taken out of the other cells' shares 
+    so val and test stay at their ratio of all elements (see _cell_quotas). Raises if the minimums don't fit in a split.
+    strata are integer cell codes, eg. from np.unique(..., return_inverse=True).
+    """
+    if rng is None:
+        rng = np.random.default_rng(UNIVERSAL_RANDOM_SEED)
+    strata = np.asarray(strata, dtype=np.int64)
+    sizes, ranks = _cell_ranks(strata, rng)
+    val_quotas = _cell_quotas(sizes, len(strata) * target_ratios['val'], min_cell_count, rng)
+    test_quotas = _cell_quotas(sizes, len(strata) * target_ratios['test'], min_cell_count, rng, capacity=sizes - val_quotas)
+    val_end = val_quotas[strata]
+    test_end = val_end + test_quotas[strata]
+    return np.where(ranks < val_end, 1, np.where(ranks < test_end, 2, 0))
+
+def stratified_choice(strata: np.ndarray, size: int, min_cell_count: int = 0, rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Sorted indices of a sample of size elements (or all of them if fewer) drawn proportionally from every cell, 
+    each cell giving at least min_cell_count if it can out of the other cells' shares. Raises if the minimums need more than size.
+    """
+    if rng is None:
+        rng = np.random.default_rng(UNIVERSAL_RANDOM_SEED)
+    strata = np.asarray(strata, dtype=np.int64)
+    if len(strata) == 0:
+        return np.array([], dtype=np.int64)
+    sizes, ranks = _cell_ranks(strata, rng)
+    quotas = _cell_quotas(sizes, min(size, len(strata)), min_cell_count, rng)
+    return np.flatnonzero(ranks < quotas[strata])
+
+# ---- Hashed draws ----
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+
+def uid_hash(uids: Iterable, seed: int = UNIVERSAL_RANDOM_SEED, salt: str = '') -> np.ndarray:
+    """
+    64 bit hash of every id that only depends on the id, seed and salt, not on its position or the other ids.
+    FNV-1a over the utf-8 bytes (one vectorized step per byte column) finished with a seeded splitmix64 mix.
+    """
+    encoded = np.array([f"{salt}{uid}".encode('utf-8') for uid in uids], dtype=bytes)
+    if len(encoded) == 0:
+        return np.array([], dtype=np.uint64)
+    width = encoded.dtype.itemsize
+    byte_cols = np.frombuffer(encoded.tobytes(), dtype=np.uint8).reshape(len(encoded), width)
+    lengths = np.char.str_len(encoded)
+    h = np.full(len(encoded), _FNV_OFFSET, dtype=np.uint64)
+    for j in range(width):
+        # padding past an id's length is skipped so hashes don't depend on the longest id
+        h = np.where(j < lengths, (h ^ byte_cols[:, j]) * _FNV_PRIME, h)
+    h = h + np.uint64((seed * 0x9E3779B97F4A7C15) % 2**64)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+def uid_uniform(uids: Iterable, seed: int = UNIVERSAL_RANDOM_SEED, salt: str = '') -> np.ndarray:
+    """Uniform [0, 1) draw per id from uid_hash, the same id always draws the same value."""
+    return (uid_hash(uids, seed=seed, salt=salt) >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
@@ -0,0 +1,105 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Union
+
+from calyapo.configurations.config import UNIVERSAL_STAGE_CACHE_PATH
+from calyapo.utils.persistence import file_digest
+
+def _canonical(obj: Any) -> Any:
+    """Makes configs json-stable so equal configs always hash the same (eg. sets and Paths)."""
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    elif isinstance(obj, (set, frozenset)):
+        return sorted([_canonical(v) for v in obj], key=str)
+    elif isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    elif isinstance(obj, Path):
+        return str(obj)
+    return obj
+
+class StageCache:
+    def __init__(self, manifest_path: Union[str|Path] = UNIVERSAL_STAGE_CACHE_PATH, enabled: bool = True, verbose: bool = False):
+        """
+        Content-addressed cache for preprocessing stages.
+        A stage's key hashes the contents of its input files, the config entries it depends on, the seed and ratios.
+        Upstream outputs are downstream inputs, so an edit only rebuilds the stages whose inputs actually changed.
+        Manifest format: {'stages' : {<stage> : {'key' : ..., 'outputs' : {<path> : <digest>}}}, 'files' : {<path> : [size, mtime, digest]}}
+        """
+        self.manifest_path = Path(manifest_path)
+        self.enabled = enabled
+        self.verbose = verbose
+        if self.manifest_path.exists():
+            self.manifest = json.loads(self.manifest_path.read_text())
+        else:
+            self.manifest = {'stages' : {}, 'files' : {}}
+
+    # --------------
+    # Hashing funcs
+    # --------------
+    def file_digest(self, path: Union[str|Path]) -> str:
+        """sha256 of a file's bytes, memoized on (size, mtime) so unchanged files aren't re-read."""
+        path = Path(path)
+        stat = path.stat()
+        memo = self.manifest['files'].get(str(path))
+        if memo and memo[0] == stat.st_size and memo[1] == stat.st_mtime_ns:
+            return memo[2]
+
+        digest = file_digest(path)
+        self.manifest['files'][str(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def stage_key(self, stage: str, inputs: Iterable[Union[str|Path]], config: Any = None) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(stage.encode())
+        for path in sorted([Path(p) for p in inputs], key=str):
+            hasher.update(str(path).encode())
+            hasher.update(self.file_digest(path).encode())
+        hasher.update(json.dumps(_canonical(config), sort_keys=True, default=str).encode())
+        return hasher.hexdigest()
+
+    # --------------
+    # Cache funcs
+    # --------------
+    def is_fresh(self, stage: str, key: str) -> bool:
+        """True if the stage last ran with this key and all of its outputs are still on disk unchanged."""
+        if not self.enabled:
+            return False
+        entry = self.manifest['stages'].get(stage)
+        if entry is None or entry['key'] != key or not entry['outputs']:
+            return False
+        for path, digest in entry['outputs'].items():
+            if not Path(path).exists() or self.file_digest(path) != digest:
+                return False
+        if self.verbose: print(f"(Stage Cache) '{stage}' unchanged, skipping")
+        return True
+
+    def record(self, stage: str, key: str, outputs: Iterable[Union[str|Path]]):
+        if not self.enabled:
+            return
+        self.manifest['stages'][stage] = {
+            'key' : key,
+            'outputs' : {str(path): self.file_digest(path) for path in outputs}
+        }
+        self.save()
+        if self.verbose: print(f"(Stage Cache) recorded '{stage}'")
+
+    def run(self, stage: str, inputs: Iterable[Union[str|Path]], config: Any, build: Callable[[], Any], outputs: Callable[[], Iterable[Union[str|Path]]]) -> Any:
+        """
+        Runs build() unless the stage is fresh, then records whatever outputs() lists.
+        Returns build()'s result, or None when skipped so callers fall back to loading outputs from disk.
+        """
+        key = self.stage_key(stage, inputs, config)
+        if self.is_fresh(stage, key):
+            return None
+        result = build()
+        self.record(stage, key, outputs())
+        return result
+
+    def outputs(self, stage: str) -> List[Path]:
+        entry = self.manifest['stages'].get(stage, {})
+        return [Path(p) for p in entry.get('outputs', {})]
+
+    def save(self):
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.write_text(json.dumps(self.manifest, indent=2))
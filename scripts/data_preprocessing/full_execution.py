@@ -1,7 +1,8 @@
 import argparse
 from calyapo.data_preprocessing.raw_handler import RawHandler
 from calyapo.data_preprocessing.split_handler import SplitHandler
-from calyapo.configurations.data_map_config import TRAIN_PLANS
+from calyapo.configurations.data_map_config import TRAIN_PLANS, ALL_DATA_MAPS
+from calyapo.utils.stage_cache import StageCache
 
 
 def main():
@@ -12,30 +13,98 @@ def main():
     parser.add_argument("--val_ratio", type=float, nargs='?', default=0.2, help="Proportion of data on validation.")
     parser.add_argument("--test_ratio", type=float, nargs='?', default=0.1, help="Proportion of data on test.")
     parser.add_argument("--seed", type=int, nargs='?', default=42, help="Seed for any and all random processes")
+    parser.add_argument("--num_workers", type=int, nargs='?', default=1, help="Number of processes to clean and split survey waves across.")
+    parser.add_argument("--vectorized", action=argparse.BooleanOptionalAction, default=False, help="Decode whole columns at once when splitting on questions.")
+    parser.add_argument("--compact", action=argparse.BooleanOptionalAction, default=False, help="Hold indiv maps as compact records until they are serialized.")
+    parser.add_argument("--persistence_format", type=str, nargs='?', default='json', choices=['json', 'jsonl'], help="'jsonl' streams processed and fullsplit packages to compact JSONL with a sidecar header. Only question splitting runs without holding the fullpack in memory, ratio splitting still loads it.")
+    parser.add_argument("--intermediate_format", type=str, nargs='?', default='csv', choices=['csv', 'columnar', 'parquet'], help="'columnar' (numpy memmap) and 'parquet' (needs pyarrow) keep dtypes and only read the columns a plan needs.")
+    parser.add_argument("--project_columns", action=argparse.BooleanOptionalAction, default=False, help="Only load the raw columns this train plan and the race maps use. Cleaned waves then only hold this plan's columns.")
+    parser.add_argument("--split_mode", type=str, nargs='?', default='random', choices=['random', 'stratified', 'hash'], help="'stratified' splits every demographic cell by the train/val/test ratios, 'hash' splits each individual by a hash of their uniqueid and the seed.")
+    parser.add_argument("--stratify_on", type=str, nargs='+', default=None, help="Demographic labels of the train plan to stratify splits on (eg. age partyid), required with --split_mode stratified. Every cell of their cross product is split by the ratios, so keep it to a few labels.")
+    parser.add_argument("--min_cell_count", type=int, nargs='?', default=0, help="Least individuals per demographic cell in val and test when stratified, taken out of the larger cells' shares so the ratios hold. Errors if the cells need more than a split's share.")
+    parser.add_argument("--stream_subproportions", action=argparse.BooleanOptionalAction, default=False, help="Write nested subproportions in one pass over the saved training jsonl instead of loading it into memory.")
+    parser.add_argument("--stratify_subproportions", type=str, nargs='+', default=None, help="Meta fields (eg. time_period) or demographic labels (eg. age partyid) to keep balanced across streamed subproportions.")
+    parser.add_argument("--append_waves", type=str, nargs='+', default=None, help="Only ingest these new waves (eg. 20241120) and append them to the saved outputs instead of rerunning every wave.")
+    parser.add_argument("--sort_files", action=argparse.BooleanOptionalAction, default=False, help="Load survey waves in file name order instead of filesystem order. Stable across machines but can reassign val/test individuals of existing splits.")
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True, help="Skip stages whose inputs, mappings, seed and ratios are unchanged since the last saved run.")
     parser.add_argument("--save", action=argparse.BooleanOptionalAction, default=True)
     parser.add_argument("--verbose", action=argparse.BooleanOptionalAction, default=True) # Set True to see the metadata
     parser.add_argument("--debug", action=argparse.BooleanOptionalAction, default=True)
     
     args = parser.parse_args()
     
-    raw_handler = RawHandler() # no randomness 
+    raw_handler = RawHandler(num_workers=args.num_workers, intermediate_format=args.intermediate_format, project_columns=args.project_columns, train_plan=args.train_plan, sort_files=args.sort_files) # no randomness 
     split_handler = SplitHandler( # randomness based on training setting
         train_plan=args.train_plan, 
         subproportions=args.subproportions, 
         train_ratio=args.train_ratio, 
         val_ratio=args.val_ratio, 
         test_ratio=args.test_ratio, 
-        seed=args.seed
+        seed=args.seed, 
+        vectorized=args.vectorized, 
+        compact=args.compact, 
+        num_workers=args.num_workers, 
+        persistence_format=args.persistence_format, 
+        intermediate_format=args.intermediate_format, 
+        stream_subproportions=args.stream_subproportions, 
+        stratify_subproportions=args.stratify_subproportions, 
+        split_mode=args.split_mode, 
+        stratify_on=args.stratify_on, 
+        min_cell_count=args.min_cell_count, 
+        sort_files=args.sort_files
     )
     plan_config = TRAIN_PLANS[args.train_plan]
+    if args.append_waves:
+        # existing splits stay put, new individuals are split by uniqueid hash
+        for time_period in args.append_waves:
+            datasets = [dataset for dataset in plan_config['datasets'] if time_period in ALL_DATA_MAPS.get(dataset, {})]
+            if not datasets:
+                raise ValueError(f"No dataset of train plan '{args.train_plan}' maps wave '{time_period}'")
+            for dataset in datasets:
+                split_handler.append_wave(dataset_name=dataset, time_period=time_period, raw_handler=raw_handler, save=args.save, debug=args.debug, verbose=args.verbose)
+        return
+    cache = StageCache(enabled=args.cache and args.save, verbose=args.verbose) # cached stages must have their outputs on disk
     for dataset in plan_config['datasets']:
-        raw_output = raw_handler.clean_dataset(dataset_name=dataset, save=args.save, debug=args.debug, verbose=args.verbose)
-        interim_output = split_handler.split_on_questions(package=raw_output, dataset_name=dataset, save=args.save, debug=args.debug, verbose=args.verbose)
-        split_handler.split_on_ratio(package=interim_output, dataset_name=dataset, save=args.save, debug=args.debug, verbose=args.verbose) # writes to folders
+        # a skipped stage returns None and the next stage pulls its outputs from the default paths
+        raw_output = cache.run(
+            stage=f"raw_clean:{dataset}", 
+            inputs=raw_handler.stage_files(dataset)[0], 
+            config=raw_handler.stage_config(dataset), 
+            build=lambda: raw_handler.clean_dataset(dataset_name=dataset, save=args.save, debug=args.debug, verbose=args.verbose), 
+            outputs=lambda: raw_handler.stage_files(dataset)[1]
+        )
+        interim_output = cache.run(
+            stage=f"split_on_questions:{args.train_plan}:{dataset}", 
+            inputs=split_handler.stage_files('split_on_questions', dataset)[0], 
+            config=split_handler.stage_config('split_on_questions', dataset), 
+            build=lambda: split_handler.split_on_questions(package=raw_output, dataset_name=dataset, save=args.save, debug=args.debug, verbose=args.verbose), 
+            outputs=lambda: split_handler.stage_files('split_on_questions', dataset)[1]
+        )
+        cache.run(
+            stage=f"split_on_ratio:{args.train_plan}:{dataset}", 
+            inputs=split_handler.stage_files('split_on_ratio', dataset)[0], 
+            config=split_handler.stage_config('split_on_ratio', dataset), 
+            build=lambda: split_handler.split_on_ratio(package=interim_output, dataset_name=dataset, save=args.save, debug=args.debug, verbose=args.verbose), # writes to folders
+            outputs=lambda: split_handler.stage_files('split_on_ratio', dataset)[1]
+        )
         
-    precombine_output = split_handler.precombiner(save=args.save, debug=args.debug, verbose=args.verbose)
-    combine_outputs = split_handler.combine_datasets(package=precombine_output, save=args.save, debug=args.debug, verbose=args.verbose)
-    subprop_output = split_handler.subproportion_dataset(package=combine_outputs, save=args.save, debug=args.debug, verbose=args.verbose)
+    def combine():
+        precombine_output = split_handler.precombiner(save=args.save, debug=args.debug, verbose=args.verbose)
+        return split_handler.combine_datasets(package=precombine_output, save=args.save, debug=args.debug, verbose=args.verbose)
+    combine_outputs = cache.run(
+        stage=f"combine_datasets:{args.train_plan}", 
+        inputs=split_handler.stage_files('combine_datasets')[0], 
+        config=split_handler.stage_config('combine_datasets'), 
+        build=combine, 
+        outputs=lambda: split_handler.stage_files('combine_datasets')[1]
+    )
+    subprop_output = cache.run(
+        stage=f"subproportion_dataset:{args.train_plan}", 
+        inputs=split_handler.stage_files('subproportion_dataset')[0], 
+        config=split_handler.stage_config('subproportion_dataset'), 
+        build=lambda: split_handler.subproportion_dataset(package=combine_outputs, save=args.save, debug=args.debug, verbose=args.verbose), 
+        outputs=lambda: split_handler.stage_files('subproportion_dataset')[1]
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
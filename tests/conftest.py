@@ -0,0 +1,69 @@
+import json
+import pandas as pd
+import pytest
+
+from calyapo.configurations.config import DATA_PATHS
+
+
+@pytest.fixture
+def igs_intermediate(tmp_path, monkeypatch):
+    """One cleaned IGS wave on disk, the ideology_to_ideology columns are all numeric and one unrelated column is text."""
+    wave = pd.DataFrame({
+        'ID': [12411, 6333, 12897],
+        'party_reg': [1.0, 3.0, 4.0],
+        'Q31': [2.0, 3.0, 5.0],
+        'Q32': [1.0, 4.0, 1.0],
+        'Q35': [41.0, 22.0, 45.0],
+        'Q36': [2.0, 1.0, 1.0],
+        'Q47': [3.0, 3.0, None],
+        'comments': ['none', 'n/a', 'ok'],
+        'time_period': [20240819] * 3,
+    })
+    wave.to_csv(tmp_path / "IGS_cleaned_20240819.csv", index=False)
+    monkeypatch.setitem(DATA_PATHS['IGS'], 'intermediate', tmp_path)
+    return tmp_path
+
+
+class CharTokenizer:
+    """Character level stand in for a HuggingFace tokenizer. bos and eos are single tokens so prompt ids prefix the example's ids."""
+    name_or_path = 'char-tokenizer'
+    bos_token = '<s>'
+    eos_token = '</s>'
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, add_special_tokens=False):
+        ids, i = [], 0
+        while i < len(text):
+            for special, idx in ((self.bos_token, 1), (self.eos_token, 2)):
+                if text.startswith(special, i):
+                    ids.append(idx)
+                    i += len(special)
+                    break
+            else:
+                ids.append(ord(text[i]) + 3)
+                i += 1
+        return ids
+
+    def __call__(self, texts, add_special_tokens=False):
+        self.calls += 1
+        return {'input_ids': [self.encode(text) for text in texts]}
+
+    def __len__(self):
+        return 0x110000 + 3
+
+
+@pytest.fixture
+def char_tokenizer():
+    return CharTokenizer()
+
+
+@pytest.fixture
+def prompts_jsonl(tmp_path):
+    """A small split of prompt/completion lines of varying lengths."""
+    path = tmp_path / "plan_train.jsonl"
+    with open(path, 'w') as f:
+        for i in range(25):
+            f.write(json.dumps({'prompt': f"Q{i}: {'x' * (i % 7)} Answer:", 'completion': f" {'ABCD'[i % 4]}"}) + "\n")
+    return path
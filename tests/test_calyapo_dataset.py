@@ -0,0 +1,83 @@
+import dataclasses
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from calyapo.training.configs.datasets import calyapo_dataset_config
+from calyapo.training.datasets import calyapo_dataset
+from calyapo.training.datasets.calyapo_dataset import CalyapoDataset, IGNORE_INDEX
+
+
+def _config(**kwargs):
+    return dataclasses.replace(calyapo_dataset_config(), **kwargs)
+
+
+def _items(dataset):
+    return [{k: np.asarray(v, dtype=np.int64).tolist() for k, v in dataset[i].items()} for i in range(len(dataset))]
+
+
+@pytest.mark.parametrize('predict_eos', [True, False])
+def test_token_cache_matches_tokenizing_on_access(prompts_jsonl, char_tokenizer, tmp_path, predict_eos):
+    on_access = CalyapoDataset(_config(predict_eos=predict_eos), char_tokenizer, prompts_jsonl)
+    cached = CalyapoDataset(_config(predict_eos=predict_eos, token_cache=True, token_cache_dir=str(tmp_path / 'cache')), char_tokenizer, prompts_jsonl)
+
+    assert len(cached) == len(on_access) == 25
+    assert _items(cached) == _items(on_access)
+    assert cached.cache['input_ids'].dtype == np.int64
+    assert isinstance(cached.cache['input_ids'], np.memmap)
+    assert all((item['labels'][:1] == [IGNORE_INDEX]) for item in _items(cached))
+
+
+def test_token_cache_is_reused_then_rebuilt_when_its_key_changes(prompts_jsonl, char_tokenizer, tmp_path, monkeypatch):
+    config = _config(token_cache=True, token_cache_dir=str(tmp_path / 'cache'))
+    first = CalyapoDataset(config, char_tokenizer, prompts_jsonl)
+    assert len(list((tmp_path / 'cache').glob("*.npy"))) == 3
+    assert not list((tmp_path / 'cache').glob("*.tmp.npy"))
+
+    def no_rebuild(self, paths):
+        raise AssertionError("token cache rebuilt for an unchanged file")
+    with monkeypatch.context() as patch:
+        patch.setattr(CalyapoDataset, '_build_token_cache', no_rebuild)
+        assert _items(CalyapoDataset(config, char_tokenizer, prompts_jsonl)) == _items(first)
+
+    # predict_eos and the data file are both part of the key
+    first.update_eos_pred(False)
+    assert len(list((tmp_path / 'cache').glob("*.npy"))) == 6
+    with open(prompts_jsonl, 'a') as f:
+        f.write('{"prompt": "Q: new Answer:", "completion": " A"}\n')
+    assert len(CalyapoDataset(config, char_tokenizer, prompts_jsonl)) == 26
+    assert len(list((tmp_path / 'cache').glob("*.npy"))) == 9
+
+
+@pytest.mark.parametrize('predict_eos', [True, False])
+def test_batch_tokenize_matches_tokenizing_on_access_across_batches(prompts_jsonl, char_tokenizer, monkeypatch, predict_eos):
+    monkeypatch.setattr(calyapo_dataset, 'TOKENIZE_BATCH_SIZE', 4) # 25 examples over 7 batched calls, the last one partial
+    on_access = CalyapoDataset(_config(predict_eos=predict_eos), char_tokenizer, prompts_jsonl)
+    char_tokenizer.calls = 0
+    batched = CalyapoDataset(_config(predict_eos=predict_eos, batch_tokenize=True), char_tokenizer, prompts_jsonl)
+
+    assert char_tokenizer.calls == 2 * 7
+    assert batched.tokens['input_ids'].dtype == np.int32
+    assert _items(batched) == _items(on_access)
+
+
+def test_flat_tokens_of_batch_tokenize_and_token_cache_agree(prompts_jsonl, char_tokenizer, tmp_path):
+    batched = CalyapoDataset(_config(batch_tokenize=True), char_tokenizer, prompts_jsonl)
+    cached = CalyapoDataset(_config(token_cache=True, token_cache_dir=str(tmp_path / 'cache')), char_tokenizer, prompts_jsonl)
+    (batched_buffers, batched_offsets), (cached_buffers, cached_offsets) = batched.flat_tokens(), cached.flat_tokens()
+
+    assert np.array_equal(batched_offsets, cached_offsets)
+    for key in ['input_ids', 'attention_mask', 'labels']:
+        assert np.array_equal(batched_buffers[key], cached_buffers[key])
+    items = _items(batched)
+    assert [item['labels'] for item in items] == [batched_buffers['labels'][start:end].tolist() for start, end in zip(batched_offsets[:-1], batched_offsets[1:])]
+    assert CalyapoDataset(_config(), char_tokenizer, prompts_jsonl).flat_tokens() is None
+
+
+def test_batch_tokenize_rejects_completions_that_add_no_tokens(tmp_path, char_tokenizer):
+    path = tmp_path / "plan_train.jsonl"
+    path.write_text('{"prompt": "Q: Answer:", "completion": " A"}\n{"prompt": "Q: Answer:", "completion": ""}\n')
+    with pytest.raises(AssertionError, match="1 examples"):
+        CalyapoDataset(_config(predict_eos=False, batch_tokenize=True), char_tokenizer, path)
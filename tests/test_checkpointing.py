@@ -0,0 +1,84 @@
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from calyapo.training.model_checkpointing import ResumeCheckpointer, find_resume_checkpoint, get_rng_state, load_resume_checkpoint, set_rng_state
+
+
+def _training_state(seed=0):
+    """A linear model with a frozen bias, its optimizer and scheduler after one step."""
+    torch.manual_seed(seed)
+    model = torch.nn.Linear(4, 3)
+    model.bias.requires_grad_(False)
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=0.1)
+    lr_scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1, gamma=0.5)
+    _step(model, optimizer, lr_scheduler)
+    return model, optimizer, lr_scheduler
+
+
+def _step(model, optimizer, lr_scheduler):
+    model(torch.randn(8, 4)).pow(2).mean().backward()
+    optimizer.step()
+    optimizer.zero_grad()
+    lr_scheduler.step()
+
+
+def test_resume_checkpoint_restores_the_saved_snapshot(tmp_path):
+    cfg = SimpleNamespace(output_dir=str(tmp_path), resume_keep_last=2)
+    model, optimizer, lr_scheduler = _training_state()
+    saved_weight = model.weight.detach().clone()
+    saved_optimizer = optimizer.state_dict()['state'][0]['exp_avg'].clone()
+
+    checkpointer = ResumeCheckpointer(cfg)
+    checkpointer.save(7, model, optimizer, lr_scheduler, None, {'epoch': 0, 'step': 7, 'rng': get_rng_state()})
+    next_draw = torch.rand(1)
+    with torch.no_grad():
+        model.weight.add_(1.0) # training carries on while the snapshot is written
+    checkpointer.wait()
+    for _ in range(3):
+        _step(model, optimizer, lr_scheduler)
+
+    step_dir = find_resume_checkpoint(cfg)
+    assert step_dir == tmp_path / 'resume' / 'step_000000007'
+    assert 'bias' not in torch.load(step_dir / 'rank0.pt', weights_only=False)['model']
+    progress = load_resume_checkpoint(model, optimizer, lr_scheduler, None, step_dir)
+
+    assert (progress['epoch'], progress['step']) == (0, 7)
+    set_rng_state(progress['rng'])
+    assert torch.equal(torch.rand(1), next_draw)
+    assert torch.equal(model.weight, saved_weight)
+    assert torch.equal(optimizer.state_dict()['state'][0]['exp_avg'], saved_optimizer)
+    assert lr_scheduler.last_epoch == 1 and optimizer.param_groups[0]['lr'] == pytest.approx(0.05)
+
+
+def test_resume_checkpointer_keeps_the_newest(tmp_path):
+    model, optimizer, lr_scheduler = _training_state()
+    checkpointer = ResumeCheckpointer(SimpleNamespace(output_dir=str(tmp_path), resume_keep_last=1)) # never fewer than 2
+    for step_id in [1, 2, 10, 11]:
+        checkpointer.save(step_id, model, optimizer, lr_scheduler, None, {'epoch': 0, 'step': step_id})
+    checkpointer.wait()
+    assert sorted(path.name for path in (tmp_path / 'resume').iterdir()) == ['step_000000010', 'step_000000011']
+
+
+def test_find_resume_checkpoint_needs_every_rank(tmp_path):
+    cfg = SimpleNamespace(output_dir=str(tmp_path))
+    assert find_resume_checkpoint(cfg) is None
+    for step_dir, files in [('step_000000001', ['rank0.pt', 'rank1.pt']), ('step_000000002', ['rank0.pt', 'rank1.tmp'])]:
+        (tmp_path / 'resume' / step_dir).mkdir(parents=True)
+        for name in files:
+            (tmp_path / 'resume' / step_dir / name).touch()
+
+    assert find_resume_checkpoint(cfg, world_size=2) == tmp_path / 'resume' / 'step_000000001'
+    assert find_resume_checkpoint(cfg, world_size=1) == tmp_path / 'resume' / 'step_000000002'
+    assert find_resume_checkpoint(cfg, world_size=3) is None
+
+
+def test_rng_state_round_trip():
+    state = get_rng_state()
+    first = (random.random(), np.random.rand(), torch.rand(1).item())
+    set_rng_state(state)
+    assert (random.random(), np.random.rand(), torch.rand(1).item()) == first
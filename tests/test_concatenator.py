@@ -0,0 +1,104 @@
+import dataclasses
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from calyapo.training.configs.datasets import calyapo_dataset_config
+from calyapo.training.data.concatenator import ConcatDataset
+from calyapo.training.datasets.calyapo_dataset import CalyapoDataset
+
+
+def _samples(num_samples=40, seed=0):
+    """Samples of 1 to 30 tokens, labels mask a random prompt prefix."""
+    rng = np.random.default_rng(seed)
+    samples = []
+    for _ in range(num_samples):
+        length = int(rng.integers(1, 31))
+        input_ids = rng.integers(3, 1000, length).tolist()
+        prompt_len = int(rng.integers(0, length))
+        samples.append({
+            'input_ids': input_ids, 
+            'attention_mask': [1] * length, 
+            'labels': [-100] * prompt_len + input_ids[prompt_len:]
+        })
+    return samples
+
+
+def _legacy_chunks(samples, chunk_size):
+    """Chunks as the list buffer ConcatDataset packed them before the flat buffers."""
+    chunks = []
+    buffer = {'input_ids': [], 'attention_mask': [], 'labels': []}
+    for sample in samples:
+        buffer = {k: v + list(sample[k]) for k, v in buffer.items()}
+        while len(buffer['input_ids']) > chunk_size:
+            chunks.append({k: v[:chunk_size] for k, v in buffer.items()})
+            buffer = {k: v[chunk_size:] for k, v in buffer.items()}
+    return chunks
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 32, 64, 10_000])
+def test_packed_chunks_match_legacy_packing(chunk_size):
+    samples = _samples()
+    packed = ConcatDataset(samples, chunk_size=chunk_size)
+    legacy = _legacy_chunks(samples, chunk_size)
+
+    assert len(packed) == len(legacy)
+    assert [{k: v.tolist() for k, v in packed[i].items()} for i in range(len(packed))] == legacy
+    if len(packed):
+        assert {k: v.tolist() for k, v in packed[-1].items()} == legacy[-1]
+    with pytest.raises(IndexError):
+        packed[len(packed)]
+
+
+def test_flat_tokens_pack_like_samples(prompts_jsonl, char_tokenizer):
+    """CalyapoDataset's flat arrays are packed without going through __getitem__, into the same chunks."""
+    dataset = CalyapoDataset(dataclasses.replace(calyapo_dataset_config(), batch_tokenize=True), char_tokenizer, prompts_jsonl)
+    packed = ConcatDataset(dataset, chunk_size=16)
+    legacy = _legacy_chunks([dataset[i] for i in range(len(dataset))], 16)
+
+    assert len(packed) == len(legacy) > 0
+    assert all({k: v.tolist() for k, v in packed[i].items()} == legacy[i] for i in range(len(packed)))
+
+
+def test_boundaries_are_sample_starts_within_the_chunk():
+    samples = _samples()
+    packed = ConcatDataset(samples, chunk_size=32)
+    starts = np.cumsum([0] + [len(sample['input_ids']) for sample in samples])
+    for idx in range(len(packed)):
+        chunk_start = idx * 32
+        expected = [0] + [int(s - chunk_start) for s in starts if chunk_start < s < chunk_start + 32]
+        assert packed.boundaries(idx).tolist() == expected
+
+
+def test_isolated_chunks_restart_position_ids_at_every_sample():
+    samples = _samples()
+    packed = ConcatDataset(samples, chunk_size=32, isolate_examples=True)
+    plain = ConcatDataset(samples, chunk_size=32)
+    starts = np.cumsum([0] + [len(sample['input_ids']) for sample in samples])
+    for idx in range(len(packed)):
+        chunk = packed[idx]
+        assert 'attention_mask' not in chunk
+        assert np.array_equal(chunk['input_ids'], plain[idx]['input_ids'])
+        # position of each token within its sample, a sample cut by the chunk start restarts at 0
+        flat_positions = np.arange(idx * 32, (idx + 1) * 32)
+        sample_starts = np.maximum(starts[np.searchsorted(starts, flat_positions, side='right') - 1], idx * 32)
+        assert chunk['position_ids'].tolist() == (flat_positions - sample_starts).tolist()
+
+
+def test_isolated_chunks_mask_labels_across_sample_boundaries():
+    """Only the first token of each sample after the chunk start loses its label, everything else matches the plain chunk."""
+    samples = _samples()
+    packed = ConcatDataset(samples, chunk_size=32, isolate_examples=True)
+    plain = ConcatDataset(samples, chunk_size=32)
+    for idx in range(len(packed)):
+        labels, plain_labels = packed[idx]['labels'], plain[idx]['labels']
+        inner_starts = packed.boundaries(idx)[1:]
+        assert np.all(labels[inner_starts] == -100)
+        keep = np.ones(32, dtype=bool)
+        keep[inner_starts] = False
+        assert np.array_equal(labels[keep], plain_labels[keep])
+        assert np.all(packed[idx]['position_ids'][inner_starts] == 0)
+    # chunks are views, masking must not write into the shared buffers
+    assert np.array_equal(packed.buffers['labels'], np.concatenate([sample['labels'] for sample in samples]))
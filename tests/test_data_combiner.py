@@ -0,0 +1,73 @@
+import json
+from collections import Counter
+
+import pytest
+
+from calyapo.data_preprocessing.cleaning_objects import DataPackage
+from calyapo.data_preprocessing.funcs.data_combiner import split_combine, stream_subdivide_training_set
+from calyapo.data_preprocessing.split_handler import SplitHandler
+from calyapo.utils.persistence import JSONLRecords
+
+
+def _combine_package(igs_intermediate):
+    processed = SplitHandler('ideology_to_ideology', train_ratio=0.8, val_ratio=0.1, test_ratio=0.1).split_on_questions(dataset_name='IGS', save=False)
+    package = DataPackage(dataset_name='multiple, combining', train_plan='ideology_to_ideology', time_period='multiple, combining')
+    package['dataset_packages'] = {'IGS': processed}
+    return package
+
+
+def test_saving_split_combine_returns_lazy_records_of_written_lines(igs_intermediate, tmp_path):
+    """Saved prompts aren't held in memory, the package reads back exactly what was written (and only this call's lines when appending)."""
+    package = _combine_package(igs_intermediate)
+    in_memory = split_combine(package=package, save=False, verbose=False)
+    out_dir = tmp_path / 'final'
+    out_dir.mkdir()
+
+    saved = split_combine(package=package, out_path=out_dir, save=True, verbose=False)
+    appended = split_combine(package=package, out_path=out_dir, save=True, mode='a', verbose=False)
+    for split in ['train', 'val', 'test']:
+        assert len(in_memory[split]) > 0
+        for key in [split, f"{split}_meta"]:
+            assert isinstance(saved[key], JSONLRecords)
+            assert list(saved[key]) == in_memory[key]
+            assert list(appended[key]) == in_memory[key]
+        assert len((out_dir / f"ideology_to_ideology_{split}.jsonl").read_text().splitlines()) == 2 * len(in_memory[split])
+
+
+def _train_jsonl(out_dir, num_lines=2000):
+    examples = [{"prompt": f"question {i}", "completion": "A"} for i in range(num_lines)]
+    metas = [{"id": i, "uniqueid": f"{i}-{20240819 + i % 3}", "time_period": str(20240819 + i % 3), "dataset": "IGS"} for i in range(num_lines)]
+    train_path, meta_path = out_dir / "plan_train.jsonl", out_dir / "plan_train_meta.jsonl"
+    train_path.write_text("".join(json.dumps(example) + "\n" for example in examples))
+    meta_path.write_text("".join(json.dumps(meta) + "\n" for meta in metas))
+    return train_path, meta_path, examples, metas
+
+
+@pytest.mark.parametrize('stratify_on', [None, ['time_period']])
+def test_stream_subdivide_training_set_writes_nested_subsets(tmp_path, stratify_on):
+    """Every subproportion is inside the next larger one, keeps file order, pairs lines with their meta and is about p of the set."""
+    train_path, meta_path, examples, metas = _train_jsonl(tmp_path)
+    subproportions = [0.7, 0.1, 0.5, 1.0]
+    out_pack = stream_subdivide_training_set(train_path, meta_path, subproportions, train_plan='plan', out_path=tmp_path, seed=3, stratify_on=stratify_on, verbose=False)
+
+    previous = set()
+    for proportion in sorted(subproportions):
+        subset, subset_meta = list(out_pack[f"train_{proportion}"]), list(out_pack[f"train_{proportion}_meta"])
+        assert subset == [json.loads(line) for line in (tmp_path / f"plan_train_{proportion}.jsonl").read_text().splitlines()]
+        lines = [int(example['prompt'].split()[-1]) for example in subset]
+        assert lines == sorted(lines)
+        assert [meta['id'] for meta in subset_meta] == lines
+        assert previous <= set(lines)
+        assert len(lines) == pytest.approx(proportion * len(examples), abs=60)
+        previous = set(lines)
+    assert len(previous) == len(examples)
+
+
+def test_stratified_stream_subdivide_keeps_every_stratum_at_its_proportion(tmp_path):
+    train_path, meta_path, examples, metas = _train_jsonl(tmp_path)
+    out_pack = stream_subdivide_training_set(train_path, meta_path, [0.1, 0.5], train_plan='plan', out_path=tmp_path, seed=3, stratify_on=['time_period'], verbose=False)
+    stratum_sizes = Counter(meta['time_period'] for meta in metas)
+    for proportion in [0.1, 0.5]:
+        subset_sizes = Counter(meta['time_period'] for meta in out_pack[f"train_{proportion}_meta"])
+        for stratum, size in stratum_sizes.items():
+            assert abs(subset_sizes[stratum] - proportion * size) <= 2
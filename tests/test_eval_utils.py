@@ -0,0 +1,59 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from calyapo.training.utils.eval_utils import answer_positions, answer_token_ids, choice_distribution
+
+
+def test_answer_positions_in_padded_and_packed_batches():
+    """The position predicting each completion's first token, one per completion even when a row packs several."""
+    labels = torch.tensor([
+        [-100, -100, -100, -100, 10, 2], # left padded, one completion
+        [-100, -100, 11, -100, -100, 12], # packed, two completions
+    ])
+    positions, answers = answer_positions(labels)
+
+    assert positions.nonzero().tolist() == [[0, 3], [1, 1], [1, 4]]
+    assert answers.tolist() == [10, 11, 12]
+    assert not answer_positions(torch.full((2, 4), -100))[0].any()
+
+
+def test_choice_distribution_scores_only_the_letters():
+    letter_ids = [10, 11, 12]
+    logits = torch.full((2, 16), -1.0)
+    logits[:, 0] = 100.0 # a non letter token wins the full vocab argmax
+    logits[0, 10], logits[0, 11] = 2.0, 1.0
+    logits[1, 12] = 3.0
+    probs, correct, total = choice_distribution(logits, torch.tensor([10, 11]), letter_ids)
+
+    assert probs.shape == (2, 3)
+    assert torch.allclose(probs.sum(dim=-1), torch.ones(2))
+    assert torch.allclose(probs[0], torch.softmax(torch.tensor([2.0, 1.0, -1.0]), dim=-1))
+    assert (int(correct), int(total)) == (1, 2)
+
+
+def test_choice_distribution_rejects_labels_outside_the_letters():
+    with pytest.raises(ValueError, match=r"\[13\]"):
+        choice_distribution(torch.zeros(2, 16), torch.tensor([10, 13]), [10, 11, 12])
+
+
+class _MergingTokenizer:
+    """Merges ':' with a following 'B', like a BPE that learned ':B'."""
+    name_or_path = 'merging-tokenizer'
+
+    def encode(self, text, add_special_tokens=False):
+        ids, i = [], 0
+        while i < len(text):
+            if text.startswith(':B', i):
+                ids.append(500)
+                i += 2
+            else:
+                ids.append(ord(text[i]))
+                i += 1
+        return ids
+
+
+def test_answer_token_ids_are_taken_in_context(char_tokenizer):
+    assert answer_token_ids(char_tokenizer, letters="ABC") == [char_tokenizer.encode(letter)[0] for letter in "ABC"]
+    with pytest.raises(ValueError, match=r"\['B'\]"):
+        answer_token_ids(_MergingTokenizer(), letters="ABC")
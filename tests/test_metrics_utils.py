@@ -0,0 +1,125 @@
+import math
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+import torch.distributed as dist
+
+from calyapo.training.utils.metrics_utils import MetricAccumulator, MetricsWriter
+
+
+def _fill(accumulator, steps):
+    for loss, correct, total in steps:
+        accumulator.update(torch.tensor(loss), torch.tensor(correct), torch.tensor(total))
+
+
+def test_flush_returns_buffered_steps_in_order_once():
+    accumulator = MetricAccumulator(step_loss_divisor=2)
+    _fill(accumulator, [(2.0, 3, 4), (4.0, 0, 0), (1600.0, 1, 1)])
+    flushed = accumulator.flush()
+
+    assert [step['loss'] for step in flushed] == [1.0, 2.0, 800.0]
+    assert flushed[0]['perplexity'] == pytest.approx(math.e)
+    assert flushed[2]['perplexity'] == math.inf
+    assert [step['accuracy'] for step in flushed] == [0.75, 0, 1.0]
+    assert accumulator.flush() == []
+    _fill(accumulator, [(6.0, 1, 2)])
+    assert [step['loss'] for step in accumulator.flush()] == [3.0]
+    assert accumulator.step_loss == [1.0, 2.0, 800.0, 3.0]
+    assert accumulator.step_accuracy == [0.75, 0, 1.0, 0.5]
+
+
+def test_reduce_epoch_sums_unscaled_losses_and_counts():
+    accumulator = MetricAccumulator(step_loss_divisor=4)
+    assert [float(v) for v in accumulator.reduce_epoch()] == [0.0, 0, 0]
+    _fill(accumulator, [(2.0, 3, 4), (4.0, 1, 5)])
+    loss_sum, correct, total = accumulator.reduce_epoch()
+
+    assert isinstance(loss_sum, torch.Tensor) and float(loss_sum) == 6.0
+    assert (correct, total) == (4, 9)
+    assert accumulator.pending # reducing doesn't flush
+
+
+def test_state_dict_resumes_epoch_sums():
+    steps = [(2.0, 3, 4), (4.0, 1, 5), (1.0, 2, 2)]
+    uninterrupted = MetricAccumulator()
+    _fill(uninterrupted, steps)
+
+    before = MetricAccumulator()
+    _fill(before, steps[:2])
+    before.flush()
+    resumed = MetricAccumulator()
+    resumed.load_state_dict(before.state_dict(), device='cpu')
+    _fill(resumed, steps[2:])
+
+    assert [float(v) for v in resumed.reduce_epoch()] == [float(v) for v in uninterrupted.reduce_epoch()]
+    fresh = MetricAccumulator()
+    fresh.load_state_dict(MetricAccumulator().state_dict())
+    assert fresh.sums is None
+
+
+def test_distributed_reduce_epoch_leaves_local_sums(tmp_path):
+    dist.init_process_group('gloo', init_method=f"file://{tmp_path / 'store'}", rank=0, world_size=1)
+    try:
+        accumulator = MetricAccumulator()
+        _fill(accumulator, [(2.0, 3, 4)])
+        local = accumulator.sums.clone()
+        loss_sum, correct, total = accumulator.reduce_epoch(distributed=True)
+    finally:
+        dist.destroy_process_group()
+    assert (float(loss_sum), correct, total) == (2.0, 3, 4)
+    assert torch.equal(accumulator.sums, local)
+
+
+def _write_epoch(writer, epoch, steps):
+    for step, loss in enumerate(steps):
+        writer.write("train", "step", epoch=epoch, step=step, loss=loss, perplexity=math.exp(loss), accuracy=0.5)
+    writer.write("train", "accumulation", epoch=epoch, step=len(steps) - 1, accuracy=0.5)
+    writer.write("val", "step", epoch=epoch, step=0, loss=steps[-1], perplexity=math.exp(steps[-1]), accuracy=0.25)
+    for split in ["train", "val"]:
+        writer.write(split, "epoch", epoch=epoch, loss=sum(steps), perplexity=math.exp(sum(steps)), accuracy=0.5)
+
+
+def test_metrics_writer_round_trips_through_load_metrics(tmp_path):
+    """Records come back as the per series lists, a resumed run appends to the same file and its series continue."""
+    load_metrics = pytest.importorskip("calyapo.training.utils.plot_metrics").load_metrics
+    filename = str(tmp_path / "metrics.jsonl")
+    writer = MetricsWriter(filename)
+    _write_epoch(writer, 1, [1.0, 2.0])
+    writer.close()
+    resumed = MetricsWriter(filename)
+    _write_epoch(resumed, 2, [0.5])
+    resumed.close()
+
+    data = load_metrics(filename)
+    assert data['train_step_loss'] == [1.0, 2.0, 0.5]
+    assert data['train_step_perplexity'] == [math.exp(1.0), math.exp(2.0), math.exp(0.5)]
+    assert data['train_accumulation_accuracy'] == [0.5, 0.5]
+    assert data['val_step_accuracy'] == [0.25, 0.25]
+    assert data['train_epoch_loss'] == data['val_epoch_loss'] == [3.0, 0.5]
+    assert 'train_step_epoch' not in data and 'train_step_step' not in data
+
+
+def test_metrics_writer_flushes_before_close(tmp_path):
+    filename = tmp_path / "metrics.jsonl"
+    writer = MetricsWriter(str(filename), flush_interval=0.05)
+    try:
+        writer.write("train", "step", epoch=1, step=0, loss=1.0)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not (filename.exists() and filename.read_text()):
+            time.sleep(0.05)
+        assert filename.read_text() == '{"split": "train", "scope": "step", "epoch": 1, "step": 0, "loss": 1.0}\n'
+    finally:
+        writer.close()
+    assert not writer.thread.is_alive()
+
+
+def test_plot_metrics_reads_metrics_jsonl(tmp_path):
+    plot_metrics = pytest.importorskip("calyapo.training.utils.plot_metrics")
+    filename = str(tmp_path / "metrics.jsonl")
+    writer = MetricsWriter(filename)
+    _write_epoch(writer, 1, [1.0, 2.0])
+    writer.close()
+    plot_metrics.plot_metrics(filename)
+    assert len(list(tmp_path.glob("metrics_*.png"))) == 4
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from calyapo.utils.persistence import sniff_data_type, file_loader
+
+
+def test_sniff_data_type_reads_stata_headers(tmp_path):
+    """Extensionless Stata files are sniffed from their header, 113-115 by release and byte order bytes, 117+ by <stata_dta>."""
+    old_release = tmp_path / "wave_old"
+    old_release.write_bytes(bytes([0x72, 0x02, 0x01, 0x00]) + b'\x00' * 12)
+    new_release = tmp_path / "wave_new"
+    new_release.write_bytes(b'<stata_dta><header><release>118</release>')
+    assert sniff_data_type(old_release, ['csv', 'dta']) == ['dta', 'csv']
+    assert sniff_data_type(new_release, ['csv', 'dta']) == ['dta', 'csv']
+
+
+def test_sniff_data_type_keeps_text_starting_with_stata_release_letters(tmp_path):
+    """Text whose first byte happens to be a Stata release byte ('q', 'r', 's') isn't mistaken for Stata."""
+    for name, first_col in [('q', 'question'), ('r', 'respondent'), ('s', 'state')]:
+        path = tmp_path / f"wave_{name}"
+        pd.DataFrame({first_col: [1, 2], 'party': [3, 4]}).to_csv(path, index=False)
+        assert sniff_data_type(path, ['csv', 'dta']) == ['csv', 'dta']
+        assert list(file_loader(in_path=path, data_type=['csv', 'dta']).columns) == [first_col, 'party']
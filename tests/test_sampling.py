@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from calyapo.utils.sampling import exhaustive_hierarchal_sample, stratified_assign, stratified_choice, uid_hash, uid_uniform
+
+
+def _buckets(num_indivs=12):
+    """Everyone has a train entry, all but every 4th a val entry and every 3rd a test entry."""
+    train = [{'uniqueid': f"{i}-1", 'split': 'train'} for i in range(num_indivs)]
+    val = [{'uniqueid': f"{i}-1", 'split': 'val'} for i in range(num_indivs) if i % 4 != 3]
+    test = [{'uniqueid': f"{i}-1", 'split': 'test'} for i in range(num_indivs) if i % 3 == 0]
+    return [train, val, test]
+
+
+def test_exhaustive_hierarchal_sample_matches_pinned_output():
+    """Seeded output of the vectorized sampler, pinned so changes to the draws show up."""
+    out = exhaustive_hierarchal_sample(_buckets(), targ_bucket_idx=2, bucket_distrib=[0.5, 0.25, 0.25], rng=np.random.default_rng(7))
+    assert [[indiv['uniqueid'] for indiv in bucket] for bucket in out] == [
+        ['0-1', '1-1', '5-1', '7-1', '8-1', '11-1'], 
+        ['2-1', '4-1', '10-1'], 
+        ['3-1', '6-1', '9-1'], 
+    ]
+
+
+def test_exhaustive_hierarchal_sample_assigns_everyone_once_to_an_eligible_bucket():
+    buckets = _buckets(num_indivs=3000)
+    distrib = [0.6, 0.25, 0.15]
+    out = exhaustive_hierarchal_sample(buckets, targ_bucket_idx=2, bucket_distrib=distrib, rng=np.random.default_rng(0))
+
+    assigned = [indiv['uniqueid'] for bucket in out for indiv in bucket]
+    assert sorted(assigned) == sorted(indiv['uniqueid'] for indiv in buckets[0])
+    for bucket, split in zip(out, ['train', 'val', 'test']):
+        assert all(indiv['split'] == split for indiv in bucket) # each bucket keeps its own maps
+        positions = [int(indiv['uniqueid'].split('-')[0]) for indiv in bucket]
+        assert positions == sorted(positions) # in their original order
+    assert len(out[2]) == int(distrib[2] * 3000)
+    # the rest is split over train and val by the renormalized distribution, among those with a val entry
+    val_eligible_rest = 3000 * 3 / 4 - len([indiv for indiv in out[2] if int(indiv['uniqueid'].split('-')[0]) % 4 != 3])
+    assert len(out[1]) / val_eligible_rest == pytest.approx(distrib[1] / (distrib[0] + distrib[1]), abs=0.04)
+
+
+def test_exhaustive_hierarchal_sample_is_reproducible_per_seed():
+    first = exhaustive_hierarchal_sample(_buckets(100), 1, [0.7, 0.2, 0.1], rng=np.random.default_rng(3))
+    again = exhaustive_hierarchal_sample(_buckets(100), 1, [0.7, 0.2, 0.1], rng=np.random.default_rng(3))
+    other = exhaustive_hierarchal_sample(_buckets(100), 1, [0.7, 0.2, 0.1], rng=np.random.default_rng(4))
+    assert first == again
+    assert first != other
+
+
+def test_exhaustive_hierarchal_sample_rejects_too_small_target_bucket():
+    with pytest.raises(ValueError):
+        exhaustive_hierarchal_sample(_buckets(), targ_bucket_idx=2, bucket_distrib=[0.2, 0.2, 0.6], rng=np.random.default_rng(0))
+
+
+TARGET_RATIOS = {'train': 0.7, 'val': 0.2, 'test': 0.1}
+
+
+def _sparse_strata(num_elements=10472, num_cells=9541, seed=0):
+    """Mostly one or two elements per cell, like the cross product of every demographic of a plan."""
+    return np.unique(np.random.default_rng(seed).integers(0, num_cells, num_elements), return_inverse=True)[1]
+
+
+@pytest.mark.parametrize('strata', [_sparse_strata(), np.random.default_rng(1).integers(0, 12, 10472)], ids=['sparse', 'dense'])
+def test_stratified_assign_meets_target_ratios(strata):
+    assignment = stratified_assign(strata, TARGET_RATIOS, rng=np.random.default_rng(2))
+    for split_idx, splt in enumerate(['train', 'val', 'test']):
+        assert np.mean(assignment == split_idx) == pytest.approx(TARGET_RATIOS[splt], abs=0.002)
+
+
+def test_stratified_assign_minimums_come_out_of_larger_cells():
+    """Small cells still get their minimum in val and test, the split sizes keep their ratios."""
+    rng = np.random.default_rng(3)
+    strata = np.concatenate([rng.integers(0, 100, 10000), np.arange(100, 140)]) # 100 big cells and 40 singletons
+    assignment = stratified_assign(strata, TARGET_RATIOS, min_cell_count=9, rng=np.random.default_rng(4))
+    for split_idx, splt in enumerate(['train', 'val', 'test']):
+        assert np.mean(assignment == split_idx) == pytest.approx(TARGET_RATIOS[splt], abs=0.002)
+    for split_idx in [1, 2]:
+        assert np.bincount(strata[assignment == split_idx], minlength=140)[:100].min() >= 9
+    assert (assignment[strata >= 100] == 1).all() # a singleton cell's one individual goes to val first
+
+
+def test_stratified_minimums_that_exceed_the_split_raise():
+    with pytest.raises(ValueError, match="min_cell_count"):
+        stratified_assign(_sparse_strata(), TARGET_RATIOS, min_cell_count=1, rng=np.random.default_rng(0))
+    with pytest.raises(ValueError, match="min_cell_count"):
+        stratified_choice(np.arange(500) % 200, size=154, min_cell_count=1, rng=np.random.default_rng(0))
+
+
+@pytest.mark.parametrize('min_cell_count', [0, 2])
+def test_stratified_choice_draws_exactly_size(min_cell_count):
+    strata = np.random.default_rng(5).integers(0, 60, 2000)
+    chosen = stratified_choice(strata, size=154, min_cell_count=min_cell_count, rng=np.random.default_rng(6))
+    assert len(chosen) == 154
+    assert (np.diff(chosen) > 0).all()
+    if min_cell_count:
+        assert np.bincount(strata[chosen], minlength=60).min() >= min_cell_count
+    assert len(stratified_choice(strata, size=5000, rng=np.random.default_rng(6))) == 2000
+
+
+def _reference_uid_hash(uid, seed, salt=''):
+    """Byte at a time FNV-1a then splitmix64, what the vectorized uid_hash computes per id."""
+    mask = 2**64 - 1
+    h = 0xCBF29CE484222325
+    for byte in f"{salt}{uid}".encode('utf-8'):
+        h = ((h ^ byte) * 0x100000001B3) & mask
+    h = (h + seed * 0x9E3779B97F4A7C15) & mask
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & mask
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & mask
+    return h ^ (h >> 31)
+
+
+def test_uid_hash_matches_reference_and_pinned_values():
+    uids = ['12411-20240819', '6333-20240819', '', 'é-2024']
+    assert [int(h) for h in uid_hash(uids, seed=42)] == [_reference_uid_hash(uid, seed=42) for uid in uids]
+    assert [int(h) for h in uid_hash(uids[:3], seed=42)] == [15004547145949149892, 8004631280791024048, 14072922164880071404]
+
+
+def test_uid_hash_only_depends_on_the_id_seed_and_salt():
+    """Neither the other ids (eg. a longer one widening the byte array) nor their order change an id's hash."""
+    uids = [f"{i}-20240819" for i in range(50)]
+    hashes = dict(zip(uids, uid_hash(uids, seed=3)))
+    shuffled = list(np.random.default_rng(0).permutation(uids)) + ['a much longer id than the rest-20240819']
+    assert all(hashes[uid] == h for uid, h in zip(shuffled[:-1], uid_hash(shuffled, seed=3)))
+    assert all(hashes[uid] == h for uid, h in zip(uids[::7], uid_hash(uids[::7], seed=3)))
+    assert not np.any(uid_hash(uids, seed=3) == uid_hash(uids, seed=4))
+    assert not np.any(uid_hash(uids, seed=3) == uid_hash(uids, seed=3, salt='val'))
+
+
+def test_uid_uniform_is_uniform_on_unit_interval():
+    draws = uid_uniform([f"{i}-1" for i in range(20_000)], seed=1)
+    assert draws.min() >= 0.0 and draws.max() < 1.0
+    assert np.allclose(np.histogram(draws, bins=10, range=(0, 1))[0] / len(draws), 0.1, atol=0.01)
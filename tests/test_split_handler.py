@@ -0,0 +1,288 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+from calyapo.configurations.config import DATA_PATHS
+from calyapo.configurations.data_map_config import TRAIN_PLANS, ALL_DATA_MAPS
+from calyapo.data_preprocessing.cleaning_objects import DataPackage
+from calyapo.data_preprocessing import split_handler
+from calyapo.data_preprocessing.funcs.ratioed import ValidityIndex
+from calyapo.data_preprocessing.split_handler import SplitHandler
+from calyapo.utils.persistence import JSONLRecords
+
+
+def test_split_on_questions_reloads_plan_columns_from_disk(igs_intermediate):
+    """Reading only the plan's columns gives the same indiv maps as reading whole waves."""
+    handler = SplitHandler('ideology_to_ideology', train_ratio=0.8, val_ratio=0.1, test_ratio=0.1)
+    projected = handler.split_on_questions(dataset_name='IGS', save=False)
+
+    handler._plan_columns = lambda dataset_name: None
+    full = handler.split_on_questions(dataset_name='IGS', save=False)
+
+    assert [indiv['uniqueid'] for indiv in projected['full']] == ['12411-20240819', '6333-20240819', '12897-20240819']
+    assert projected['full'] == full['full']
+
+
+def _synthetic_waves(dataset_name, rows=20, seed=0):
+    """A cleaned wave per time period of dataset_name with every mapped column: int ids, float survey codes and a text column."""
+    rng = np.random.default_rng(seed)
+    waves = {}
+    for time_period, maps in ALL_DATA_MAPS[dataset_name].items():
+        wave = {}
+        for var, label in maps['var2label'].items():
+            if label == 'dataset_id':
+                wave[var] = rng.permutation(10_000)[:rows]
+            else:
+                wave[var] = np.where(rng.random(rows) < 0.1, np.nan, rng.integers(1, 6, rows))
+        wave['comments'] = ['free text'] * rows
+        wave['time_period'] = [int(time_period)] * rows
+        waves[time_period] = pd.DataFrame(wave)
+    return waves
+
+
+@pytest.mark.parametrize('train_plan', [plan for plan, config in TRAIN_PLANS.items() if all(d in ALL_DATA_MAPS for d in config['datasets'])])
+def test_cached_rerun_matches_in_memory_split_on_questions(train_plan, tmp_path, monkeypatch):
+    """
+    A cached rerun skips raw_clean, so split_on_questions reloads the cleaned waves from disk (only the plan's columns). 
+    That has to give the same indiv maps as the first run, which gets the cleaned frames passed in memory.
+    """
+    handler = SplitHandler(train_plan, train_ratio=0.8, val_ratio=0.1, test_ratio=0.1, sort_files=True)
+    for dataset_name in TRAIN_PLANS[train_plan]['datasets']:
+        waves = _synthetic_waves(dataset_name)
+        interim_dir = tmp_path / dataset_name
+        interim_dir.mkdir()
+        for time_period, wave in waves.items():
+            wave.to_csv(interim_dir / f"{dataset_name}_cleaned_{time_period}.csv", index=False)
+        monkeypatch.setitem(DATA_PATHS[dataset_name], 'intermediate', interim_dir)
+
+        in_memory = DataPackage(dataset_name=dataset_name)
+        in_memory['data'] = [pd.read_csv(path) for path in sorted(interim_dir.glob("*.csv"))]
+        first_run = handler.split_on_questions(package=in_memory, save=False)
+        cached_rerun = handler.split_on_questions(dataset_name=dataset_name, save=False)
+
+        assert len(cached_rerun['full']) > 0
+        assert cached_rerun['full'] == first_run['full']
+
+
+def test_jsonl_split_on_questions_returns_streamed_records(igs_intermediate, tmp_path, monkeypatch):
+    """With jsonl persistence the fullpack is written as it's merged and handed back as lazy records, same maps as json."""
+    processed_dir = tmp_path / 'processed'
+    processed_dir.mkdir()
+    monkeypatch.setitem(DATA_PATHS['IGS'], 'processed', processed_dir)
+
+    in_memory = SplitHandler('ideology_to_ideology', train_ratio=0.8, val_ratio=0.1, test_ratio=0.1).split_on_questions(dataset_name='IGS', save=False)
+    handler = SplitHandler('ideology_to_ideology', train_ratio=0.8, val_ratio=0.1, test_ratio=0.1, persistence_format='jsonl')
+    streamed = handler.split_on_questions(dataset_name='IGS', save=True)
+
+    assert isinstance(streamed['full'], JSONLRecords)
+    assert (processed_dir / "ideology_to_ideology_IGS_fullpack_processed.jsonl").exists()
+    for split in ['full', 'train', 'val', 'test']:
+        assert list(streamed[split]) == in_memory[split]
+
+
+def test_split_on_ratio_reuses_fresh_validity_index(igs_intermediate, tmp_path, monkeypatch):
+    """A rerun on the same saved fullpack loads the validity index saved with the last fullsplit instead of rebuilding it."""
+    processed_dir = tmp_path / 'processed'
+    penult_dir = tmp_path / 'penultimate'
+    processed_dir.mkdir()
+    monkeypatch.setitem(DATA_PATHS['IGS'], 'processed', processed_dir)
+    monkeypatch.setattr(split_handler, 'UNIVERSAL_PENULTIMATE_FOLDER', penult_dir)
+
+    handler = SplitHandler('ideology_to_ideology', train_ratio=0.6, val_ratio=0.2, test_ratio=0.2)
+    handler.split_on_questions(dataset_name='IGS', save=True)
+    first = handler.split_on_ratio(dataset_name='IGS', save=True)
+    assert (penult_dir / "ideology_to_ideology_IGS_fullsplit.validity.npz").exists()
+
+    def no_rebuild(indiv_maps, *args, **kwargs):
+        raise AssertionError("validity index rebuilt for an unchanged fullpack")
+    monkeypatch.setattr(ValidityIndex, 'build', no_rebuild)
+    rerun = handler.split_on_ratio(dataset_name='IGS', save=True)
+    for split in ['train', 'val', 'test']:
+        assert rerun[split] == first[split]
+
+
+def _processed_package(handler, dataset_name, rows, seed=0):
+    in_memory = DataPackage(dataset_name=dataset_name)
+    in_memory['data'] = list(_synthetic_waves(dataset_name, rows=rows, seed=seed).values())
+    return handler.split_on_questions(package=in_memory, save=False)
+
+
+@pytest.mark.parametrize('min_cell_count', [0, 3])
+def test_stratified_split_on_ratio_keeps_target_ratios(min_cell_count):
+    """Train Setting 1, every individual lands in one split and the split sizes follow the ratios."""
+    ratios = {'train': 0.6, 'val': 0.25, 'test': 0.15}
+    handler = SplitHandler('ideology_to_ideology', train_ratio=ratios['train'], val_ratio=ratios['val'], test_ratio=ratios['test'], split_mode='stratified', stratify_on=['age'], min_cell_count=min_cell_count)
+    out_pack = handler.split_on_ratio(package=_processed_package(handler, 'IGS', rows=400), save=False)
+    num_indivs = sum(len(out_pack[splt]) for splt in ratios)
+    for splt, ratio in ratios.items():
+        assert abs(len(out_pack[splt]) - ratio * num_indivs) <= 1
+    if min_cell_count:
+        for splt in ['val', 'test']:
+            ages = [indiv_map['demog']['age'] for indiv_map in out_pack[splt]]
+            assert min(ages.count(age) for age in set(indiv_map['demog']['age'] for indiv_map in out_pack['train'])) >= min_cell_count
+
+
+def test_stratified_split_on_ratio_draws_setting_2_sizes_from_train():
+    """Train Setting 2, val and test are their ratio of the train size, the cell minimums don't push them past it."""
+    handler = SplitHandler('ideology_to_trump', train_ratio=0.7, val_ratio=0.2, test_ratio=0.1, split_mode='stratified', stratify_on=['age', 'partyid'], min_cell_count=25)
+    out_pack = handler.split_on_ratio(package=_processed_package(handler, 'IGS', rows=400), save=False)
+    assert len(out_pack['val']) == int(len(out_pack['train']) * 0.2)
+    assert len(out_pack['test']) == int(len(out_pack['train']) * 0.1)
+
+
+def test_stratified_split_mode_needs_explicit_plan_demographics():
+    with pytest.raises(ValueError, match="stratify_on"):
+        SplitHandler('ideology_to_ideology', train_ratio=0.8, val_ratio=0.1, test_ratio=0.1, split_mode='stratified')
+    with pytest.raises(ValueError, match="not demographics"):
+        SplitHandler('ideology_to_ideology', train_ratio=0.8, val_ratio=0.1, test_ratio=0.1, split_mode='stratified', stratify_on=['race'])
+
+
+class _WaveHandler:
+    """Stands in for RawHandler.clean_wave, hands back an already cleaned wave."""
+    def __init__(self, wave):
+        self.wave = wave
+
+    def clean_wave(self, dataset_name, time_period, save=False, debug=False, verbose=False):
+        raw_pack = DataPackage(dataset_name=dataset_name, time_period=time_period)
+        raw_pack['data'] = [self.wave]
+        return raw_pack
+
+
+@pytest.fixture
+def built_plan(tmp_path, monkeypatch):
+    """ideology_to_ideology run through the full pipeline on every IGS wave but the last, which is handed back for appending."""
+    waves = _synthetic_waves('IGS', rows=40)
+    new_time_period = list(waves)[-1]
+    dirs = {name: tmp_path / name for name in ['intermediate', 'processed', 'penultimate', 'final']}
+    for directory in dirs.values():
+        directory.mkdir()
+    for time_period, wave in waves.items():
+        if time_period != new_time_period:
+            wave.to_csv(dirs['intermediate'] / f"IGS_cleaned_{time_period}.csv", index=False)
+    monkeypatch.setitem(DATA_PATHS['IGS'], 'intermediate', dirs['intermediate'])
+    monkeypatch.setitem(DATA_PATHS['IGS'], 'processed', dirs['processed'])
+    monkeypatch.setattr(split_handler, 'UNIVERSAL_PENULTIMATE_FOLDER', dirs['penultimate'])
+    monkeypatch.setattr(split_handler, 'UNIVERSAL_FINAL_FOLDER', dirs['final'])
+
+    handler = SplitHandler('ideology_to_ideology', train_ratio=0.6, val_ratio=0.2, test_ratio=0.2, sort_files=True)
+    handler.split_on_questions(dataset_name='IGS', save=True)
+    handler.split_on_ratio(dataset_name='IGS', save=True)
+    handler.combine_datasets(package=handler.precombiner(save=True), save=True)
+    handler.subproportion_dataset(save=True)
+    return handler, new_time_period, _WaveHandler(waves[new_time_period]), tmp_path
+
+
+def _snapshot(root):
+    return {path.relative_to(root): path.read_bytes() for path in sorted(root.rglob('*')) if path.is_file()}
+
+
+def _wave_lines(final_dir, split, time_period):
+    with open(final_dir / f"ideology_to_ideology_{split}_meta.jsonl") as f:
+        return sum(json.loads(line)['time_period'] == time_period for line in f)
+
+
+def test_append_wave_extends_saved_outputs(built_plan):
+    """The new wave's individuals are appended after the existing ones, nobody already split moves."""
+    handler, time_period, raw_handler, root = built_plan
+    before = handler._load_package(root / 'penultimate' / "ideology_to_ideology_IGS_fullsplit.json")
+    handler.append_wave('IGS', time_period, raw_handler=raw_handler)
+
+    after = handler._load_package(root / 'penultimate' / "ideology_to_ideology_IGS_fullsplit.json")
+    fullpack = handler._load_package(root / 'processed' / "ideology_to_ideology_IGS_fullpack_processed.json")
+    assert sum(indiv_map['time'] == time_period for indiv_map in fullpack['full']) > 0
+    for split in ['train', 'val', 'test']:
+        assert after[split][:len(before[split])] == before[split]
+        assert all(indiv_map['time'] == time_period for indiv_map in after[split][len(before[split]):])
+    assert sum(_wave_lines(root / 'final', split, time_period) for split in ['train', 'val', 'test']) > 0
+    assert (root / 'processed' / f"ideology_to_ideology_IGS_{time_period}_processed.json").exists()
+
+
+def test_append_wave_rerun_is_skipped(built_plan):
+    handler, time_period, raw_handler, root = built_plan
+    handler.append_wave('IGS', time_period, raw_handler=raw_handler)
+    appended = _snapshot(root)
+    assert handler.append_wave('IGS', time_period, raw_handler=raw_handler) is None
+    assert _snapshot(root) == appended
+
+
+def test_append_wave_failure_before_writing_leaves_outputs_untouched(built_plan, monkeypatch):
+    handler, time_period, raw_handler, root = built_plan
+    built = _snapshot(root)
+
+    def failing_split(*args, **kwargs):
+        raise RuntimeError("split failed")
+    with monkeypatch.context() as patch:
+        patch.setattr(split_handler, 'hash_split_ratio', failing_split)
+        with pytest.raises(RuntimeError):
+            handler.append_wave('IGS', time_period, raw_handler=raw_handler)
+    assert _snapshot(root) == built
+
+    handler.append_wave('IGS', time_period, raw_handler=raw_handler)
+    assert _snapshot(root) != built
+
+
+def test_append_wave_retry_finishes_outputs_a_failure_missed(built_plan, monkeypatch):
+    """The fullpack and fullsplit are appended before the final jsonls fail, the retry only appends the jsonls."""
+    handler, time_period, raw_handler, root = built_plan
+    with monkeypatch.context() as patch:
+        patch.setattr(SplitHandler, '_append_final', lambda *args, **kwargs: (_ for _ in ()).throw(RuntimeError("compile failed")))
+        with pytest.raises(RuntimeError):
+            handler.append_wave('IGS', time_period, raw_handler=raw_handler)
+    fullpack_path = root / 'processed' / "ideology_to_ideology_IGS_fullpack_processed.json"
+    partial_fullpack = fullpack_path.read_bytes()
+    assert sum(_wave_lines(root / 'final', split, time_period) for split in ['train', 'val', 'test']) == 0
+
+    handler.append_wave('IGS', time_period, raw_handler=raw_handler)
+    assert fullpack_path.read_bytes() == partial_fullpack
+    fullpack = handler._load_package(fullpack_path)
+    uniqueids = [indiv_map['uniqueid'] for indiv_map in fullpack['full']]
+    assert len(uniqueids) == len(set(uniqueids))
+    fullsplit = handler._load_package(root / 'penultimate' / "ideology_to_ideology_IGS_fullsplit.json")
+    wave_uniqueids = [indiv_map['uniqueid'] for split in ['train', 'val', 'test'] for indiv_map in fullsplit[split] if indiv_map['time'] == time_period]
+    assert len(wave_uniqueids) > 0 and len(wave_uniqueids) == len(set(wave_uniqueids))
+    assert sum(_wave_lines(root / 'final', split, time_period) for split in ['train', 'val', 'test']) > 0
+
+
+def test_append_wave_rejects_train_setting_3(built_plan, monkeypatch):
+    handler, time_period, raw_handler, root = built_plan
+    monkeypatch.setattr(handler, 'train_setting', 3)
+    monkeypatch.setattr(handler, 'homogenous_plan', False)
+    built = _snapshot(root)
+    with pytest.raises(ValueError, match="Train Setting 3"):
+        handler.append_wave('IGS', time_period, raw_handler=raw_handler)
+    assert _snapshot(root) == built
+
+
+def _split_uniqueids(out_pack):
+    return {splt: sorted(indiv_map['uniqueid'] for indiv_map in out_pack[splt]) for splt in ['train', 'val', 'test']}
+
+
+def test_hash_split_on_ratio_ignores_row_order_and_other_individuals():
+    """Train Setting 1 hash splits are a function of uniqueid and seed, reordering or splitting a subset puts everyone in the same split."""
+    handler = SplitHandler('ideology_to_ideology', train_ratio=0.6, val_ratio=0.25, test_ratio=0.15, split_mode='hash')
+    package = _processed_package(handler, 'IGS', rows=300)
+    whole = _split_uniqueids(handler.split_on_ratio(package=package, save=False))
+
+    reordered = DataPackage(package.dataset_name, package.train_plan, package.time_period)
+    reordered['full'] = list(np.random.default_rng(5).permutation(package['full']))
+    assert _split_uniqueids(handler.split_on_ratio(package=reordered, save=False)) == whole
+
+    subset = DataPackage(package.dataset_name, package.train_plan, package.time_period)
+    subset['full'] = package['full'][::3]
+    kept = {indiv_map['uniqueid'] for indiv_map in subset['full']}
+    assert _split_uniqueids(handler.split_on_ratio(package=subset, save=False)) == {splt: [uid for uid in uids if uid in kept] for splt, uids in whole.items()}
+
+    num_indivs = sum(len(uids) for uids in whole.values())
+    assert abs(len(whole['train']) / num_indivs - 0.6) < 0.05
+    reseeded = SplitHandler('ideology_to_ideology', train_ratio=0.6, val_ratio=0.25, test_ratio=0.15, split_mode='hash', seed=7)
+    assert _split_uniqueids(reseeded.split_on_ratio(package=package, save=False)) != whole
+
+
+def test_hash_split_on_ratio_setting_2_sizes_follow_train():
+    handler = SplitHandler('ideology_to_trump', train_ratio=0.7, val_ratio=0.2, test_ratio=0.1, split_mode='hash')
+    out_pack = handler.split_on_ratio(package=_processed_package(handler, 'IGS', rows=400), save=False)
+    train_ids = {indiv_map['uniqueid'] for indiv_map in out_pack['train']}
+    for splt, ratio in [('val', 0.2), ('test', 0.1)]:
+        assert {indiv_map['uniqueid'] for indiv_map in out_pack[splt]} <= train_ids
+        assert abs(len(out_pack[splt]) - ratio * len(out_pack['train'])) < 4 * np.sqrt(ratio * len(out_pack['train']))
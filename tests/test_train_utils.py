@@ -0,0 +1,58 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from calyapo.training.utils.eval_utils import accuracy_counts, completion_accuracy_counts
+from calyapo.training.utils.train_utils import completion_forward
+
+
+@pytest.fixture
+def tiny_model():
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=64, 
+        hidden_size=16, 
+        intermediate_size=32, 
+        num_hidden_layers=1, 
+        num_attention_heads=2, 
+        num_key_value_heads=2, 
+        attn_implementation="eager"
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+def _batch():
+    """Two left padded rows, completions of 2 and 3 tokens."""
+    input_ids = torch.randint(3, 64, (2, 9), generator=torch.Generator().manual_seed(1))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, :2] = 0
+    labels = torch.full_like(input_ids, -100)
+    labels[0, 7:] = input_ids[0, 7:]
+    labels[1, 6:] = input_ids[1, 6:]
+    return {'input_ids': input_ids, 'attention_mask': attention_mask, 'labels': labels}
+
+
+def test_completion_forward_matches_the_full_forward(tiny_model):
+    batch = _batch()
+    full = tiny_model(**batch)
+    loss, logits, labels = completion_forward(tiny_model, batch)
+
+    mask = batch['labels'][..., 1:] != -100
+    assert logits.shape == (5, 64)
+    assert torch.allclose(logits, full.logits[..., :-1, :][mask], atol=1e-5)
+    assert torch.equal(labels, batch['labels'][..., 1:][mask])
+    assert torch.allclose(loss, full.loss, atol=1e-5)
+    assert [int(count) for count in completion_accuracy_counts(logits, labels)] == [int(count) for count in accuracy_counts(full.logits, batch['labels'])]
+
+
+def test_completion_forward_gradients_match_and_hook_is_removed(tiny_model):
+    batch = _batch()
+    tiny_model(**batch).loss.backward()
+    full_grads = [param.grad.clone() for param in tiny_model.parameters()]
+    tiny_model.zero_grad()
+    completion_forward(tiny_model, batch)[0].backward()
+
+    assert all(torch.allclose(full, param.grad, atol=1e-5) for full, param in zip(full_grads, tiny_model.parameters()))
+    assert not tiny_model.get_output_embeddings()._forward_pre_hooks
+    assert tiny_model(input_ids=batch['input_ids']).logits.shape == (2, 9, 64)